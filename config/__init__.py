@@ -1 +1,3 @@
-default_app_config = "core.apps.CoreConfig"
\ No newline at end of file
+from .celery import app as celery_app
+
+__all__ = ("celery_app",)
@@ -0,0 +1,23 @@
+"""
+Celery app for background work (core/tasks.py).
+
+Run a worker next to the web process:
+
+    CELERY_BROKER_URL=redis://localhost:6379/0 celery -A config worker -l info
+
+and one beat process for the periodic tasks (``CELERY_BEAT_SCHEDULE``):
+
+    CELERY_BROKER_URL=redis://localhost:6379/0 celery -A config beat -l info
+
+Without ``CELERY_BROKER_URL`` tasks run eagerly, inline in the calling
+process (dev, tests, one-off management commands).
+"""
+import os
+
+from celery import Celery
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+
+app = Celery("holograms")
+app.config_from_object("django.conf:settings", namespace="CELERY")
+app.autodiscover_tasks()
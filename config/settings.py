@@ -1,5 +1,6 @@
 from pathlib import Path
 import environ
+from celery.schedules import crontab
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -18,10 +19,12 @@ INSTALLED_APPS = [
     "django.contrib.humanize",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "rest_framework",
     "core",
 ]
 
 MIDDLEWARE = [
+    "core.profiling.ProfilingMiddleware",  # first, so it times everything; off unless PROFILING_ENABLED
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -54,6 +57,20 @@ DATABASES = {
     "default": env.db("DATABASE_URL", default=f"sqlite:///{BASE_DIR / 'db.sqlite3'}")
 }
 
+# Redis in docker-compose: CACHE_URL=redis://redis:6379/1
+CACHES = {
+    "default": env.cache("CACHE_URL", default="locmemcache://"),
+}
+CACHE_FRAGMENT_TIMEOUT = env.int("CACHE_FRAGMENT_TIMEOUT", default=300)  # core/caching.py
+
+# ---- read-only JSON API (core/api.py) ----
+REST_FRAMEWORK = {
+    "DEFAULT_RENDERER_CLASSES": ["rest_framework.renderers.JSONRenderer"],
+    "DEFAULT_PARSER_CLASSES": ["rest_framework.parsers.JSONParser"],
+    "DEFAULT_PERMISSION_CLASSES": ["rest_framework.permissions.AllowAny"],
+    "UNAUTHENTICATED_USER": None,
+}
+
 STATIC_URL = "/static/"
 STATICFILES_DIRS = [BASE_DIR / "static"]
 MEDIA_URL = "/media/"
@@ -65,4 +82,58 @@ LOGIN_REDIRECT_URL = "/ads/"
 LOGOUT_REDIRECT_URL = "/ads/"
 
 EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"  # dev only
-DEFAULT_FROM_EMAIL = "Holograms <no-reply@holograms.local>"
\ No newline at end of file
+DEFAULT_FROM_EMAIL = "Holograms <no-reply@holograms.local>"
+
+# ---- background tasks (config/celery.py, core/tasks.py) ----
+# Redis in docker-compose: CELERY_BROKER_URL=redis://redis:6379/0
+CELERY_BROKER_URL = env("CELERY_BROKER_URL", default="")
+CELERY_TASK_ALWAYS_EAGER = env.bool("CELERY_TASK_ALWAYS_EAGER", default=not CELERY_BROKER_URL)
+CELERY_TASK_EAGER_PROPAGATES = True
+CELERY_TASK_ACKS_LATE = True  # tasks are idempotent: redeliver if a worker dies mid-task
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_TASK_IGNORE_RESULT = True
+CELERY_SLOW_TASK_MS = env.int("CELERY_SLOW_TASK_MS", default=2000)
+# run by `celery -A config beat`; without a beat process, cron `manage.py roll_leaderboards` hourly instead
+CELERY_BEAT_SCHEDULE = {
+    "roll-leaderboards": {"task": "core.tasks.roll_leaderboards", "schedule": crontab(minute=0)},
+}
+
+ADMIN_BULK_INLINE_LIMIT = env.int("ADMIN_BULK_INLINE_LIMIT", default=5000)  # larger selections: BulkJob (core/bulk.py)
+
+# ---- leaderboards (core/leaderboards.py) ----
+# Redis sorted sets, e.g. redis://redis:6379/1; empty: the LeaderboardEntry table
+LEADERBOARD_REDIS_URL = env("LEADERBOARD_REDIS_URL", default="")
+
+# ---- profiling (core/profiling.py) ----
+PROFILING = {
+    "ENABLED": env.bool("PROFILING_ENABLED", default=False),
+    "SAMPLE_RATE": env.float("PROFILING_SAMPLE_RATE", default=1.0),
+    "SLOW_MS": env.int("PROFILING_SLOW_MS", default=500),
+    "SLOW_QUERIES": env.int("PROFILING_SLOW_QUERIES", default=50),
+    "DUPLICATES": env.int("PROFILING_DUPLICATES", default=5),
+    "SERVER_TIMING": True,
+}
+SLOW_REQUEST_LOG = Path(env("SLOW_REQUEST_LOG", default=str(BASE_DIR / "logs" / "slow_requests.log")))
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "bare": {"format": "%(message)s"},  # the middleware writes JSON lines
+    },
+    "handlers": {
+        "slow_requests": {
+            "class": "logging.handlers.RotatingFileHandler",
+            "filename": SLOW_REQUEST_LOG,
+            "maxBytes": 10 * 1024 * 1024,
+            "backupCount": 5,
+            "delay": True,  # no file until something is slow
+            "formatter": "bare",
+        },
+    },
+    "loggers": {
+        "holograms.slow_requests": {"handlers": ["slow_requests"], "level": "INFO", "propagate": False},
+    },
+}
+if PROFILING["ENABLED"]:
+    SLOW_REQUEST_LOG.parent.mkdir(parents=True, exist_ok=True)
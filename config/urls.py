@@ -1,26 +1,33 @@
 from django.contrib import admin
 from django.urls import path, include
-from core.api import health
-from core.views import ad_list, ad_detail, review_submit, signup, profile_edit, profile_public,brand_list, brand_detail, agency_list, agency_detail, search
+from core.api import health, suggest, v1 as api_v1
+from core.views import ad_list, ad_detail, review_submit, signup, feed, profile_edit, profile_public,brand_list, brand_detail, agency_list, agency_detail, person_list, person_detail, leaderboard, search
 
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/health/", health),
+    path("api/suggest/", suggest, name="suggest"),
+    path("api/v1/", include((api_v1.urls, "api-v1"))),
     path("ads/", ad_list, name="ad_list"),
     path("ads/<int:pk>/", ad_detail, name="ad_detail"),
     path("ads/<int:pk>/review/", review_submit, name="review_submit"),
     path("accounts/", include("django.contrib.auth.urls")),  # login/logout/etc.
     path("accounts/signup/", signup, name="signup"),
     path("accounts/profile/", profile_edit, name="profile_edit"),
+    path("feed/", feed, name="feed"),
     path("u/<str:username>/", profile_public, name="profile_public"),
     path("search/", search, name="search"),
+    path("top/", leaderboard, name="leaderboard"),
 
     path("brands/", brand_list, name="brand_list"),
     path("brands/<slug:slug>/", brand_detail, name="brand_detail"),
 
     path("agencies/", agency_list, name="agency_list"),
     path("agencies/<slug:slug>/", agency_detail, name="agency_detail"),
+
+    path("people/", person_list, name="person_list"),
+    path("people/<slug:slug>/", person_detail, name="person_detail"),
 ]
 
 from django.conf import settings
@@ -14,3 +14,13 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_wsgi_application()
+
+
+# Warm per-process in-memory indexes at worker start instead of on the first request.
+from django.db import DatabaseError  # noqa: E402
+from core.suggest import index as suggest_index  # noqa: E402
+
+try:
+    suggest_index.build()
+except DatabaseError:
+    pass  # e.g. not migrated yet; built lazily on first lookup
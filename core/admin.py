@@ -1,30 +1,85 @@
 from django.contrib import admin, messages
 from django import forms
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.urls import reverse
+from django.utils.html import format_html
 from django.utils.text import slugify
-from .models import Brand, Agency, Person, Ad, Review, UserProfile, Tag, Credit
+from django.utils.translation import gettext as _
+from .models import Brand, Agency, Person, Ad, Review, UserProfile, Tag, Credit, BulkJob
+from django.contrib.admin import helpers
 from django.contrib.admin.helpers import ActionForm
+from django.contrib.admin.options import IS_POPUP_VAR, TO_FIELD_VAR
+from . import bulk, tasks
+from .forms import AdAdminForm
+from .suggest import index as suggest_index
+
+
+class SuggestSearchMixin:
+    """Serve autocomplete widgets from the in-memory prefix index (core.suggest)."""
+    suggest_kind = None
+    suggest_limit = 50
+
+    def get_search_results(self, request, queryset, search_term):
+        if search_term and request.path.endswith("/autocomplete/"):
+            hits = suggest_index.lookup(search_term, limit=self.suggest_limit, kinds={self.suggest_kind})
+            return queryset.filter(pk__in=[h["id"] for h in hits]), False
+        return super().get_search_results(request, queryset, search_term)
+
+
+def find_by_name(model, value):
+    value = (value or "").strip()
+    return model.objects.filter(Q(name__iexact=value) | Q(slug=slugify(value))).first() if value else None
+
+
+class MergeActionForm(ActionForm):
+    merge_into = forms.CharField(required=False, help_text="Name of the record to keep (default: the oldest selected)")
+
+
+class MergeMixin:
+    """``merge_selected`` action: fold the selected duplicates into one record (core.bulk.merge)."""
+    action_form = MergeActionForm
+    actions = ["merge_selected"]
+
+    @admin.action(description="Merge selected into one (name it in the box, or the oldest is kept)")
+    def merge_selected(self, request, queryset):
+        records = list(queryset.order_by("pk"))
+        name = request.POST.get("merge_into")
+        target = find_by_name(self.model, name) if name else records[0]
+        if target is None:
+            self.message_user(request, f"No {self.model._meta.verbose_name} called “{name}”.", level=messages.ERROR)
+            return
+        if len(records) < 2 and target in records:
+            self.message_user(request, "Select at least two records to merge.", level=messages.WARNING)
+            return
+        moved = bulk.merge(self.model, target, records)
+        summary = ", ".join(f"{n} {what}" for what, n in moved.items())
+        self.message_user(request, f"Merged into “{target}”: {summary}.", level=messages.SUCCESS)
 
 
 @admin.register(Person)
-class PersonAdmin(admin.ModelAdmin):
+class PersonAdmin(MergeMixin, SuggestSearchMixin, admin.ModelAdmin):
+    suggest_kind = "person"
     list_display = ("name","website","created_at")
     search_fields = ("name",)
     prepopulated_fields = {"slug": ("name",)}
 
 @admin.register(Brand)
-class BrandAdmin(admin.ModelAdmin):
+class BrandAdmin(MergeMixin, SuggestSearchMixin, admin.ModelAdmin):
+    suggest_kind = "brand"
     list_display = ("name",)
     search_fields = ("name",)
     prepopulated_fields = {"slug": ("name",)}
 
 @admin.register(Agency)
-class AgencyAdmin(admin.ModelAdmin):
+class AgencyAdmin(MergeMixin, SuggestSearchMixin, admin.ModelAdmin):
+    suggest_kind = "agency"
     list_display = ("name","country","website","created_at")
     search_fields = ("name","country")
     prepopulated_fields = {"slug": ("name",)}
 
 @admin.register(Tag)
-class TagAdmin(admin.ModelAdmin):
+class TagAdmin(MergeMixin, admin.ModelAdmin):
     list_display = ("name",)
     search_fields = ("name",)
 
@@ -34,8 +89,15 @@ class CreditInline(admin.TabularInline):
     autocomplete_fields = ("person",)
     fields = ("person", "role", "company")
 
-class ApplyTagActionForm(ActionForm):
-    tag = forms.CharField(required=True, help_text="Type a tag name, e.g. ‘automotive’")
+class SaveRefused(Exception):
+    """Raised by AdAdmin.save_model when Ad.save() refuses the object; ``form`` carries the error."""
+    def __init__(self, form):
+        super().__init__(form)
+        self.form = form
+
+class BulkAdActionForm(ActionForm):
+    tag = forms.CharField(required=False, help_text="Tag name, for the tag actions, e.g. ‘automotive’")
+    owner = forms.CharField(required=False, label="Brand/agency", help_text="Name, for the reassign actions")
 
 @admin.register(Ad)
 class AdAdmin(admin.ModelAdmin):
@@ -45,22 +107,128 @@ class AdAdmin(admin.ModelAdmin):
     autocomplete_fields = ("brand","agency")
     inlines = [CreditInline]
     filter_horizontal = ("tags_m2m",)
-    actions = ["apply_tag"]
-    action_form = ApplyTagActionForm  # 👈 adds a text box to the actions bar
+    actions = ["apply_tag", "remove_tag", "reassign_brand", "reassign_agency"]
+    action_form = BulkAdActionForm  # 👈 adds the text boxes to the actions bar
+    form = AdAdminForm
+
+    def save_model(self, request, obj, form, change):
+        try:
+            super().save_model(request, obj, form, change)
+        except ValidationError as exc:
+            # the unique index caught a duplicate video; Ad.save() rolled back to its
+            # savepoint, so nothing is written yet: put the error on this form
+            form.add_error(None, exc)
+            raise SaveRefused(form) from exc
 
+    def _changeform_view(self, request, object_id, form_url, extra_context):
+        try:
+            return super()._changeform_view(request, object_id, form_url, extra_context)
+        except SaveRefused as refused:
+            return self._refused_form(request, refused.form, object_id, form_url, extra_context)
+
+    def _refused_form(self, request, form, object_id, form_url, extra_context):
+        """The change form again, as ModelAdmin shows an invalid one, with the error from save_model."""
+        add = object_id is None or "_saveasnew" in request.POST
+        obj = None if add else form.instance
+        formsets, inline_instances = self._create_formsets(request, form.instance, change=not add)
+        admin_form = helpers.AdminForm(
+            form, list(self.get_fieldsets(request, obj)), self.get_prepopulated_fields(request, obj),
+            self.get_readonly_fields(request, obj), model_admin=self,
+        )
+        inline_formsets = self.get_inline_formsets(request, formsets, inline_instances, obj)
+        media = self.media + admin_form.media
+        for inline_formset in inline_formsets:
+            media += inline_formset.media
+        context = {
+            **self.admin_site.each_context(request),
+            "title": (_("Add %s") if add else _("Change %s")) % self.opts.verbose_name,
+            "subtitle": None if add else str(obj),
+            "adminform": admin_form,
+            "object_id": object_id,
+            "original": obj,
+            "is_popup": IS_POPUP_VAR in request.POST or IS_POPUP_VAR in request.GET,
+            "to_field": request.POST.get(TO_FIELD_VAR, request.GET.get(TO_FIELD_VAR)),
+            "media": media,
+            "inline_admin_formsets": inline_formsets,
+            "errors": helpers.AdminErrorList(form, formsets),
+            "preserved_filters": self.get_preserved_filters(request),
+            **(extra_context or {}),
+        }
+        return self.render_change_form(request, context, add=add, change=not add, obj=obj, form_url=form_url)
+
+    def _bulk(self, request, queryset, action, done_message, **params):
+        """Run a core.bulk operation inline, or queue it as a BulkJob when the selection is large."""
+        # done_message(n, of): the report when run inline
+        ad_ids = list(queryset.order_by("pk").values_list("pk", flat=True))
+        if len(ad_ids) > bulk.inline_limit():
+            job = bulk.queue(action, ad_ids, user=request.user, **params)
+            link = reverse("admin:core_bulkjob_change", args=[job.pk])
+            self.message_user(request, format_html(
+                "{} ads queued as <a href=\"{}\">bulk job #{}</a>; progress is shown there.", len(ad_ids), link, job.pk))
+            return
+        n = bulk.OPERATIONS[action](ad_ids, **params)
+        self.message_user(request, done_message(n, len(ad_ids)), level=messages.SUCCESS)
+
+    @admin.action(description="Apply tag (enter name in box, then run)")
     def apply_tag(self, request, queryset):
         tag_name = (request.POST.get("tag") or "").strip()
         if not tag_name:
             messages.error(request, "Please type a tag name before running the action.")
             return
         tag, _ = Tag.objects.get_or_create(slug=slugify(tag_name), defaults={"name": tag_name})
-        updated = 0
-        for ad in queryset:
-            ad.tags_m2m.add(tag)
-            updated += 1
-        self.message_user(request, f"Applied tag “{tag.name}” to {updated} ad(s).", level=messages.SUCCESS)
+        self._bulk(request, queryset, "apply_tag",
+                   lambda n, of: f"Applied tag “{tag.name}” to {n} of {of} ad(s).", tag_id=tag.pk)
+
+    @admin.action(description="Remove tag (enter name in box, then run)")
+    def remove_tag(self, request, queryset):
+        tag = find_by_name(Tag, request.POST.get("tag"))
+        if tag is None:
+            messages.error(request, "Please type the name of an existing tag.")
+            return
+        self._bulk(request, queryset, "remove_tag",
+                   lambda n, of: f"Removed tag “{tag.name}” from {n} ad(s).", tag_id=tag.pk)
+
+    @admin.action(description="Move to brand (enter name in box, then run)")
+    def reassign_brand(self, request, queryset):
+        brand = find_by_name(Brand, request.POST.get("owner"))
+        if brand is None:
+            messages.error(request, "Please type the name of an existing brand.")
+            return
+        self._bulk(request, queryset, "reassign",
+                   lambda n, of: f"Moved {n} ad(s) to “{brand.name}”.", brand_id=brand.pk)
+
+    @admin.action(description="Move to agency (enter name in box, then run)")
+    def reassign_agency(self, request, queryset):
+        agency = find_by_name(Agency, request.POST.get("owner"))
+        if agency is None:
+            messages.error(request, "Please type the name of an existing agency.")
+            return
+        self._bulk(request, queryset, "reassign",
+                   lambda n, of: f"Moved {n} ad(s) to “{agency.name}”.", agency_id=agency.pk)
+
+
+@admin.register(BulkJob)
+class BulkJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "action", "status", "progress", "created_by", "created_at", "finished_at")
+    list_filter = ("status", "action")
+    readonly_fields = ("action", "status", "progress", "error", "created_by", "created_at", "finished_at")
+    exclude = ("params", "total", "done")
+    actions = ["requeue"]
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.display(description="Progress")
+    def progress(self, job):
+        return f"{job.done}/{job.total} ({job.percent}%)"
 
-    apply_tag.short_description = "Apply tag (enter name in box, then run)"
+    @admin.action(description="Run again (resumes where it stopped)")
+    def requeue(self, request, queryset):
+        jobs = list(queryset.exclude(status="done").values_list("pk", flat=True))
+        BulkJob.objects.filter(pk__in=jobs).update(status="queued", error="")
+        for pk in jobs:
+            tasks.run_bulk_job.delay_on_commit(pk)
+        self.message_user(request, f"Requeued {len(jobs)} job(s).")
 
 @admin.register(Review)
 class ReviewAdmin(admin.ModelAdmin):
@@ -1,4 +1,204 @@
+from django.db.models import Q
 from django.http import JsonResponse
+from rest_framework import routers, serializers, viewsets
+from rest_framework.decorators import action
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .models import Ad, Agency, Brand, Credit, Person, Review
+from .pagination import CursorPaginator
+from .serializers import (AdSerializer, AgencySerializer, BrandSerializer, CreditSerializer,
+                          PersonSerializer, ReviewSerializer, parse_tree)
+from .suggest import SOURCES, index as suggest_index
+from .utils import extract_youtube_ids
 
 def health(_):
-    return JsonResponse({"status": "ok"})
\ No newline at end of file
+    return JsonResponse({"status": "ok"})
+
+def suggest(request):
+    """GET /api/suggest/?q=<prefix>[&type=ad,brand][&limit=10] -> prefix matches by name."""
+    q = (request.GET.get("q") or "").strip()
+    kinds = {k for k in (request.GET.get("type") or "").split(",") if k in SOURCES} or None
+    try:
+        limit = min(max(int(request.GET.get("limit", 10)), 1), 50)
+    except ValueError:
+        limit = 10
+    return JsonResponse({"q": q, "results": suggest_index.lookup(q, limit=limit, kinds=kinds)})
+
+
+# ---- /api/v1/: read-only resources ------------------------------------------------
+#
+#   GET /api/v1/<resource>/[?fields=..&include=..&cursor=..&page_size=..]
+#   GET /api/v1/<resource>/<id or slug>/
+#   GET|POST /api/v1/ads/batch/   ids / youtube_ids, up to BATCH_LIMIT per call
+#
+# Pages are keyset cursors (core.pagination), so there is no COUNT(*) and deep
+# pages cost the same as the first. See core/serializers.py for fields/include.
+
+BATCH_LIMIT = 200
+
+
+def _digits(value) -> bool:
+    # str.isdigit() alone accepts "²" and other digits int() refuses
+    return value.isascii() and value.isdigit()
+
+
+class KeysetPagination(BasePagination):
+    page_size = 50
+    max_page_size = 200
+
+    def paginate_queryset(self, queryset, request, view=None):
+        try:
+            size = min(max(int(request.query_params.get("page_size", self.page_size)), 1), self.max_page_size)
+        except ValueError:
+            size = self.page_size
+        self.request = request
+        self.page = CursorPaginator(queryset, size).get_page(request.query_params.get("cursor"))
+        return self.page.object_list
+
+    def _link(self, token):
+        if not token:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), "cursor", token)
+
+    def get_paginated_response(self, data):
+        return Response({
+            "next": self._link(self.page.next_cursor),
+            "previous": self._link(self.page.previous_cursor),
+            "results": data,
+        })
+
+
+class ReadViewSet(viewsets.ReadOnlyModelViewSet):
+    """Parses ?fields= / ?include= once and hands them to the queryset and the serializer."""
+    pagination_class = KeysetPagination
+    authentication_classes = ()  # public, anonymous data only
+    ordering = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.fields_tree = parse_tree(request.query_params.get("fields"))
+        self.include_tree = parse_tree(request.query_params.get("include")) or {}
+        self.serializer_class.check_params(self.fields_tree, self.include_tree)
+
+    def get_queryset(self):
+        qs = self.serializer_class.optimise(self.queryset.all(), self.fields_tree, self.include_tree)
+        return qs.order_by(*self.ordering) if self.ordering else qs
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault("fields", self.fields_tree)
+        kwargs.setdefault("include", self.include_tree)
+        return super().get_serializer(*args, **kwargs)
+
+
+class AdViewSet(ReadViewSet):
+    queryset = Ad.objects.defer("search_vector")
+    serializer_class = AdSerializer
+    ordering = ("-year", "title")  # Ad(-year, title) index
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        params = self.request.query_params
+        if params.get("brand"):
+            qs = qs.filter(brand__slug=params["brand"])
+        if params.get("agency"):
+            qs = qs.filter(agency__slug=params["agency"])
+        if params.get("tag"):
+            qs = qs.filter(tags_m2m__slug=params["tag"])
+        if _digits(params.get("year", "")):
+            qs = qs.filter(year=int(params["year"]))
+        return qs
+
+    @action(detail=False, methods=["get", "post"], pagination_class=None)
+    def batch(self, request):
+        """Many ads in one call, in the order asked for: ``ids`` and/or ``youtube_ids`` (URLs are fine)."""
+        source = request.data if request.method == "POST" else request.query_params
+
+        def values(key):
+            raw = source.get(key) or []
+            if not isinstance(raw, (str, list)):
+                raise serializers.ValidationError({key: "Expected a list or a comma-separated string."})
+            items = raw.split(",") if isinstance(raw, str) else raw
+            return [str(v).strip() for v in items if str(v).strip()]
+
+        ids, youtube_ids = values("ids"), values("youtube_ids")
+        if len(ids) + len(youtube_ids) > BATCH_LIMIT:
+            raise serializers.ValidationError({"detail": f"At most {BATCH_LIMIT} ids per batch."})
+        bad = [v for v in ids if not _digits(v)]
+        if bad:
+            raise serializers.ValidationError({"ids": [f"Not an id: {v}" for v in bad]})
+        normalised = dict(zip(youtube_ids, extract_youtube_ids(youtube_ids)))
+
+        ads = self.get_queryset().filter(
+            Q(pk__in=[int(v) for v in ids]) | Q(youtube_id__in=[v for v in normalised.values() if v]))
+        by_pk = {ad.pk: ad for ad in ads}
+        by_youtube_id = {ad.youtube_id: ad for ad in by_pk.values()}
+
+        found, seen = [], set()
+        missing = {"ids": [], "youtube_ids": []}
+        for key, lookup in [("ids", v) for v in ids] + [("youtube_ids", v) for v in youtube_ids]:
+            ad = by_pk.get(int(lookup)) if key == "ids" else by_youtube_id.get(normalised[lookup])
+            if ad is None:
+                missing[key].append(lookup)
+            elif ad.pk not in seen:
+                seen.add(ad.pk)
+                found.append(ad)
+        return Response({"results": self.get_serializer(found, many=True).data, "missing": missing})
+
+
+class BrandViewSet(ReadViewSet):
+    queryset = Brand.objects.all()
+    serializer_class = BrandSerializer
+    lookup_field = "slug"
+    ordering = ("name",)
+
+
+class AgencyViewSet(BrandViewSet):
+    queryset = Agency.objects.all()
+    serializer_class = AgencySerializer
+
+
+class PersonViewSet(BrandViewSet):
+    queryset = Person.objects.all()
+    serializer_class = PersonSerializer
+
+
+class CreditViewSet(ReadViewSet):
+    queryset = Credit.objects.all()
+    serializer_class = CreditSerializer
+    ordering = ("id",)
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        params = self.request.query_params
+        if _digits(params.get("ad", "")):
+            qs = qs.filter(ad_id=int(params["ad"]))
+        if params.get("person"):
+            qs = qs.filter(person__slug=params["person"])
+        return qs
+
+
+class ReviewViewSet(ReadViewSet):
+    queryset = Review.objects.all()
+    serializer_class = ReviewSerializer
+
+    def get_queryset(self):
+        qs = unfiltered = super().get_queryset()
+        params = self.request.query_params
+        if _digits(params.get("ad", "")):
+            qs = qs.filter(ad_id=int(params["ad"]))
+        if params.get("user"):
+            qs = qs.filter(user__username=params["user"])
+        if qs is unfiltered:
+            return qs.order_by("-id")  # no index covers created_at across every review
+        return qs.order_by("-created_at", "id")  # Review(ad|user, -created_at, id) indexes
+
+
+v1 = routers.DefaultRouter()
+v1.register("ads", AdViewSet, basename="ad")
+v1.register("brands", BrandViewSet, basename="brand")
+v1.register("agencies", AgencyViewSet, basename="agency")
+v1.register("people", PersonViewSet, basename="person")
+v1.register("credits", CreditViewSet, basename="credit")
+v1.register("reviews", ReviewViewSet, basename="review")
@@ -0,0 +1,198 @@
+# core/bulk.py
+"""
+Set-based bulk operations behind the admin actions.
+
+Each operation works through the selected ad ids in chunks of ``CHUNK``. A
+chunk is one transaction of a few statements, however many ads it holds:
+``bulk_create(ignore_conflicts=True)`` on the tag through-table, one
+``DELETE`` or one ``UPDATE``. Chunks can be re-run safely, which makes a
+failed job resumable. ``update()`` and ``bulk_create`` skip model signals,
+so ``_ads_changed`` does their work for the chunk: it stamps ``updated_at``,
+queues a search reindex and bumps the page cache.
+
+Selections larger than ``settings.ADMIN_BULK_INLINE_LIMIT`` become a
+``BulkJob`` instead. ``tasks.run_bulk_job`` works through it and records
+progress after every chunk.
+
+``merge`` folds duplicate brands, agencies, people or tags into one record:
+every reference is repointed with one ``UPDATE`` per relation, then the
+duplicates are deleted. Tag facet counts (core.facets) and collaborations
+(core.collaborations) follow every change.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from . import caching, collaborations, facets, tasks
+from .counters import refresh_owner_totals
+from .freshness import touch, touch_reviewers
+from .models import Ad, Agency, Brand, BulkJob, Credit, Person, Tag
+
+CHUNK = 2000
+Through = Ad.tags_m2m.through
+
+
+def inline_limit():
+    return getattr(settings, "ADMIN_BULK_INLINE_LIMIT", 5000)
+
+
+def chunked(ids, size=CHUNK):
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def _ads_changed(ad_ids, *models, stamp=True):
+    """What the model signals would have done for ``ad_ids``."""
+    if not ad_ids:
+        return
+    if stamp:
+        touch(Ad, pk__in=ad_ids)
+    tasks.reindex_ads.delay_on_commit(list(ad_ids))
+    caching.bump(*{ns for m in models for ns in caching.INVALIDATES[m.__name__]})
+
+
+def _run(ad_ids, step, progress=None):
+    """``step(chunk)`` per chunk in its own transaction; returns the summed results."""
+    total = 0
+    for n, chunk in enumerate(chunked(list(ad_ids)), 1):
+        with transaction.atomic():
+            total += step(chunk)
+        if progress:
+            progress(min(n * CHUNK, len(ad_ids)))
+    return total
+
+
+# ---- ads ---------------------------------------------------------------------------
+
+def apply_tag(ad_ids, tag_id, progress=None) -> int:
+    """Tag every ad in ``ad_ids``; returns how many were not tagged yet."""
+    def step(chunk):
+        tagged = set(Through.objects.filter(tag_id=tag_id, ad_id__in=chunk).values_list("ad_id", flat=True))
+        new = [ad_id for ad_id in chunk if ad_id not in tagged]
+        Through.objects.bulk_create([Through(ad_id=a, tag_id=tag_id) for a in new], ignore_conflicts=True)
+        facets.apply(facets.count((a, tag_id) for a in new))
+        _ads_changed(new, Tag)
+        return len(new)
+    return _run(ad_ids, step, progress)
+
+
+def remove_tag(ad_ids, tag_id, progress=None) -> int:
+    def step(chunk):
+        links = Through.objects.filter(tag_id=tag_id, ad_id__in=chunk)
+        untagged = list(links.values_list("ad_id", flat=True))
+        links.delete()  # one DELETE: the through-table has no signals or cascades
+        facets.apply(facets.count(((a, tag_id) for a in untagged), -1))
+        _ads_changed(untagged, Tag)
+        return len(untagged)
+    return _run(ad_ids, step, progress)
+
+
+def reassign(ad_ids, progress=None, **owner) -> int:
+    """Move ads to another brand and/or agency: ``brand_id=..``, ``agency_id=..`` (None clears the agency)."""
+    unknown = set(owner) - {"brand_id", "agency_id"}
+    if unknown or not owner:
+        raise ValueError(f"reassign takes brand_id and/or agency_id, not {sorted(unknown)}")
+
+    def step(chunk):
+        before = set(Ad.objects.filter(pk__in=chunk).values_list("brand_id", "agency_id"))
+        moved = Ad.objects.filter(pk__in=chunk).update(**owner, updated_at=timezone.now())
+        old_brands, old_agencies = zip(*before) if before else ((), ())
+        if "brand_id" in owner:
+            refresh_owner_totals(Brand, {owner["brand_id"], *old_brands})
+            touch_reviewers(pk__in=chunk)
+        if "agency_id" in owner:
+            refresh_owner_totals(Agency, {owner["agency_id"], *old_agencies})
+        _ads_changed(chunk, Ad, stamp=False)  # stamped by the update
+        return moved
+    return _run(ad_ids, step, progress)
+
+
+# ---- background jobs ---------------------------------------------------------------
+
+OPERATIONS = {"apply_tag": apply_tag, "remove_tag": remove_tag, "reassign": reassign}
+
+
+def queue(action, ad_ids, user=None, **kwargs) -> BulkJob:
+    job = BulkJob.objects.create(action=action, params={"ad_ids": list(ad_ids), **kwargs},
+                                 total=len(ad_ids), created_by=user)
+    tasks.run_bulk_job.delay_on_commit(job.pk)
+    return job
+
+
+def run_job(job_id):
+    """Carry out a queued ``BulkJob``, resuming after the last chunk it completed."""
+    job = BulkJob.objects.filter(pk=job_id).exclude(status="done").first()
+    if job is None:
+        return
+    BulkJob.objects.filter(pk=job.pk).update(status="running")
+    params = dict(job.params)
+    ad_ids = params.pop("ad_ids")[job.done:]
+    done_before = job.done
+
+    def progress(done):
+        BulkJob.objects.filter(pk=job.pk).update(done=done_before + done)
+
+    try:
+        OPERATIONS[job.action](ad_ids, progress=progress, **params)
+    except Exception as exc:
+        BulkJob.objects.filter(pk=job.pk).update(status="failed", error=repr(exc))
+        raise
+    BulkJob.objects.filter(pk=job.pk).update(status="done", error="", finished_at=timezone.now())
+
+
+# ---- merging duplicates ------------------------------------------------------------------
+
+def _repoint(model, field, target_id, dup_ids, unique_with=()):
+    """
+    ``UPDATE model SET field = target WHERE field IN dups``. Rows that would then
+    break a unique constraint over (field, *unique_with) are deleted first: those
+    duplicating a row of the target, or an earlier row of another duplicate.
+    """
+    rows = model.objects.filter(**{f"{field}__in": dup_ids})
+    if unique_with:
+        same = {f: OuterRef(f) for f in unique_with}
+        clash = (Exists(model.objects.filter(**{field: target_id}, **same))
+                 | Exists(model.objects.filter(**{f"{field}__in": dup_ids}, pk__lt=OuterRef("pk"), **same)))
+        model.objects.filter(pk__in=list(rows.filter(clash).values_list("pk", flat=True))).delete()
+    return rows.update(**{field: target_id})
+
+
+def merge(model, target, duplicates) -> dict[str, int]:
+    """Fold ``duplicates`` (instances of Brand, Agency, Person or Tag) into ``target``."""
+    dup_ids = [d.pk for d in duplicates if d.pk != target.pk]
+    if not dup_ids:
+        return {}
+    moved = {}
+    with transaction.atomic():
+        if model is Brand:
+            ad_ids = list(Ad.objects.filter(brand__in=dup_ids).values_list("pk", flat=True))
+            moved["ads"] = _repoint(Ad, "brand", target.pk, dup_ids)
+        elif model is Agency:
+            ad_ids = list(Ad.objects.filter(agency__in=dup_ids).values_list("pk", flat=True))
+            ad_ids += Credit.objects.filter(company__in=dup_ids).values_list("ad_id", flat=True)
+            moved["ads"] = _repoint(Ad, "agency", target.pk, dup_ids)
+            moved["credits"] = _repoint(Credit, "company", target.pk, dup_ids)
+        elif model is Person:
+            ad_ids = list(Credit.objects.filter(person__in=dup_ids).values_list("ad_id", flat=True))
+            moved["credits"] = _repoint(Credit, "person", target.pk, dup_ids, unique_with=("ad", "role"))
+        elif model is Tag:
+            ad_ids = list(Through.objects.filter(tag__in=dup_ids).values_list("ad_id", flat=True))
+            moved["ads"] = _repoint(Through, "tag", target.pk, dup_ids, unique_with=("ad",))
+        else:
+            raise ValueError(f"Cannot merge {model.__name__} records")
+
+        ad_ids = sorted(set(ad_ids))
+        touch(Ad, pk__in=ad_ids)  # the new name shows on every one of these pages
+        if model is Brand:
+            touch_reviewers(pk__in=ad_ids)
+        moved["deleted"] = model.objects.filter(pk__in=dup_ids).delete()[1].get(model._meta.label, 0)
+        if model in (Brand, Agency):
+            refresh_owner_totals(model, [target.pk])
+        elif model is Tag:
+            facets.rebuild([target.pk])  # the duplicates' facets went with them
+        elif model is Person:
+            collaborations.refresh(target.pk)  # and so did their collaborations
+        tasks.reindex_ads.delay_on_commit(ad_ids)
+        caching.bump_all()
+    return moved
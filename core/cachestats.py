@@ -0,0 +1,40 @@
+# core/cachestats.py
+"""
+Named counters kept in the Django cache, so they add up across every worker.
+
+``CacheStats(prefix, counters)`` counts ``counters`` per name (a fragment, a
+task, ...) under ``<prefix>:<name>:<counter>``; the names seen so far are
+listed under ``<prefix>:names``. Used by core.caching (fragment hits and
+misses) and core.tasks (runs, failures, run times).
+"""
+from django.core.cache import cache
+
+
+class CacheStats:
+    def __init__(self, prefix, counters):
+        self.prefix, self.counters = prefix, tuple(counters)
+
+    def key(self, name, counter):
+        return f"{self.prefix}:{name}:{counter}"
+
+    def incr(self, name, counter, by=1):
+        key = self.key(name, counter)
+        try:
+            cache.incr(key, by)
+        except ValueError:
+            # first count since the cache was started or cleared: (re)list the name
+            if not cache.add(key, by, None):
+                cache.incr(key, by)
+            names = cache.get(f"{self.prefix}:names") or set()
+            if name not in names:
+                cache.set(f"{self.prefix}:names", names | {name}, None)
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        names = sorted(cache.get(f"{self.prefix}:names") or ())
+        found = cache.get_many([self.key(n, c) for n in names for c in self.counters])
+        return {n: {c: found.get(self.key(n, c), 0) for c in self.counters} for n in names}
+
+    def reset(self):
+        names = cache.get(f"{self.prefix}:names") or ()
+        cache.delete_many([self.key(n, c) for n in names for c in self.counters])
+        cache.delete(f"{self.prefix}:names")
@@ -0,0 +1,158 @@
+# core/caching.py
+"""
+Versioned fragment cache for the public listing pages.
+
+Each cached fragment depends on one or more *namespaces* ("ads", "brands",
+...). Every namespace has a version number in the cache; the versions are part
+of the fragment key, so invalidating is a single ``incr`` (``bump``) and stale
+fragments simply stop being read and age out. signals.py bumps namespaces on
+model changes (see ``INVALIDATES``); bulk writers that skip signals, such as
+the CSV importer, call ``bump`` themselves.
+
+``get_or_build`` guards against stampedes: on a miss one process takes a short
+lock and rebuilds while the others wait for its result (up to
+``CACHE_LOCK_WAIT`` seconds) rather than all hitting the database at once.
+
+Hits and misses are counted per fragment name in the cache itself so the
+numbers cover every worker; ``manage.py cache_stats`` prints them.
+
+Works with any Django cache backend: Redis in docker-compose (``CACHE_URL``),
+local memory by default and in tests.
+"""
+import copy
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import QueryDict
+from django.template.loader import render_to_string
+
+from .cachestats import CacheStats
+
+NAMESPACES = ("ads", "brands", "agencies", "tags")
+
+# model name -> namespaces whose pages show its data (directly or via counters)
+INVALIDATES = {
+    "Ad": ("ads", "brands", "agencies"),          # listings, num_ads
+    "Review": ("ads", "brands", "agencies"),      # avg ratings everywhere
+    "Brand": ("brands", "ads"),                   # brand names on ad cards
+    "Agency": ("agencies", "ads"),
+    "Tag": ("tags", "ads"),                       # tag chips on ad cards
+}
+
+STATS_PREFIX = "cachestats"
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+# ---- versions ------------------------------------------------------------------
+
+def _version_key(ns):
+    return f"cachever:{ns}"
+
+
+def versions(namespaces) -> str:
+    keys = [_version_key(ns) for ns in namespaces]
+    found = cache.get_many(keys)
+    missing = {k: time.time_ns() for k in keys if k not in found}
+    if missing:
+        # a fresh, time-based start so an evicted counter can't reuse old keys
+        for k, v in missing.items():
+            cache.add(k, v, None)
+        found.update(cache.get_many(list(missing)))
+    return ".".join(str(found.get(k, 0)) for k in keys)
+
+
+def bump(*namespaces):
+    """Invalidate every fragment depending on ``namespaces`` (after commit)."""
+    def _bump():
+        for ns in namespaces:
+            try:
+                cache.incr(_version_key(ns))
+            except ValueError:  # not set yet (or evicted)
+                cache.set(_version_key(ns), time.time_ns(), None)
+    transaction.on_commit(_bump)
+
+
+def bump_all():
+    bump(*NAMESPACES)
+
+
+# ---- fragments -----------------------------------------------------------------
+
+def fragment_key(name, vary, params, namespaces) -> str:
+    """``name`` + a digest of ``vary`` and the query parameters (a QueryDict) + the namespace versions."""
+    raw = repr((tuple(vary), sorted(params.lists())))
+    digest = hashlib.md5(raw.encode(), usedforsecurity=False).hexdigest()[:16]
+    return f"frag:{name}:{digest}:{versions(namespaces)}"
+
+
+def get_or_build(name, key, build, timeout=None):
+    timeout = _setting("CACHE_FRAGMENT_TIMEOUT", 300) if timeout is None else timeout
+    value = cache.get(key)
+    if value is not None:
+        _count(name, "hit")
+        return value
+
+    lock = f"{key}:lock"
+    if cache.add(lock, 1, _setting("CACHE_LOCK_TIMEOUT", 30)):
+        try:
+            value = build()
+            cache.set(key, value, timeout)
+        finally:
+            cache.delete(lock)
+        _count(name, "miss")
+        return value
+
+    # someone else is building this fragment: wait for it
+    deadline = time.monotonic() + _setting("CACHE_LOCK_WAIT", 2.0)
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        value = cache.get(key)
+        if value is not None:
+            _count(name, "wait")
+            return value
+    _count(name, "miss")
+    return build()  # the builder died or is very slow; don't pile onto its lock
+
+
+def cached_fragment(request, name, namespaces, template, context, *, vary=(), params=(), timeout=None):
+    """
+    Render ``template`` with ``context(request)`` once per (name, vary,
+    ``params``, namespace versions). Only the query parameters named in
+    ``params`` are part of the key, so ``?utm_source=...`` and the like can't
+    fill the cache; ``context`` gets a copy of the request whose ``GET`` holds
+    just those, so pagination links match the key too. ``context`` is only
+    called on a miss, so the queries it runs are skipped on a hit. Fragments
+    are rendered without the request: they must not depend on who is looking.
+    """
+    query = QueryDict(mutable=True)
+    for param in params:
+        if param in request.GET:
+            query.setlist(param, request.GET.getlist(param))
+    query._mutable = False
+    key = fragment_key(name, vary, query, namespaces)
+
+    def build():
+        narrowed = copy.copy(request)
+        narrowed.GET = query
+        return render_to_string(template, context(narrowed))
+    return get_or_build(name, key, build, timeout)
+
+
+# ---- stats ---------------------------------------------------------------------
+
+_stats = CacheStats(STATS_PREFIX, ("hit", "wait", "miss"))
+_count = _stats.incr
+
+
+def stats() -> dict[str, dict[str, int]]:
+    return _stats.stats()
+
+
+def reset_stats():
+    _stats.reset()
@@ -0,0 +1,90 @@
+# core/collaborations.py
+"""
+Who worked with whom: the ``Collaboration`` table.
+
+One row per ordered pair of people credited on the same ads, with the number
+of ads they share and the latest year among them. A person's frequent
+collaborators are then one range of the ``(person, -shared_ads)`` index
+instead of a self-join over ``Credit`` on every page view.
+
+signals.py keeps it current. A new credit adds one shared ad to the pairs of
+that ad with F() increments (``credit_added``); a person counts once per ad
+however many roles they have on it. Anything that can lower a count -- a
+deleted or moved credit, a changed ad year, merged people -- recomputes the
+pairs involved with ``refresh``, which reads only the credits of one person.
+That stays exact when several credits of one ad go in a single delete.
+``rebuild`` recomputes everything (``rebuild_collaborations`` command).
+"""
+from django.db import transaction
+from django.db.models import Count, F, Max, Q, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Ad, Collaboration, Credit
+
+
+def people_on(ad_id, exclude=None) -> set[int]:
+    return set(Credit.objects.filter(ad_id=ad_id).exclude(person_id=exclude).values_list("person_id", flat=True))
+
+
+def _pairs(person_id, others):
+    """Both directions of ``person_id`` with each of ``others``."""
+    return Q(person_id=person_id, other_id__in=others) | Q(person_id__in=others, other_id=person_id)
+
+
+def _shared(credits, others=None):
+    """``(person_id, other_id, shared_ads, last_year)`` for the people of ``credits``."""
+    qs = credits.annotate(other=F("ad__credits__person_id")).exclude(other=F("person_id"))
+    if others is not None:
+        qs = qs.filter(other__in=others)
+    return (qs.values_list("person_id", "other")
+            .annotate(n=Count("ad_id", distinct=True), last=Max("ad__year")).order_by())
+
+
+def credit_added(ad_id, person_id):
+    """Count ``ad_id`` for ``person_id`` and everyone else credited on it."""
+    if Credit.objects.filter(ad_id=ad_id, person_id=person_id).count() > 1:
+        return  # already on the ad in another role
+    others = people_on(ad_id, exclude=person_id)
+    if not others:
+        return
+    year = Ad.objects.filter(pk=ad_id).values_list("year", flat=True).first()
+    Collaboration.objects.bulk_create(
+        [Collaboration(person_id=a, other_id=b) for o in others for a, b in ((person_id, o), (o, person_id))],
+        ignore_conflicts=True,
+    )
+    update = {"shared_ads": F("shared_ads") + 1}
+    if year is not None:
+        update["last_year"] = Greatest(Coalesce("last_year", Value(year)), Value(year))
+    Collaboration.objects.filter(_pairs(person_id, others)).update(**update)
+
+
+def refresh(person_id, others=None):
+    """Recompute the pairs of ``person_id`` with ``others`` (everyone when None) from the credits."""
+    with transaction.atomic():
+        if others is None:
+            stale = Collaboration.objects.filter(Q(person_id=person_id) | Q(other_id=person_id))
+        else:
+            stale = Collaboration.objects.filter(_pairs(person_id, set(others) - {person_id}))
+        stale.delete()
+        rows = _shared(Credit.objects.filter(person_id=person_id), others)
+        Collaboration.objects.bulk_create(
+            Collaboration(person_id=a, other_id=b, shared_ads=n, last_year=last)
+            for p, o, n, last in rows for a, b in ((p, o), (o, p))
+        )
+
+
+def refresh_ad(ad_id):
+    """Every pair on one ad, e.g. after its year changed."""
+    people = sorted(people_on(ad_id))
+    for i, person_id in enumerate(people[:-1]):
+        refresh(person_id, set(people[i + 1:]))  # each pair once
+
+
+def rebuild():
+    with transaction.atomic():
+        Collaboration.objects.all().delete()
+        Collaboration.objects.bulk_create(
+            (Collaboration(person_id=p, other_id=o, shared_ads=n, last_year=last)
+             for p, o, n, last in _shared(Credit.objects.all()).iterator(chunk_size=5000)),
+            batch_size=5000,
+        )
@@ -0,0 +1,187 @@
+# core/counters.py
+"""
+Maintenance of the denormalised review counters (``RatingCounters``).
+
+New ads are counted with ``apply_ad_delta`` (atomic F() increments, from
+signals.py). Review writes are reconciled after commit by a background task
+(core.tasks) with ``reconcile_ad``, which recomputes the ad from its reviews
+and passes only the difference on to its brand/agency, so running it twice
+changes nothing. Bulk paths and the ``rebuild_rating_counters`` command use
+the ``refresh_*`` functions, which recompute the counters set-based with
+correlated subqueries.
+
+Every update also stamps ``updated_at`` on the rows it touches: the counters
+are shown on those rows' pages (see core.freshness).
+
+``UserProfile`` review stats (count, sum, 0..5 histogram, most-reviewed tags
+and brands) are different: signals.py applies them with
+``apply_profile_delta`` in the transaction of the review write itself. The
+top lists are recomputed from the user's reviews only when a review is added
+or removed. Tag and brand renames or re-tagging reach them through
+``manage.py reconcile_profile_stats``, which also repairs any drift.
+"""
+from collections import defaultdict
+
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Ad, Agency, Brand, Review, UserProfile
+
+OWNERS = ((Brand, "brand"), (Agency, "agency"))
+
+
+def _total(qs, aggregate):
+    """``Coalesce((SELECT aggregate FROM qs), 0)`` for use in ``update()``."""
+    return Coalesce(
+        Subquery(qs.annotate(v=aggregate).values("v")[:1]), 0,
+        output_field=models.PositiveIntegerField(),
+    )
+
+
+# ---- incremental ---------------------------------------------------------------
+
+def apply_review_delta(ad_id, d_sum: int, d_count: int):
+    """Add a review's contribution to its ad and the ad's brand/agency."""
+    if ad_id is None:
+        return
+    if not (d_sum or d_count):
+        # e.g. only the review text changed: just the ad page is affected
+        Ad.objects.filter(pk=ad_id).update(updated_at=timezone.now())
+        return
+    delta = {
+        "rating_sum": F("rating_sum") + d_sum,
+        "rating_count": F("rating_count") + d_count,
+        "updated_at": timezone.now(),
+    }
+    with transaction.atomic():
+        Ad.objects.filter(pk=ad_id).update(**delta)
+        for model, _ in OWNERS:
+            model.objects.filter(ads=ad_id).update(**delta)
+
+
+def reconcile_ad(ad_id) -> bool:
+    """Make one ad's counters match its reviews; returns whether anything changed."""
+    with transaction.atomic():
+        stored = (Ad.objects.select_for_update().filter(pk=ad_id)
+                  .values_list("rating_sum", "rating_count").first())
+        if stored is None:
+            return False  # deleted meanwhile
+        actual = Review.objects.filter(ad_id=ad_id).aggregate(s=Coalesce(Sum("rating"), 0), n=Count("pk"))
+        d_sum, d_count = actual["s"] - stored[0], actual["n"] - stored[1]
+        if not (d_sum or d_count):
+            return False
+        apply_review_delta(ad_id, d_sum, d_count)
+        return True
+
+
+def apply_ad_delta(brand_id, agency_id, d_ads: int):
+    """Count a newly created ad (its ratings start at zero)."""
+    with transaction.atomic():
+        for model, pk in ((Brand, brand_id), (Agency, agency_id)):
+            if pk is not None:
+                model.objects.filter(pk=pk).update(num_ads=F("num_ads") + d_ads, updated_at=timezone.now())
+
+
+# ---- set-based refresh -------------------------------------------------------------
+
+def refresh_ad_ratings(ad_ids=None):
+    """Recompute ``Ad.rating_sum/rating_count`` from reviews (all ads if ``ad_ids`` is None)."""
+    qs = Ad.objects.all() if ad_ids is None else Ad.objects.filter(pk__in=list(ad_ids))
+    reviews = Review.objects.filter(ad=OuterRef("pk")).order_by().values("ad")
+    return qs.update(
+        rating_sum=_total(reviews, Sum("rating")),
+        rating_count=_total(reviews, Count("pk")),
+        updated_at=timezone.now(),
+    )
+
+
+def refresh_owner_totals(model, ids=None):
+    """Recompute ``num_ads`` and rating totals of Brand or Agency rows from their ads."""
+    fk = dict(OWNERS)[model]
+    qs = model.objects.all() if ids is None else model.objects.filter(pk__in=[i for i in ids if i is not None])
+    ads = Ad.objects.filter(**{fk: OuterRef("pk")}).order_by().values(fk)
+    return qs.update(
+        num_ads=_total(ads, Count("pk")),
+        rating_sum=_total(ads, Sum("rating_sum")),
+        rating_count=_total(ads, Sum("rating_count")),
+        updated_at=timezone.now(),
+    )
+
+
+def refresh_for_ads(ad_ids):
+    """Recompute one or more ads and the brands/agencies they belong to."""
+    ad_ids = list(ad_ids)
+    owners = Ad.objects.filter(pk__in=ad_ids).values_list("brand_id", "agency_id")
+    brand_ids, agency_ids = (set(col) for col in zip(*owners)) if owners else (set(), set())
+    with transaction.atomic():
+        refresh_ad_ratings(ad_ids)
+        refresh_owner_totals(Brand, brand_ids)
+        refresh_owner_totals(Agency, agency_ids)
+
+
+def rebuild_all():
+    with transaction.atomic():
+        refresh_ad_ratings()
+        refresh_owner_totals(Brand)
+        refresh_owner_totals(Agency)
+
+
+# ---- user profiles ---------------------------------------------------------------
+
+PROFILE_TOP = 5
+
+
+def apply_profile_delta(user_id, old_rating=None, new_rating=None):
+    """Move one review on its author's profile; a rating of None is no review (created or deleted)."""
+    delta = defaultdict(int)
+    for rating, sign in ((old_rating, -1), (new_rating, 1)):
+        if rating is not None:
+            delta["rating_count"] += sign
+            delta["rating_sum"] += sign * rating
+            delta[f"ratings_{rating}"] += sign
+    changes = {field: F(field) + d for field, d in delta.items() if d}
+    found = UserProfile.objects.filter(user_id=user_id).update(**changes, updated_at=timezone.now())
+    if found and (old_rating is None) != (new_rating is None):  # a review came or went
+        refresh_profile_tops([user_id])
+
+
+def refresh_profile_stats(user_ids=None):
+    """Recompute the review stats of profiles set-based (all of them if ``user_ids`` is None)."""
+    qs = UserProfile.objects.all() if user_ids is None else UserProfile.objects.filter(user_id__in=list(user_ids))
+    reviews = Review.objects.filter(user=OuterRef("user")).order_by().values("user")
+    with transaction.atomic():
+        updated = qs.update(
+            rating_sum=_total(reviews, Sum("rating")),
+            rating_count=_total(reviews, Count("pk")),
+            **{f"ratings_{r}": _total(reviews.filter(rating=r), Count("pk")) for r in range(6)},
+        )
+        refresh_profile_tops(user_ids)
+    return updated
+
+
+def _top(rows):
+    """``{user_id: [{"name", "slug", "n"}, ...]}`` from ``(user_id, name, slug, n)`` rows."""
+    found = defaultdict(list)
+    for user_id, name, slug, n in sorted(rows, key=lambda r: (r[0], -r[3], r[1])):
+        if len(found[user_id]) < PROFILE_TOP:
+            found[user_id].append({"name": name, "slug": slug, "n": n})
+    return found
+
+
+def refresh_profile_tops(user_ids=None, chunk=500):
+    """The most-reviewed tags and brands of profiles, ``chunk`` users per pair of queries."""
+    if user_ids is None:
+        user_ids = UserProfile.objects.order_by("user_id").values_list("user_id", flat=True)
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), chunk):
+        users = user_ids[start:start + chunk]
+        reviews = Review.objects.filter(user_id__in=users).order_by()
+        tags = _top(reviews.exclude(ad__tags_m2m=None)
+                    .values_list("user_id", "ad__tags_m2m__name", "ad__tags_m2m__slug").annotate(n=Count("pk")))
+        brands = _top(reviews.values_list("user_id", "ad__brand__name", "ad__brand__slug").annotate(n=Count("pk")))
+        profiles = list(UserProfile.objects.filter(user_id__in=users).only("pk", "user_id"))
+        for p in profiles:
+            p.top_tags, p.top_brands = tags.get(p.user_id, []), brands.get(p.user_id, [])
+        UserProfile.objects.bulk_update(profiles, ["top_tags", "top_brands"])
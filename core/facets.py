@@ -0,0 +1,108 @@
+# core/facets.py
+"""
+Tag facet counts: how many ads carry each tag, per year (``TagFacet``).
+
+The table changes in the same transaction as the tag links. signals.py
+covers ``tags_m2m`` edits, year edits and ad deletions. bulk.py, imports.py
+and the legacy tag backfill cover the set-based writes that skip signals.
+Each of them turns its change into a ``Counter`` of ``(tag_id, year)``
+deltas and hands it to ``apply``, which issues one UPDATE per distinct
+``(year, delta)``. ``links`` taken before and after a write gives the delta
+of writes too involved to count directly. ``rebuild`` recomputes the table
+from the links (``rebuild_tag_facets`` command).
+
+``search_facets`` gives the search page its tag and year counts for the
+current filter. Without a query or tag they come straight from the table.
+Otherwise they are aggregated over at most ``SAMPLE`` matching ads.
+"""
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from .models import Ad, TagFacet
+
+Through = Ad.tags_m2m.through
+SAMPLE = 2000
+
+
+def links(ad_ids=None, tag_ids=None) -> Counter:
+    """``(tag_id, year) -> links`` over the links of ``ad_ids`` and/or ``tag_ids`` (all when neither)."""
+    qs = Through.objects.all()
+    if ad_ids is not None:
+        qs = qs.filter(ad_id__in=list(ad_ids))
+    if tag_ids is not None:
+        qs = qs.filter(tag_id__in=list(tag_ids))
+    rows = qs.values("tag_id", "ad__year").annotate(n=Count("pk")).order_by()
+    counts = Counter()
+    for row in rows:
+        counts[row["tag_id"], row["ad__year"] or 0] += row["n"]
+    return counts
+
+
+def count(pairs, sign=1) -> Counter:
+    """Delta for adding (``sign=1``) or removing (``-1``) the ``(ad_id, tag_id)`` links in ``pairs``."""
+    pairs = list(pairs)
+    # years from the database, not from a possibly stale instance: they are what ``links`` sees
+    years = dict(Ad.objects.filter(pk__in={ad for ad, _ in pairs}).order_by().values_list("pk", "year"))
+    delta = Counter()
+    for ad, tag in pairs:
+        delta[tag, years.get(ad) or 0] += sign
+    return delta
+
+
+def change(before: Counter, after: Counter) -> Counter:
+    delta = Counter(after)
+    delta.subtract(before)  # keeps negative counts, unlike ``after - before``
+    return delta
+
+
+def apply(delta):
+    delta = {key: d for key, d in delta.items() if d}
+    if not delta:
+        return
+    TagFacet.objects.bulk_create(
+        [TagFacet(tag_id=tag, year=year) for (tag, year), d in delta.items() if d > 0], ignore_conflicts=True,
+    )
+    by_step = defaultdict(list)
+    for (tag, year), d in delta.items():
+        by_step[year, d].append(tag)
+    for (year, d), tag_ids in by_step.items():
+        TagFacet.objects.filter(year=year, tag_id__in=tag_ids).update(num_ads=F("num_ads") + d)
+
+
+def rebuild(tag_ids=None):
+    """Recompute the facets of ``tag_ids`` (every tag when None) from the links."""
+    with transaction.atomic():
+        stale = TagFacet.objects.all() if tag_ids is None else TagFacet.objects.filter(tag_id__in=list(tag_ids))
+        stale.delete()
+        TagFacet.objects.bulk_create(
+            TagFacet(tag_id=tag, year=year, num_ads=n) for (tag, year), n in links(tag_ids=tag_ids).items()
+        )
+
+
+# ---- search page -------------------------------------------------------------------
+
+def search_facets(qs, q="", tag="", year=None):
+    """
+    ``(tag counts, year counts, partial)`` for the ads in ``qs``, the search results
+    for ``q`` / ``tag`` (a slug) / ``year``. ``partial``: some counts cover only the
+    first ``SAMPLE`` results.
+    """
+    table = TagFacet.objects.filter(num_ads__gt=0)
+    if not (q or tag):
+        if year is not None:
+            table = table.filter(year=year)
+        tags = dict(table.values_list("tag_id").annotate(n=Sum("num_ads")).order_by())
+        return tags, [], False
+
+    rows = list(qs.values_list("pk", "year")[:SAMPLE + 1])
+    partial = len(rows) > SAMPLE
+    rows = rows[:SAMPLE]
+    tags = dict(Through.objects.filter(ad_id__in=[pk for pk, _ in rows])
+                .values_list("tag_id").annotate(n=Count("pk")).order_by())
+    if q:
+        years = sorted(Counter(y for _, y in rows if y).items(), reverse=True)
+    else:  # every year of one tag: exact, from the table
+        years = list(table.filter(tag__slug=tag, year__gt=0).order_by("-year").values_list("year", "num_ads"))
+    return tags, years, partial
@@ -0,0 +1,195 @@
+# core/feed.py
+"""
+The "for you" feed: a short ranked list of ads per user, kept in ``FeedItem``.
+
+``refresh(user_id)`` recomputes one user's feed from their latest ``HISTORY``
+reviews in three steps:
+
+1. A taste profile: a weight per tag, brand, agency and credited person. It
+   averages ``rating - NEUTRAL`` over the reviewed ads that have the feature,
+   so liked ads pull towards their features and panned ones away.
+2. Candidates: the precomputed neighbours (core.similar) of the best-rated
+   reviewed ads, plus the most-reviewed ads of the favourite brands,
+   agencies, tags and people.
+3. A score per candidate: its features dotted with the profile and damped
+   by its number of features, plus its similarity to the ads it was found
+   next to.
+
+Ads the user has already reviewed are left out. The best ``SIZE`` replace
+the old feed; the profile and the ratings it averages go to ``FeedTaste``. Every step is a few
+set-based queries bounded by ``HISTORY`` and the candidate limits, whatever
+the size of the catalogue.
+
+A review posted through ``review_submit`` is folded in by ``add_review``
+instead (``tasks.update_feed``): the stored profile moves by that one review
+(and by the one it pushes out of the ``HISTORY`` window), the current feed items
+keep their similarity bonus, the reviewed ad adds its neighbours and the top
+ads of its features, and everything is rescored. Reviews written elsewhere
+(API, admin, deletions) and changes to the ads' features are only picked up by
+the next full ``refresh``: ``manage.py rebuild_feeds`` queues every reviewer in
+chunks, which Celery workers run in parallel.
+
+Serving (``views.feed``) is one range read of the ``(user, rank)`` index.
+"""
+import heapq
+import math
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Max
+
+from .models import Ad, Credit, FeedItem, FeedTaste, Review, SimilarAd
+
+SIZE = 50
+HISTORY = 200
+NEUTRAL = 2.5       # ratings above it count as liked
+SEEDS = 20          # best-rated reviewed ads whose neighbours become candidates
+FAVOURITES = 5      # favourite brands, agencies, tags and people drawn from
+PER_KIND = 100      # candidates drawn from the favourites of one kind
+
+Through = Ad.tags_m2m.through
+KINDS = {"brand": "brand_id__in", "agency": "agency_id__in", "tag": "tags_m2m__in",
+         "person": "credits__person_id__in"}
+
+
+def ad_features(ad_ids) -> dict[int, set]:
+    """``{ad_id: {("brand", id), ("tag", id), ...}}`` in three queries, however many ads."""
+    features = defaultdict(set)
+    for pk, brand, agency in Ad.objects.filter(pk__in=ad_ids).values_list("pk", "brand_id", "agency_id"):
+        features[pk].add(("brand", brand))
+        if agency:
+            features[pk].add(("agency", agency))
+    for pk, tag in Through.objects.filter(ad_id__in=ad_ids).values_list("ad_id", "tag_id"):
+        features[pk].add(("tag", tag))
+    for pk, person in Credit.objects.filter(ad_id__in=ad_ids).order_by().values_list("ad_id", "person_id"):
+        features[pk].add(("person", person))
+    return features
+
+
+def profile(reviews) -> dict[tuple, float]:
+    """Taste weights from ``[(ad_id, rating), ...]``."""
+    features = ad_features([ad_id for ad_id, _ in reviews])
+    taste = defaultdict(float)
+    for ad_id, rating in reviews:
+        for f in features[ad_id]:
+            taste[f] += (rating - NEUTRAL) / len(reviews)
+    return taste
+
+
+def candidates(reviews, taste) -> dict[int, float]:
+    """``{ad_id: similarity bonus}`` of the ads worth scoring."""
+    found = defaultdict(float)
+    seeds = {ad_id: rating - NEUTRAL for ad_id, rating in heapq.nlargest(SEEDS, reviews, key=lambda r: r[1])
+             if rating > NEUTRAL}
+    neighbours = SimilarAd.objects.filter(ad_id__in=list(seeds)).values_list("ad_id", "other_id", "score")
+    for ad_id, other, score in neighbours:
+        found[other] += seeds[ad_id] * score
+    for kind, lookup in KINDS.items():
+        favourites = heapq.nlargest(FAVOURITES, (f for f, w in taste.items() if f[0] == kind and w > 0),
+                                    key=taste.get)
+        if favourites:
+            ads = (Ad.objects.filter(**{lookup: [value for _, value in favourites]})
+                   .order_by("-rating_count").values_list("pk", flat=True).distinct()[:PER_KIND])
+            for pk in ads:
+                found[pk] += 0.0
+    return found
+
+
+def refresh(user_id) -> int:
+    """Recompute the feed of ``user_id``; returns its length."""
+    as_of = Review.objects.filter(user_id=user_id).aggregate(as_of=Max("updated_at"))["as_of"]
+    reviews = list(Review.objects.filter(user_id=user_id).order_by("-created_at", "-id")
+                   .values_list("ad_id", "rating")[:HISTORY])
+    taste = profile(reviews) if reviews else {}
+    best = _best(user_id, taste, candidates(reviews, taste)) if reviews else []
+    with transaction.atomic():
+        _lock(user_id)
+        _store(user_id, best, taste, dict(reviews), as_of)
+    return len(best)
+
+
+def add_review(review_id):
+    """
+    Fold review ``review_id``, new or re-rated, into its author's stored feed.
+    A review the stored profile already includes is skipped, so a redelivered
+    task changes nothing; without a stored profile this is ``refresh``.
+    """
+    review = Review.objects.filter(pk=review_id).values("user_id", "ad_id", "rating", "updated_at").first()
+    if review is None:  # deleted since: the next refresh drops it
+        return
+    user_id, ad_id, rating = review["user_id"], review["ad_id"], review["rating"]
+    with transaction.atomic():
+        _lock(user_id)
+        stored = FeedTaste.objects.filter(user_id=user_id).first()
+        if stored is None or not stored.ratings:
+            refresh(user_id)
+            return
+        if stored.as_of and review["updated_at"] <= stored.as_of:
+            return
+        ratings = {int(pk): r for pk, r in stored.ratings.items()}
+        sums = defaultdict(float, {f: w * len(ratings) for f, w in _decode(stored.weights).items()})
+        rerated = ad_id in ratings
+        steps = [(ad_id, rating - (ratings[ad_id] if rerated else NEUTRAL))]
+        if not rerated and len(ratings) >= HISTORY:
+            # a new review pushes the oldest one out of the window; a re-rated one beyond it changes nothing
+            pushed = (Review.objects.filter(user_id=user_id).order_by("-created_at", "-id")
+                      .values_list("ad_id", "rating")[HISTORY:HISTORY + 1])
+            pushed = [(old, old_rating) for old, old_rating in pushed if old in ratings]
+            if not pushed:
+                FeedTaste.objects.filter(user_id=user_id).update(as_of=review["updated_at"])
+                return
+            for old, old_rating in pushed:
+                steps.append((old, NEUTRAL - old_rating))
+                del ratings[old]
+        ratings[ad_id] = rating
+        features = ad_features([pk for pk, _ in steps])
+        for pk, step in steps:
+            for f in features[pk]:
+                sums[f] += step
+        taste = {f: total / len(ratings) for f, total in sums.items() if abs(total) > 1e-9}
+
+        # the current feed keeps its similarity bonuses; a new review adds its ad's own candidates
+        found = defaultdict(float, FeedItem.objects.filter(user_id=user_id).values_list("ad_id", "bonus"))
+        own = {f: taste[f] for f in features[ad_id] if f in taste}
+        for pk, bonus in candidates([] if rerated else [(ad_id, rating)], own).items():
+            found[pk] += bonus
+        _store(user_id, _best(user_id, taste, found), taste, ratings, review["updated_at"])
+
+
+def _best(user_id, taste, found) -> list[tuple]:
+    """The top ``SIZE`` of ``found`` (``{ad_id: bonus}``) not reviewed yet, as ``(score, -ad_id, bonus)``."""
+    for ad_id in Review.objects.filter(user_id=user_id, ad_id__in=list(found)).values_list("ad_id", flat=True):
+        del found[ad_id]
+    features = ad_features(list(found))
+    scored = (
+        (sum(taste.get(f, 0.0) for f in features[pk]) / math.sqrt(len(features[pk]) or 1) + bonus, -pk, bonus)
+        for pk, bonus in found.items()
+    )
+    return heapq.nlargest(SIZE, (s for s in scored if s[0] > 0))
+
+
+def _lock(user_id):
+    # serialises the writes to one user's feed, so their delete/insert pairs cannot interleave
+    list(get_user_model().objects.select_for_update().filter(pk=user_id).values_list("pk"))
+
+
+def _store(user_id, best, taste, ratings, as_of):
+    FeedItem.objects.filter(user_id=user_id).delete()
+    FeedItem.objects.bulk_create(
+        FeedItem(user_id=user_id, ad_id=-pk, rank=rank, score=round(score, 4), bonus=bonus)
+        for rank, (score, pk, bonus) in enumerate(best, 1)
+    )
+    FeedTaste.objects.update_or_create(user_id=user_id, defaults={"weights": _encode(taste), "ratings": ratings, "as_of": as_of})
+
+
+def _encode(taste):
+    return {f"{kind}:{pk}": weight for (kind, pk), weight in taste.items()}
+
+
+def _decode(weights):
+    taste = {}
+    for key, weight in weights.items():
+        kind, _, pk = key.partition(":")
+        taste[kind, int(pk)] = weight
+    return taste
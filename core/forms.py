@@ -1,24 +1,19 @@
 from django import forms
 from .models import Ad, Review, UserProfile
-from .utils import extract_youtube_id
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 
 
 class AdAdminForm(forms.ModelForm):
+    """
+    Ad.clean() normalises the YouTube URL without a duplicate query; a duplicate
+    is found by the unique index when saving (AdAdmin.save_model attaches it).
+    """
     class Meta:
         model = Ad
         fields = "__all__"
 
-    def clean(self):
-        cleaned = super().clean()
-        url = cleaned.get("youtube_url", "")
-        yt_id = extract_youtube_id(url or "")
-        if not yt_id:
-            raise forms.ValidationError("Please paste a valid YouTube URL or ID.")
-        cleaned["youtube_id"] = yt_id
-        return cleaned
-    
+
 class ReviewForm(forms.ModelForm):
     class Meta:
         model = Review
@@ -0,0 +1,88 @@
+# core/freshness.py
+"""
+HTTP conditional GETs (ETag / Last-Modified -> 304) for the detail pages.
+
+``Ad``, ``Brand`` and ``Agency`` carry an ``updated_at`` that changes
+whenever anything shown on their page changes. Their own saves update it
+(auto_now). counters.py stamps it alongside every counter update (reviews,
+ads added or removed). signals.py ``touch``-es it for credits, tags, people
+and renames. A freshness check is therefore one small query on indexed keys.
+
+``UserProfile.updated_at`` works the same way for the public profile page:
+counters.py stamps it with every review write, and ``touch_reviewers``
+stamps the profiles that list an ad whose title, year or brand changed.
+The view's own queries and template only run when the client's copy is stale.
+
+The ETag also covers the viewer (pages show who is logged in), and no
+conditional response is given while flash messages are waiting to be shown.
+"""
+import hashlib
+
+from django.conf import settings
+from django.contrib import messages
+from django.utils import timezone
+from django.views.decorators.http import condition
+
+from .models import Ad, Agency, Brand, UserProfile
+
+
+def touch(model, **filters):
+    """Mark the pages of matching rows as changed."""
+    return model.objects.filter(**filters).update(updated_at=timezone.now())
+
+
+def touch_reviewers(**ad_filters):
+    """Mark the profile pages whose review lists show the matching ads."""
+    return touch(UserProfile, **{f"user__reviews__ad__{k}": v for k, v in ad_filters.items()})
+
+
+# ---- state lookups: (last_modified, extra etag parts) or None when missing ------
+
+def ad_state(request, pk):
+    row = (Ad.objects.filter(pk=pk).order_by()
+           .values_list("updated_at", "brand__updated_at", "agency__updated_at").first())
+    return row and (max(t for t in row if t), ())
+
+
+def brand_state(request, slug):
+    updated = Brand.objects.filter(slug=slug).order_by().values_list("updated_at", flat=True).first()
+    return updated and (updated, ())
+
+
+def agency_state(request, slug):
+    updated = Agency.objects.filter(slug=slug).order_by().values_list("updated_at", flat=True).first()
+    return updated and (updated, ())
+
+
+def profile_state(request, username):
+    row = (UserProfile.objects.filter(user__username=username).order_by()
+           .values_list("updated_at", "rating_count").first())
+    return row and (row[0], row[1:])
+
+
+# ---- decorator -------------------------------------------------------------------
+
+def conditional_page(lookup):
+    """``condition()`` around a view, with ``lookup`` run once per request."""
+
+    def state(request, *args, **kwargs):
+        if not hasattr(request, "_page_state"):
+            # render normally (no 304) while there are flash messages to show
+            pending = len(messages.get_messages(request)) if hasattr(request, "_messages") else 0
+            request._page_state = None if pending else lookup(request, *args, **kwargs)
+        return request._page_state
+
+    def last_modified(request, *args, **kwargs):
+        found = state(request, *args, **kwargs)
+        return found[0] if found else None
+
+    def etag(request, *args, **kwargs):
+        found = state(request, *args, **kwargs)
+        if not found:
+            return None
+        modified, extra = found
+        raw = repr((lookup.__name__, modified and modified.isoformat(), extra,
+                    request.user.pk, getattr(settings, "ETAG_SALT", "")))
+        return hashlib.md5(raw.encode(), usedforsecurity=False).hexdigest()
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
@@ -0,0 +1,284 @@
+# core/leaderboards.py
+"""
+Trending and top-rated leaderboards, overall and per tag, brand, agency and year.
+
+A board is a sorted set of ad ids under a key:
+
+    trending:<window>:<scope>   reviews posted in the last 24h, 7d or 30d
+    rated:<scope>               Bayesian average rating, ads with MIN_COUNT+ reviews
+
+``scope`` is ``all``, ``tag:<id>``, ``brand:<id>``, ``agency:<id>`` or
+``year:<year>``. The Bayesian average ``(PRIOR * mean + sum) / (PRIOR + n)``
+pulls ads with few reviews towards the site-wide mean, so three 5-star reviews
+do not outrank three hundred 4.8s. The mean is fixed at each backfill, so all
+scores on a board are comparable.
+
+Windows are bucketed by the hour: ``24h`` counts the reviews of the current
+hour and the 23 before it. Scores are never incremented blindly.
+``refresh(ad_ids)`` recomputes the ads' review counts and averages from
+``Review`` and the ad counters and writes them to every board the ads belong
+on, so running it twice changes nothing. ``tasks.reconcile_ads`` calls it after
+every review write. Once an hour ``roll`` refreshes the ads whose reviews have
+just slid out of a window: Celery beat runs ``tasks.roll_leaderboards`` on the
+hour (``CELERY_BEAT_SCHEDULE``), or cron runs ``manage.py roll_leaderboards``.
+As a fallback the first read of a trending board in an hour queues the task
+for a worker; with eager tasks (no broker) reads never roll, the request
+would run it inline. ``manage.py backfill_leaderboards`` rebuilds every board
+from ``Review.created_at``.
+
+Storage (``get_backend``) is Redis sorted sets when ``LEADERBOARD_REDIS_URL``
+is set, otherwise the ``LeaderboardEntry`` table (tests, dev). Either way the
+top N is one index range, O(log n + N): ``ZREVRANGE``, or ``ORDER BY score DESC
+LIMIT N`` on ``(key, -score)``.
+
+An ad moved to another brand, agency, year or tag set stays on its old
+scope's boards until it is next refreshed: a review, the hourly roll, or an
+edit of the ad itself (signals.py queues one, as it does for a deleted ad).
+``views.leaderboard`` filters such ads out when it loads them.
+"""
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+from functools import lru_cache
+
+import redis
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import bulk, tasks
+from .models import Ad, LeaderboardEntry, Review
+
+WINDOWS = {"24h": 24, "7d": 24 * 7, "30d": 24 * 30}  # hours
+MIN_COUNT = 5
+PRIOR = 10
+TOP = 100
+
+Through = Ad.tags_m2m.through
+
+
+# ---- storage -----------------------------------------------------------------------
+
+class DatabaseBoards:
+    """Boards as ``LeaderboardEntry`` rows."""
+
+    def replace(self, ad_ids, scores, removed=()):
+        """Make ``scores`` (``{(key, ad_id): score}``) the only entries of ``ad_ids``."""
+        with transaction.atomic():
+            LeaderboardEntry.objects.filter(member__in=list(ad_ids)).delete()
+            LeaderboardEntry.objects.bulk_create(
+                [LeaderboardEntry(key=key, member=member, score=score) for (key, member), score in scores.items()],
+                batch_size=5000,
+            )
+
+    def top(self, key, n):
+        return list(LeaderboardEntry.objects.filter(key=key).order_by("-score", "member")
+                    .values_list("member", "score")[:n])
+
+    def get_meta(self, name):
+        return LeaderboardEntry.objects.filter(key=f"meta:{name}").values_list("score", flat=True).first()
+
+    def set_meta(self, name, value):
+        LeaderboardEntry.objects.update_or_create(key=f"meta:{name}", member=0, defaults={"score": value})
+
+    def clear(self):
+        LeaderboardEntry.objects.all().delete()
+
+
+@lru_cache
+def _redis(url):
+    return redis.Redis.from_url(url)
+
+
+class RedisBoards:
+    """Boards as Redis sorted sets under ``lb:``."""
+    prefix = "lb:"
+
+    def __init__(self, url=None):
+        self.redis = _redis(url or settings.LEADERBOARD_REDIS_URL)
+
+    def replace(self, ad_ids, scores, removed=()):
+        """
+        As ``DatabaseBoards.replace``. The keys each ad is on are kept in a set
+        (``lb:ad:<id>``), so its entries on boards it no longer belongs on go
+        too: scopes it has left, every board once it is deleted. ``removed``
+        names more ``(key, ad_id)`` entries to drop.
+        """
+        ad_ids = list(ad_ids)
+        read = self.redis.pipeline(transaction=False)
+        for ad_id in ad_ids:
+            read.smembers(self._keys_of(ad_id))
+        stale = {ad_id: {_str(k) for k in keys} for ad_id, keys in zip(ad_ids, read.execute())}
+        for key, member in removed:
+            stale.setdefault(member, set()).add(key)
+        by_key, keys_of = defaultdict(dict), defaultdict(set)
+        for (key, member), score in scores.items():
+            by_key[key][member] = score
+            keys_of[member].add(key)
+
+        pipe = self.redis.pipeline()
+        for ad_id, keys in stale.items():
+            for key in keys - keys_of[ad_id]:
+                pipe.zrem(self.prefix + key, ad_id)
+        for ad_id in ad_ids:
+            pipe.delete(self._keys_of(ad_id))
+            if keys_of[ad_id]:
+                pipe.sadd(self._keys_of(ad_id), *keys_of[ad_id])
+        for key, mapping in by_key.items():
+            pipe.zadd(self.prefix + key, mapping)
+        pipe.execute()
+
+    def _keys_of(self, ad_id):
+        return f"{self.prefix}ad:{ad_id}"
+
+    def top(self, key, n):
+        return [(int(m), s) for m, s in self.redis.zrevrange(self.prefix + key, 0, n - 1, withscores=True)]
+
+    def get_meta(self, name):
+        value = self.redis.get(f"{self.prefix}meta:{name}")
+        return None if value is None else float(value)
+
+    def set_meta(self, name, value):
+        self.redis.set(f"{self.prefix}meta:{name}", value)
+
+    def clear(self):
+        keys = list(self.redis.scan_iter(match=self.prefix + "*", count=1000))
+        for batch in bulk.chunked(keys, 1000):
+            self.redis.delete(*batch)
+
+
+def _str(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def get_backend():
+    path = getattr(settings, "LEADERBOARD_BACKEND", None)
+    if path:
+        return import_string(path)()
+    return RedisBoards() if getattr(settings, "LEADERBOARD_REDIS_URL", "") else DatabaseBoards()
+
+
+# ---- scores ------------------------------------------------------------------------
+
+def hour(when=None) -> int:
+    return int((when or timezone.now()).timestamp() // 3600)
+
+
+def hour_start(h) -> datetime:
+    return datetime.fromtimestamp(h * 3600, tz=dt_timezone.utc)
+
+
+def window_start(window, now_hour) -> datetime:
+    return hour_start(now_hour - WINDOWS[window] + 1)
+
+
+def bayesian(rating_sum, rating_count, mean) -> float:
+    return (PRIOR * mean + rating_sum) / (PRIOR + rating_count)
+
+
+def site_mean() -> float:
+    totals = Ad.objects.aggregate(s=Sum("rating_sum"), n=Sum("rating_count"))
+    return totals["s"] / totals["n"] if totals["n"] else 2.5
+
+
+def key(board, scope="all", window=None) -> str:
+    return f"trending:{window}:{scope}" if board == "trending" else f"rated:{scope}"
+
+
+def _ads(ad_ids):
+    """``{ad_id: (scopes, rating_sum, rating_count)}``."""
+    found = {}
+    for pk, brand, agency, year, rating_sum, rating_count in Ad.objects.filter(pk__in=ad_ids).values_list(
+            "pk", "brand_id", "agency_id", "year", "rating_sum", "rating_count"):
+        scopes = ["all", f"brand:{brand}"]
+        if agency:
+            scopes.append(f"agency:{agency}")
+        if year:
+            scopes.append(f"year:{year}")
+        found[pk] = (scopes, rating_sum, rating_count)
+    for pk, tag in Through.objects.filter(ad_id__in=ad_ids).values_list("ad_id", "tag_id"):
+        found[pk][0].append(f"tag:{tag}")
+    return found
+
+
+def refresh(ad_ids, now_hour=None, backend=None):
+    """Recompute every board entry of ``ad_ids``."""
+    ad_ids = list(ad_ids)
+    if not ad_ids:
+        return
+    backend = backend or get_backend()
+    now_hour = hour() if now_hour is None else now_hour
+    mean = backend.get_meta("mean")
+    if mean is None:
+        mean = site_mean()
+        backend.set_meta("mean", mean)
+    counts = {
+        row["ad_id"]: row for row in
+        Review.objects.filter(ad_id__in=ad_ids, created_at__gte=window_start("30d", now_hour))
+        .values("ad_id").order_by()
+        .annotate(**{f"n_{w}": Count("pk", filter=Q(created_at__gte=window_start(w, now_hour))) for w in WINDOWS})
+    }
+    scores, removed = {}, []
+    for pk, (scopes, rating_sum, rating_count) in _ads(ad_ids).items():
+        row = counts.get(pk, {})
+        rated = round(bayesian(rating_sum, rating_count, mean), 4) if rating_count >= MIN_COUNT else None
+        for scope in scopes:
+            for w in WINDOWS:
+                if row.get(f"n_{w}"):
+                    scores[key("trending", scope, w), pk] = row[f"n_{w}"]
+                else:
+                    removed.append((key("trending", scope, w), pk))
+            if rated is None:
+                removed.append((key("rated", scope), pk))
+            else:
+                scores[key("rated", scope), pk] = rated
+    backend.replace(ad_ids, scores, removed)
+
+
+def roll(now_hour=None) -> int:
+    """Refresh the ads whose reviews left a window since the last roll; returns how many."""
+    backend = get_backend()
+    now_hour = hour() if now_hour is None else now_hour
+    last = backend.get_meta("rolled")
+    if last is not None and last >= now_hour:
+        return 0
+    ad_ids = []
+    if last is not None:
+        left = Q()
+        for w in WINDOWS:  # reviews in [start of the window then, start of the window now)
+            left |= Q(created_at__gte=window_start(w, int(last)), created_at__lt=window_start(w, now_hour))
+        ad_ids = sorted(set(Review.objects.filter(left).values_list("ad_id", flat=True)))
+        for chunk in bulk.chunked(ad_ids):
+            refresh(chunk, now_hour, backend)
+    backend.set_meta("rolled", now_hour)
+    return len(ad_ids)
+
+
+def rebuild(progress=None) -> int:
+    """Every board from scratch; returns the number of ads placed."""
+    backend = get_backend()
+    backend.clear()
+    now_hour = hour()
+    backend.set_meta("mean", site_mean())
+    ad_ids = sorted(
+        set(Review.objects.filter(created_at__gte=window_start("30d", now_hour)).values_list("ad_id", flat=True))
+        | set(Ad.objects.filter(rating_count__gte=MIN_COUNT).values_list("pk", flat=True))
+    )
+    for n, chunk in enumerate(bulk.chunked(ad_ids), 1):
+        refresh(chunk, now_hour, backend)
+        if progress:
+            progress(min(n * bulk.CHUNK, len(ad_ids)), len(ad_ids))
+    backend.set_meta("rolled", now_hour)
+    return len(ad_ids)
+
+
+# ---- reading -----------------------------------------------------------------------
+
+def top(board, scope="all", window="24h", n=TOP) -> list[tuple[int, float]]:
+    """``[(ad_id, score), ...]`` best first. Trending reads queue a missed hourly ``roll`` for a worker."""
+    if board == "trending" and not settings.CELERY_TASK_ALWAYS_EAGER \
+            and cache.add(f"leaderboards:roll:{hour()}", 1, 3600):
+        tasks.roll_leaderboards.delay()  # a no-op when beat or cron already rolled this hour
+    return get_backend().top(key(board, scope, window), n)
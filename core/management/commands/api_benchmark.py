@@ -0,0 +1,86 @@
+# core/management/commands/api_benchmark.py
+import time
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+
+from core.api import v1
+from core.serializers import ReadSerializer, parse_tree
+
+RESOURCES = {prefix: viewset for prefix, viewset, _ in v1.registry}
+
+
+@contextmanager
+def stock_drf():
+    """Serialize through DRF's generic ``to_representation`` instead of the field plan."""
+    planned = ReadSerializer.to_representation
+    ReadSerializer.to_representation = serializers.ModelSerializer.to_representation
+    try:
+        yield
+    finally:
+        ReadSerializer.to_representation = planned
+
+
+def best_of(repeat, fn):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - started)
+    return min(times), result
+
+
+class Command(BaseCommand):
+    help = "Objects per second through the /api/v1/ serializers, against the current database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("resource", nargs="?", default="ads", choices=sorted(RESOURCES))
+        parser.add_argument("--count", type=int, default=5000, help="Objects to serialize (default 5000)")
+        parser.add_argument("--fields", default=None, help="As ?fields=, e.g. id,title,brand.name")
+        parser.add_argument("--include", default=None, help="As ?include=, e.g. brand,credits.person")
+        parser.add_argument("--repeat", type=int, default=5, help="Best of N runs (default 5)")
+
+    def handle(self, *args, **opts):
+        viewset = RESOURCES[opts["resource"]]
+        serializer = viewset.serializer_class
+        fields, include = parse_tree(opts["fields"]), parse_tree(opts["include"]) or {}
+        try:
+            serializer.check_params(fields, include)
+        except serializers.ValidationError as e:
+            raise CommandError(e.detail)
+
+        qs = serializer.optimise(viewset.queryset.all(), fields, include)
+        if viewset.ordering:
+            qs = qs.order_by(*viewset.ordering)
+        with CaptureQueriesContext(connection) as ctx:
+            started = time.perf_counter()
+            objects = list(qs[:opts["count"]])
+            fetched = time.perf_counter() - started
+        if not objects:
+            raise CommandError(f"No {opts['resource']} to serialize")
+        n = len(objects)
+        self.stdout.write(f"{n} {opts['resource']}, fields={opts['fields'] or '*'}, include={opts['include'] or '-'}")
+        self.stdout.write(f"{'fetch':<12} {fetched * 1000:>9.1f} ms {n / fetched:>12,.0f} obj/s  {len(ctx)} queries")
+
+        def serialize():
+            return serializer(objects, many=True, fields=fields, include=include).data
+
+        rows = []
+        for label, mode in (("planned", None), ("stock DRF", stock_drf)):
+            with CaptureQueriesContext(connection) as ctx:
+                if mode:
+                    with mode():
+                        seconds, data = best_of(opts["repeat"], serialize)
+                else:
+                    seconds, data = best_of(opts["repeat"], serialize)
+            rows.append((label, seconds, len(ctx)))
+        for label, seconds, queries in rows:
+            note = f"  {queries} queries (should be 0)" if queries else ""
+            self.stdout.write(f"{label:<12} {seconds * 1000:>9.1f} ms {n / seconds:>12,.0f} obj/s{note}")
+        seconds, body = best_of(opts["repeat"], lambda: JSONRenderer().render(data))
+        self.stdout.write(f"{'json':<12} {seconds * 1000:>9.1f} ms {n / seconds:>12,.0f} obj/s  {len(body) / n:.0f} bytes/obj")
+        self.stdout.write(f"planned is {rows[1][1] / rows[0][1]:.1f}x stock DRF")
@@ -0,0 +1,22 @@
+# core/management/commands/backfill_leaderboards.py
+import time
+from django.core.management.base import BaseCommand
+
+from core import leaderboards
+
+
+class Command(BaseCommand):
+    help = "Rebuild the trending and top-rated leaderboards from Review.created_at and the rating counters"
+
+    def handle(self, *args, **opts):
+        started = time.perf_counter()
+        backend = leaderboards.get_backend()
+
+        def progress(done, total):
+            self.stdout.write(f"{done}/{total} ads  {time.perf_counter() - started:.1f}s")
+
+        placed = leaderboards.rebuild(progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f"{placed} ads placed on the {type(backend).__name__} leaderboards "
+            f"(mean rating {backend.get_meta('mean'):.2f}) in {time.perf_counter() - started:.1f}s"
+        ))
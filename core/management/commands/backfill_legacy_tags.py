@@ -0,0 +1,74 @@
+# core/management/commands/backfill_legacy_tags.py
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core import caching, tasks
+from core.freshness import touch
+from core.imports import NameResolver, backfill_tags, missing_tag_links
+from core.models import Ad, Tag
+
+
+class Command(BaseCommand):
+    help = ("Copy the legacy comma-separated Ad.tags text into tags_m2m, in primary-key batches. "
+            "Safe to run against the live database and to rerun: only missing links are added.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="Ads read and linked per transaction (default: 1000)")
+        parser.add_argument("--after", type=int, default=0,
+                            help="Resume after this ad id (printed with every batch)")
+        parser.add_argument("--throttle", type=float, default=1.0,
+                            help="Sleep this many times as long as each batch took (default 1.0: "
+                                 "the backfill holds the database at most half the time)")
+        parser.add_argument("--dry-run", action="store_true",
+                            help="Only report the links that are missing; write nothing")
+
+    def handle(self, *args, **opts):
+        size, dry = max(opts["batch_size"], 1), opts["dry_run"]
+        legacy = Ad.objects.exclude(tags="").order_by("pk").values_list("pk", "tags")
+        last = opts["after"]
+        total = legacy.filter(pk__gt=last).count()
+        resolver = NameResolver(Tag)
+        scanned = links = 0
+        ads_changed = set()
+        started = time.perf_counter()
+
+        while batch := list(legacy.filter(pk__gt=last)[:size]):
+            batch_started = time.perf_counter()
+            if dry:
+                missing = missing_tag_links(batch)
+            else:
+                with transaction.atomic():
+                    missing = backfill_tags(batch, resolver)
+                    ad_ids = sorted({pk for pk, _ in missing})
+                    if ad_ids:
+                        # bulk_create skips m2m_changed: do what its receivers would
+                        touch(Ad, pk__in=ad_ids)
+                        tasks.reindex_ads.delay_on_commit(ad_ids)
+                    ads_changed.update(ad_ids)
+            last = batch[-1][0]
+            scanned += len(batch)
+            links += len(missing)
+
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"{scanned}/{total} ads ({scanned * 100 // max(total, 1)}%), "
+                f"{links} links {'missing' if dry else 'added'}, {scanned / elapsed:,.0f} ads/s, after id {last}"
+            )
+            time.sleep((time.perf_counter() - batch_started) * opts["throttle"])
+
+        if ads_changed:
+            caching.bump(*caching.INVALIDATES["Tag"])
+        if dry:
+            summary = f"{scanned} ads scanned, {links} links missing"
+        else:
+            summary = (f"{scanned} ads scanned, {links} links added to {len(ads_changed)} ads, "
+                       f"{resolver.created} tags created")
+        self.stdout.write(self.style.SUCCESS(f"{summary} in {time.perf_counter() - started:.1f}s"))
+        if opts["after"] == 0 and (links == 0 or not dry):
+            self.stdout.write(
+                "tags_m2m now holds every tag named in Ad.tags, so the legacy column can go: stop writing "
+                "it in core.imports, remove Ad.tags from core.models and run makemigrations."
+            )
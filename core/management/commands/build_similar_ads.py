@@ -0,0 +1,27 @@
+# core/management/commands/build_similar_ads.py
+import time
+from django.core.management.base import BaseCommand
+
+from core import similar
+
+
+class Command(BaseCommand):
+    help = "Recompute the similar-ads lists (SimilarAd) from tags, owners, year, credits and ratings"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top-k", type=int, default=similar.TOP_K, help=f"Neighbours per ad (default {similar.TOP_K})")
+        parser.add_argument("--block-size", type=int, default=similar.BLOCK,
+                            help=f"Ads per block and transaction (default {similar.BLOCK})")
+        parser.add_argument("--max-df", type=int, default=similar.MAX_DF,
+                            help=f"Features on more ads than this are left out of the dot products (default {similar.MAX_DF})")
+
+    def handle(self, *args, **opts):
+        started = time.perf_counter()
+
+        def progress(done, total):
+            self.stdout.write(f"{done}/{total} ads  {time.perf_counter() - started:.1f}s")
+
+        written = similar.build(opts["top_k"], opts["block_size"], opts["max_df"], progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f"{written} similar-ad rows written in {time.perf_counter() - started:.1f}s"
+        ))
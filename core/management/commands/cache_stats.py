@@ -0,0 +1,30 @@
+# core/management/commands/cache_stats.py
+from django.core.management.base import BaseCommand
+
+from core import caching
+
+
+class Command(BaseCommand):
+    help = "Hit/miss rates of the listing fragment cache (core.caching), across all workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true", help="Zero the counters after printing")
+        parser.add_argument("--invalidate", action="store_true", help="Bump every namespace version")
+
+    def handle(self, *args, **opts):
+        stats = caching.stats()
+        if not stats:
+            self.stdout.write("No fragment cache activity recorded.")
+        else:
+            self.stdout.write(f"{'fragment':<16} {'hits':>8} {'waits':>7} {'misses':>8} {'hit rate':>9}")
+            for name, c in stats.items():
+                served = c["hit"] + c["wait"]
+                total = served + c["miss"]
+                rate = f"{100 * served / total:.1f}%" if total else "-"
+                self.stdout.write(f"{name:<16} {c['hit']:>8} {c['wait']:>7} {c['miss']:>8} {rate:>9}")
+        if opts["reset"]:
+            caching.reset_stats()
+            self.stdout.write("Counters reset.")
+        if opts["invalidate"]:
+            caching.bump_all()
+            self.stdout.write("All cached fragments invalidated.")
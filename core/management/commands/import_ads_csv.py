@@ -1,11 +1,12 @@
 # core/management/commands/import_ads_csv.py
 import csv
+import time
 from pathlib import Path
 from django.core.management.base import BaseCommand, CommandError
-from django.utils.text import slugify
 
-from core.models import Ad, Brand, Agency, Tag
-from core.utils import extract_youtube_id
+from core.imports import (
+    AdBatchWriter, Checkpoint, ImportPlanner, csv_format, iter_chunks, iter_chunks_parallel, read_header,
+)
 
 
 class Command(BaseCommand):
@@ -14,9 +15,19 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument("csvfile", type=str, help="Path to CSV file")
         parser.add_argument("--dry-run", action="store_true",
-                            help="Print what would happen; do not write to DB")
+                            help="Print the per-row plan (create/update/unchanged/skip); do not write to DB")
         parser.add_argument("--append-tags", action="store_true",
                             help="Append tags instead of replacing existing ones")
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="Rows written per transaction (default: 1000)")
+        parser.add_argument("--resume", action="store_true",
+                            help="Continue after the last committed batch of a previous run")
+        parser.add_argument("--checkpoint", type=str, default=None,
+                            help="Checkpoint file (default: <csvfile>.checkpoint.json)")
+        parser.add_argument("--workers", type=int, default=1,
+                            help="Processes used to parse/normalise rows (default: 1). One writer still does "
+                                 "all the DB work and is usually the bottleneck, so this rarely speeds up "
+                                 "an import; it helps only when parsing is slow and the database is fast")
 
     # ---- helpers -------------------------------------------------------------
 
@@ -34,19 +45,6 @@ class Command(BaseCommand):
                 quoting = csv.QUOTE_MINIMAL
             return _Fallback()
 
-    def _split_tags(self, tags_str: str):
-        seen, out = set(), []
-        for piece in (tags_str or "").split(","):
-            name = piece.strip()
-            if not name:
-                continue
-            key = name.lower()
-            if key in seen:
-                continue
-            seen.add(key)
-            out.append(name)
-        return out
-
     # ---- main ---------------------------------------------------------------
 
     def handle(self, *args, **opts):
@@ -54,121 +52,109 @@ class Command(BaseCommand):
         if not path.exists():
             raise CommandError(f"File not found: {path}")
 
-        # Read file with BOM handling and delimiter sniffing
+        # BOM handling and delimiter sniffing; the body is then streamed
         with path.open(encoding="utf-8-sig", newline="") as f:
-            sample = f.read(2048)
-            f.seek(0)
-            dialect = self._detect_dialect(sample)
-            reader = csv.DictReader(f, dialect=dialect)
+            dialect = self._detect_dialect(f.read(2048))
+        fmt = csv_format(dialect)
+        header, offset, line = read_header(path, fmt)
 
-            fields = [ (c or "").strip().lower() for c in (reader.fieldnames or []) ]
-            required = {"title", "brand", "youtube"}
-            missing = required - set(fields)
-            if missing:
-                raise CommandError(f"CSV missing required columns: {', '.join(sorted(missing))}")
+        fields = [ (c or "").strip().lower() for c in header ]
+        required = {"title", "brand", "youtube"}
+        missing = required - set(fields)
+        if missing:
+            raise CommandError(f"CSV missing required columns: {', '.join(sorted(missing))}")
 
-            rows = list(reader)
+        dry = opts["dry_run"]
+        checkpoint = Checkpoint(path, opts["checkpoint"])
+        if opts["resume"] and not dry:
+            try:
+                state = checkpoint.load()
+            except ValueError as exc:
+                raise CommandError(f"{exc}; rerun without --resume") from exc
+            if state:
+                offset, line = state["offset"], state["line"]
+                self.stdout.write(f"Resuming after line {line} (byte {offset}) from {checkpoint.path}")
+            else:
+                self.stdout.write(f"No checkpoint at {checkpoint.path}; starting from the top")
 
-        self.stdout.write(f"Loaded {len(rows)} rows from {path}")
-        self.stdout.write(f"Detected delimiter: {repr(getattr(dialect, 'delimiter', ','))}")
+        self.stdout.write(f"Streaming rows from {path}")
+        self.stdout.write(f"Detected delimiter: {repr(fmt['delimiter'])}")
 
-        created, updated, skipped = 0, 0, 0
-        dry = opts["dry_run"]
-        append_tags = opts["append_tags"]
-
-        for i, raw in enumerate(rows, start=2):  # header is line 1
-            # Normalise keys -> lower/stripped
-            row = { (k or "").strip().lower(): (v or "").strip() for k, v in raw.items() }
-
-            title = row.get("title")
-            brand_name = row.get("brand")
-            agency_name = row.get("agency") or ""
-            year_str = row.get("year") or ""
-            youtube_in = row.get("youtube")
-            duration_str = row.get("duration_sec") or ""
-            tags_str = row.get("tags") or ""
-
-            if not title or not brand_name or not youtube_in:
-                self.stderr.write(f"[line {i}] missing title/brand/youtube → skipped")
-                skipped += 1
-                continue
+        batch_size = opts["batch_size"]
+        workers = opts["workers"]
+        verbose = opts["verbosity"] >= 2
+        if dry:
+            planner = ImportPlanner(append_tags=opts["append_tags"])
+        else:
+            writer = AdBatchWriter(append_tags=opts["append_tags"])
+        skipped = 0
+        started = time.perf_counter()
+
+        if workers > 1:
+            self.stdout.write(f"Parsing with {workers} worker processes")
+            chunks = iter_chunks_parallel(path, fmt, header, offset, line, workers)
+        else:
+            chunks = iter_chunks(path, fmt, header, offset, line, batch_size)
+
+        for chunk in chunks:
+            for n, reason in chunk.skipped:
+                self.stderr.write(f"[line {n}] {reason} → skipped")
+            skipped += len(chunk.skipped)
 
-            yt_id = extract_youtube_id(youtube_in)
-            if not yt_id:
-                self.stderr.write(f"[line {i}] invalid YouTube URL/ID: {youtube_in} → skipped")
-                skipped += 1
+            if dry:
+                for row, action, changes in planner.plan(chunk.rows):
+                    if action != "UNCHANGED" or verbose:
+                        self.stdout.write(f"[line {row.line}] {action}: {row.title} (yt:{row.youtube_id})"
+                                          + self._describe(changes))
                 continue
 
-            # Look up Brand/Agency by NAME (unique), slug is just a default
-            if dry:
-                brand = Brand(name=brand_name)
-                agency = Agency(name=agency_name) if agency_name else None
-            else:
-                brand, _ = Brand.objects.get_or_create(
-                    name=brand_name, defaults={"slug": slugify(brand_name)}
-                )
-                agency = None
-                if agency_name:
-                    agency, _ = Agency.objects.get_or_create(
-                        name=agency_name, defaults={"slug": slugify(agency_name)}
-                    )
-
-            # Prepare common fields
-            year = int(year_str) if year_str.isdigit() else None
-            duration = int(duration_str) if duration_str.isdigit() else None
-            tags_list = self._split_tags(tags_str)
-
-            # Upsert by youtube_id (natural key)
-            if dry:
-                # Simulate: check if an Ad *would* exist (best-effort)
-                # In dry-run we can’t hit DB reliably without reading, but we can just print
-                action = "CREATE or UPDATE"
-                self.stdout.write(f"[line {i}] {action}: {title} (yt:{yt_id})")
-            else:
-                ad, was_created = Ad.objects.get_or_create(
-                    youtube_id=yt_id,
-                    defaults={
-                        "title": title,
-                        "brand": brand,
-                        "agency": agency or None,
-                        "year": year,
-                        "duration_sec": duration,
-                        # store canonical URL; model clean/save will ensure this too
-                        "youtube_url": f"https://www.youtube.com/watch?v={yt_id}",
-                        # keep raw CSV text if you still have CharField 'tags'
-                        "tags": tags_str,
-                    },
-                )
-                if not was_created:
-                    # Update existing record
-                    ad.title = title
-                    ad.brand = brand
-                    ad.agency = agency or None
-                    ad.year = year
-                    ad.duration_sec = duration
-                    ad.youtube_url = f"https://www.youtube.com/watch?v={yt_id}"
-                    ad.tags = tags_str
-                    ad.save()
-                    updated += 1
-                    action = "UPDATED"
-                else:
-                    created += 1
-                    action = "CREATED"
-
-                # M2M tags (on your field 'tags_m2m')
-                if not append_tags:
-                    ad.tags_m2m.clear()
-                for name in tags_list:
-                    tag, _ = Tag.objects.get_or_create(
-                        name=name, defaults={"slug": slugify(name)}
-                    )
-                    ad.tags_m2m.add(tag)
-
-                self.stdout.write(f"[line {i}] {action}: {ad.title}")
+            for i in range(0, len(chunk.rows), batch_size):
+                self._flush(writer, chunk.rows[i:i + batch_size], verbose, started)
+            checkpoint.save(chunk.end_offset, chunk.last_line)
+        if not dry:
+            checkpoint.clear()  # finished: nothing to resume
 
+        elapsed = time.perf_counter() - started
+        if dry:
+            c = planner.counts
+            total = sum(c.values()) + skipped
+            self.stdout.write(self.style.SUCCESS(
+                f"Plan. Create: {c['CREATE']}, Update: {c['UPDATE']}, Unchanged: {c['UNCHANGED']}, "
+                f"Skip: {skipped}; new brands: {len(planner.new_brands)}, "
+                f"new agencies: {len(planner.new_agencies)}, new tags: {len(planner.new_tags)} "
+                f"({total} rows in {elapsed:.1f}s, {self._rate(total, elapsed)} rows/s)"
+            ))
+            self.stdout.write(self.style.WARNING("Dry run: no database writes were made."))
+            return
+
+        total = writer.created + writer.updated + skipped
         self.stdout.write(self.style.SUCCESS(
-            f"Done. Created: {created}, Updated: {updated}, Skipped: {skipped}"
+            f"Done. Created: {writer.created}, Updated: {writer.updated}, Skipped: {skipped} "
+            f"({total} rows in {elapsed:.1f}s, {self._rate(total, elapsed)} rows/s)"
         ))
 
-        if dry:
-            self.stdout.write(self.style.WARNING("Dry run: no database writes were made."))
\ No newline at end of file
+    def _flush(self, writer, batch, verbose, started):
+        for row, action in writer.write(batch):
+            if verbose:
+                self.stdout.write(f"[line {row.line}] {action}: {row.title}")
+        done = writer.created + writer.updated
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"… {done} ads written, up to line {batch[-1].line} "
+            f"({self._rate(done, elapsed)} rows/s)"
+        )
+
+    @staticmethod
+    def _describe(changes):
+        parts = []
+        for field, (old, new) in changes.items():
+            if field == "tags_m2m":
+                diff = [f"+{t}" for t in sorted(new - old)] + [f"-{t}" for t in sorted(old - new)]
+                parts.append(f"tags_m2m: {' '.join(diff)}")
+            else:
+                parts.append(f"{field}: {old!r} → {new!r}")
+        return f" [{'; '.join(parts)}]" if parts else ""
+
+    @staticmethod
+    def _rate(n, elapsed):
+        return f"{n / elapsed:,.0f}" if elapsed > 0 else "—"
@@ -0,0 +1,17 @@
+# core/management/commands/rebuild_collaborations.py
+import time
+from django.core.management.base import BaseCommand
+
+from core.collaborations import rebuild
+from core.models import Collaboration
+
+
+class Command(BaseCommand):
+    help = "Recompute who-worked-with-whom (Collaboration) from Credit"
+
+    def handle(self, *args, **opts):
+        started = time.perf_counter()
+        rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"{Collaboration.objects.count()} collaborations rebuilt in {time.perf_counter() - started:.1f}s"
+        ))
@@ -0,0 +1,24 @@
+# core/management/commands/rebuild_feeds.py
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import tasks
+from core.bulk import chunked
+from core.models import FeedItem, FeedTaste, Review
+
+
+class Command(BaseCommand):
+    help = 'Recompute every user\'s "for you" feed (FeedItem), in parallel across Celery workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=200, help="Users per task (default 200)")
+
+    def handle(self, *args, **opts):
+        FeedItem.objects.exclude(user_id__in=Review.objects.values("user_id")).delete()  # no reviews left
+        FeedTaste.objects.exclude(user_id__in=Review.objects.values("user_id")).delete()
+        user_ids = list(Review.objects.order_by("user_id").values_list("user_id", flat=True).distinct())
+        chunks = list(chunked(user_ids, opts["chunk_size"]))
+        for chunk in chunks:
+            tasks.refresh_feeds.delay(chunk)
+        how = "rebuilt inline" if settings.CELERY_TASK_ALWAYS_EAGER else f"queued in {len(chunks)} tasks"
+        self.stdout.write(self.style.SUCCESS(f"Feeds of {len(user_ids)} users {how}"))
@@ -0,0 +1,18 @@
+# core/management/commands/rebuild_rating_counters.py
+import time
+from django.core.management.base import BaseCommand
+
+from core.caching import bump_all
+from core.counters import rebuild_all
+
+
+class Command(BaseCommand):
+    help = "Recompute rating_sum/rating_count/num_ads on Ad, Brand and Agency from scratch"
+
+    def handle(self, *args, **opts):
+        started = time.perf_counter()
+        rebuild_all()
+        bump_all()  # cached listings show the counters
+        self.stdout.write(self.style.SUCCESS(
+            f"Rating counters rebuilt in {time.perf_counter() - started:.1f}s"
+        ))
@@ -0,0 +1,19 @@
+# core/management/commands/rebuild_search_index.py
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.search import get_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index for all ads"
+
+    def handle(self, *args, **opts):
+        backend = get_backend()
+        started = time.perf_counter()
+        with transaction.atomic():
+            backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"{type(backend).__name__}: index rebuilt in {time.perf_counter() - started:.1f}s"
+        ))
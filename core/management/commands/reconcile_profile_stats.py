@@ -0,0 +1,30 @@
+# core/management/commands/reconcile_profile_stats.py
+import time
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.counters import refresh_profile_stats
+from core.models import UserProfile
+
+STATS = ("rating_sum", "rating_count", *UserProfile.HISTOGRAM, "top_tags", "top_brands")
+
+
+class Command(BaseCommand):
+    help = "Recompute the review stats on every UserProfile from Review and report the ones that had drifted"
+
+    def handle(self, *args, **opts):
+        started = time.perf_counter()
+        missing = get_user_model().objects.filter(profile=None, reviews__isnull=False).distinct()
+        created = UserProfile.objects.bulk_create([UserProfile(user_id=pk) for pk in missing.values_list("pk", flat=True)])
+
+        before = {row[0]: row[1:] for row in UserProfile.objects.values_list("pk", *STATS).iterator(chunk_size=5000)}
+        refresh_profile_stats()
+        drifted = [row[0] for row in UserProfile.objects.values_list("pk", *STATS).iterator(chunk_size=5000)
+                   if before.get(row[0]) != row[1:]]
+        UserProfile.objects.filter(pk__in=drifted).update(updated_at=timezone.now())  # public pages re-render
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(before)} profiles checked ({len(created)} created), {len(drifted)} fixed "
+            f"in {time.perf_counter() - started:.1f}s"
+        ))
@@ -0,0 +1,16 @@
+# core/management/commands/roll_leaderboards.py
+import time
+from django.core.management.base import BaseCommand
+
+from core import leaderboards
+
+
+class Command(BaseCommand):
+    help = "Refresh the ads whose reviews left a trending window since the last roll (hourly, from cron)"
+
+    def handle(self, *args, **opts):
+        started = time.perf_counter()
+        refreshed = leaderboards.roll()
+        self.stdout.write(self.style.SUCCESS(
+            f"{refreshed} ads refreshed on the leaderboards in {time.perf_counter() - started:.1f}s"
+        ))
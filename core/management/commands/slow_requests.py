@@ -0,0 +1,100 @@
+# core/management/commands/slow_requests.py
+import json
+from collections import Counter, defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+SORT_KEYS = {
+    "total": lambda s: s["total_ms"],
+    "p95": lambda s: s["p95_ms"],
+    "count": lambda s: s["count"],
+    "queries": lambda s: s["avg_queries"],
+    "sql": lambda s: s["sql_ms"],
+}
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def _share(part, whole):
+    return f"{100 * part / whole:.0f}" if whole else "-"
+
+
+def log_files(log: Path):
+    """The log and its RotatingFileHandler backups (log.1, log.2, ...), oldest first."""
+    backups = [f for f in log.parent.glob(log.name + ".*") if f.suffix[1:].isdigit()]
+    backups.sort(key=lambda f: int(f.suffix[1:]), reverse=True)
+    return [f for f in backups + [log] if f.exists()]
+
+
+class Command(BaseCommand):
+    help = "Summarise the slow-request log written by core.profiling into the worst routes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--log", default=None, help="Log file (default settings.SLOW_REQUEST_LOG, rotated files included)")
+        parser.add_argument("--top", type=int, default=10)
+        parser.add_argument("--sort", choices=sorted(SORT_KEYS), default="total",
+                            help="total = summed time spent in the route (default)")
+        parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+
+    def handle(self, *args, **opts):
+        log = Path(opts["log"] or settings.SLOW_REQUEST_LOG)
+        files = log_files(log)
+        if not files:
+            raise CommandError(f"No slow-request log at {log}")
+
+        by_route = defaultdict(list)
+        bad = 0
+        for path in files:
+            with path.open(encoding="utf-8") as fh:
+                for line in fh:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        bad += 1
+                        continue
+                    by_route[(rec.get("method"), rec.get("route") or rec.get("path"))].append(rec)
+
+        summary = []
+        for (method, route), recs in by_route.items():
+            totals = [r["total_ms"] for r in recs]
+            dupes = Counter()
+            for r in recs:
+                for d in r.get("duplicates", []):
+                    dupes[d["sql"]] = max(dupes[d["sql"]], d["count"])
+            summary.append({
+                "route": route,
+                "method": method,
+                "count": len(recs),
+                "total_ms": round(sum(totals), 1),
+                "p50_ms": percentile(totals, 50),
+                "p95_ms": percentile(totals, 95),
+                "max_ms": max(totals),
+                "avg_queries": round(sum(r["queries"] for r in recs) / len(recs), 1),
+                "sql_ms": round(sum(r["sql_ms"] for r in recs), 1),
+                "template_ms": round(sum(r.get("template_ms", 0) for r in recs), 1),
+                "worst_duplicate": dupes.most_common(1)[0] if dupes else None,
+            })
+        summary.sort(key=SORT_KEYS[opts["sort"]], reverse=True)
+        summary = summary[:opts["top"]]
+
+        if opts["json"]:
+            self.stdout.write(json.dumps(summary, indent=2))
+            return
+
+        self.stdout.write(f"{'route':<32} {'n':>5} {'p50':>8} {'p95':>8} {'max':>8} {'queries':>8} {'sql%':>5} {'tpl%':>5}")
+        for s in summary:
+            self.stdout.write(
+                f"{s['method'] or '':<4}{s['route'][:28]:<28} {s['count']:>5} {s['p50_ms']:>8.0f} "
+                f"{s['p95_ms']:>8.0f} {s['max_ms']:>8.0f} {s['avg_queries']:>8.1f} "
+                f"{_share(s['sql_ms'], s['total_ms']):>5} {_share(s['template_ms'], s['total_ms']):>5}"
+            )
+            if s["worst_duplicate"]:
+                sql, n = s["worst_duplicate"]
+                self.stdout.write(self.style.WARNING(f"      x{n} {sql[:110]}"))
+        if bad:
+            self.stderr.write(f"{bad} unreadable line(s) skipped")
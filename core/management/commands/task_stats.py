@@ -0,0 +1,25 @@
+# core/management/commands/task_stats.py
+from django.core.management.base import BaseCommand
+
+from core import tasks
+
+
+class Command(BaseCommand):
+    help = "Runs, failures, retries and timings of the background tasks (core.tasks), across all workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true", help="Zero the counters after printing")
+
+    def handle(self, *args, **opts):
+        stats = tasks.stats()
+        if not stats:
+            self.stdout.write("No task activity recorded.")
+        else:
+            self.stdout.write(f"{'task':<32} {'runs':>7} {'failed':>7} {'retried':>7} {'avg ms':>8} {'max ms':>8}")
+            for name, c in stats.items():
+                avg = f"{c['total_ms'] / c['runs']:.0f}" if c["runs"] else "-"
+                self.stdout.write(f"{name.removeprefix('core.tasks.'):<32} {c['runs']:>7} {c['failures']:>7} "
+                                  f"{c['retries']:>7} {avg:>8} {c['max_ms']:>8}")
+        if opts["reset"]:
+            tasks.reset_stats()
+            self.stdout.write("Counters reset.")
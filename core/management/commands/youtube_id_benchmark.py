@@ -0,0 +1,97 @@
+# core/management/commands/youtube_id_benchmark.py
+import random
+import re
+import string
+import time
+from urllib.parse import parse_qs, urlparse
+
+from django.core.management.base import BaseCommand
+
+from core.utils import _extract, extract_youtube_id, extract_youtube_ids
+
+SHAPES = [
+    "{id}",
+    "https://www.youtube.com/watch?v={id}",
+    "https://youtube.com/watch?v={id}&t=42s",
+    "http://www.youtube.com/watch?feature=share&v={id}",
+    "https://m.youtube.com/watch?v={id}",
+    "https://music.youtube.com/watch?v={id}&list=RDAMVM{id}",
+    "www.youtube.com/watch?v={id}",
+    "https://youtu.be/{id}",
+    "https://youtu.be/{id}?si=Xb3kq0w9fA2",
+    "https://www.youtube.com/embed/{id}",
+    "https://www.youtube-nocookie.com/embed/{id}?rel=0",
+    "https://www.youtube.com/shorts/{id}",
+    "https://www.youtube.com/live/{id}?feature=share",
+    "https://www.youtube.com/channel/UC{id}",
+    "https://vimeo.com/123456789",
+]
+
+
+_LEGACY_ID_RE = re.compile(r"^[a-zA-Z0-9_-]{11}$")
+
+
+def legacy_extract(url):
+    """The parser this replaced: urlparse/parse_qs on every call."""
+    if _LEGACY_ID_RE.match(url):
+        return url
+    u = urlparse(url)
+    if u.netloc.endswith(("youtube.com", "youtu.be")):
+        if u.netloc.endswith("youtu.be"):
+            return u.path.strip("/").split("/")[0] or None
+        if u.path == "/watch":
+            return parse_qs(u.query).get("v", [None])[0]
+        parts = [p for p in u.path.split("/") if p]
+        return parts[-1] if parts else None
+    return None
+
+
+def best_of(repeat, fn):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+class Command(BaseCommand):
+    help = "Time YouTube id extraction (per call, memoised, batch) against the urlparse-based parser it replaced"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=100_000, help="Values per run (default 100000)")
+        parser.add_argument("--distinct", type=int, default=2000,
+                            help="Distinct ids among them, i.e. how often values repeat (default 2000)")
+        parser.add_argument("--repeat", type=int, default=5, help="Best of N runs (default 5)")
+
+    def handle(self, *args, **opts):
+        rnd = random.Random(0)
+        alphabet = string.ascii_letters + string.digits + "_-"
+        ids = ["".join(rnd.choices(alphabet, k=11)) for _ in range(opts["distinct"])]
+        values = [rnd.choice(SHAPES).format(id=rnd.choice(ids)) for _ in range(opts["count"])]
+        n = len(values)
+
+        def memoised():
+            extract_youtube_id.cache_clear()
+            for v in values:
+                extract_youtube_id(v)
+
+        runs = [
+            ("legacy", lambda: [legacy_extract(v) for v in values]),
+            ("per call", lambda: [_extract(v) for v in values]),
+            ("memoised", memoised),
+            ("batch", lambda: extract_youtube_ids(values)),
+        ]
+        self.stdout.write(f"{n} values, {len(set(values))} distinct, {len(SHAPES)} URL shapes")
+        baseline = None
+        for label, fn in runs:
+            seconds = best_of(opts["repeat"], fn)
+            baseline = baseline or seconds
+            self.stdout.write(f"{label:<10} {seconds * 1e9 / n:>8.0f} ns/value {baseline / seconds:>6.1f}x")
+
+        # where the two parsers disagree, by URL shape
+        for shape in SHAPES:
+            sample = shape.format(id=ids[0])
+            old, new = legacy_extract(sample), _extract(sample)
+            if old != new:
+                self.stdout.write(f"  {shape:<52} legacy={old!r} now={new!r}")
@@ -0,0 +1,76 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:52
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Ad = apps.get_model("core", "Ad")
+    Review = apps.get_model("core", "Review")
+
+    def total(qs, aggregate):
+        return Coalesce(Subquery(qs.annotate(v=aggregate).values("v")[:1]), 0,
+                        output_field=models.PositiveIntegerField())
+
+    reviews = Review.objects.filter(ad=OuterRef("pk")).order_by().values("ad")
+    Ad.objects.update(rating_sum=total(reviews, Sum("rating")),
+                      rating_count=total(reviews, Count("pk")))
+    for name, fk in (("Brand", "brand"), ("Agency", "agency")):
+        ads = Ad.objects.filter(**{fk: OuterRef("pk")}).order_by().values(fk)
+        apps.get_model("core", name).objects.update(
+            num_ads=total(ads, Count("pk")),
+            rating_sum=total(ads, Sum("rating_sum")),
+            rating_count=total(ads, Sum("rating_count")),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_alter_credit_unique_together_person_instagram_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ad',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='ad',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='agency',
+            name='num_ads',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='agency',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='agency',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='brand',
+            name='num_ads',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='brand',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='brand',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:54
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# The search structures are vendor specific, so they are created here rather
+# than declared on the model: a GIN index over Ad.search_vector on PostgreSQL,
+# an FTS5 table keyed by Ad.id on SQLite. Both are filled like core.search does.
+
+PG_VECTOR = """
+    setweight(to_tsvector('simple', coalesce(a.title, '')), 'A')
+    || setweight(to_tsvector('simple', coalesce(
+           (SELECT name FROM core_brand WHERE id = a.brand_id), '')), 'B')
+    || setweight(to_tsvector('simple', coalesce(
+           (SELECT name FROM core_agency WHERE id = a.agency_id), '')), 'B')
+    || setweight(to_tsvector('simple', coalesce(
+           (SELECT string_agg(t.name, ' ')
+              FROM core_ad_tags_m2m m JOIN core_tag t ON t.id = m.tag_id
+             WHERE m.ad_id = a.id), '')), 'C')
+"""
+
+SQLITE_SOURCE = """
+    SELECT a.id, a.title, b.name, COALESCE(g.name, ''),
+           COALESCE((SELECT group_concat(t.name, ' ')
+                       FROM core_ad_tags_m2m m JOIN core_tag t ON t.id = m.tag_id
+                      WHERE m.ad_id = a.id), '')
+      FROM core_ad a
+      JOIN core_brand b ON b.id = a.brand_id
+      LEFT JOIN core_agency g ON g.id = a.agency_id
+"""
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        schema_editor.execute("CREATE INDEX core_ad_search_vector_gin ON core_ad USING gin (search_vector)")
+        schema_editor.execute(f"UPDATE core_ad AS a SET search_vector = {PG_VECTOR}")
+    elif vendor == "sqlite":
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE core_ad_fts USING fts5("
+            "title, brand, agency, tags, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(f"INSERT INTO core_ad_fts (rowid, title, brand, agency, tags) {SQLITE_SOURCE}")
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS core_ad_search_vector_gin")
+    elif vendor == "sqlite":
+        schema_editor.execute("DROP TABLE IF EXISTS core_ad_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_rating_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ad',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
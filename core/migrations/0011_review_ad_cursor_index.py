@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:59
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_review_cursor_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['ad', '-created_at', 'id'], name='core_review_ad_id_15ca53_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_review_ad_cursor_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ad',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='agency',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='brand',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
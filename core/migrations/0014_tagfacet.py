@@ -0,0 +1,40 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import Coalesce
+
+
+def fill_facets(apps, schema_editor):
+    Ad = apps.get_model("core", "Ad")
+    TagFacet = apps.get_model("core", "TagFacet")
+    rows = (Ad.tags_m2m.through.objects.values("tag_id", year=Coalesce("ad__year", 0))
+            .annotate(n=Count("pk")).order_by())
+    TagFacet.objects.bulk_create(
+        (TagFacet(tag_id=r["tag_id"], year=r["year"], num_ads=r["n"]) for r in rows), batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_bulkjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveIntegerField(default=0)),
+                ('num_ads', models.IntegerField(default=0)),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facets', to='core.tag')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['year', 'tag'], name='core_tagfac_year_8b6d45_idx')],
+                'constraints': [models.UniqueConstraint(fields=('tag', 'year'), name='uniq_tag_year')],
+            },
+        ),
+        migrations.RunPython(fill_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, F, Max
+
+
+def fill_collaborations(apps, schema_editor):
+    Credit = apps.get_model("core", "Credit")
+    Collaboration = apps.get_model("core", "Collaboration")
+    rows = (Credit.objects.annotate(other=F("ad__credits__person_id")).exclude(other=F("person_id"))
+            .values_list("person_id", "other").annotate(n=Count("ad_id", distinct=True), last=Max("ad__year"))
+            .order_by())
+    Collaboration.objects.bulk_create(
+        (Collaboration(person_id=p, other_id=o, shared_ads=n, last_year=last) for p, o, n, last in rows),
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_tagfacet'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Collaboration',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shared_ads', models.IntegerField(default=0)),
+                ('last_year', models.PositiveIntegerField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='credit',
+            index=models.Index(fields=['person', 'role'], name='core_credit_person__1d1500_idx'),
+        ),
+        migrations.AddField(
+            model_name='collaboration',
+            name='other',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.person'),
+        ),
+        migrations.AddField(
+            model_name='collaboration',
+            name='person',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='collaborations', to='core.person'),
+        ),
+        migrations.AddIndex(
+            model_name='collaboration',
+            index=models.Index(fields=['person', '-shared_ads', 'other'], name='core_collab_person__df35c8_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='collaboration',
+            constraint=models.UniqueConstraint(fields=('person', 'other'), name='uniq_person_other'),
+        ),
+        migrations.RunPython(fill_collaborations, migrations.RunPython.noop),
+    ]
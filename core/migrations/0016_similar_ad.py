@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_collaboration'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarAd',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('ad', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar', to='core.ad')),
+                ('other', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.ad')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('ad', 'rank'), name='uniq_similar_ad_rank')],
+            },
+        ),
+    ]
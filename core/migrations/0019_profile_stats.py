@@ -0,0 +1,93 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:48
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_profile_stats(apps, schema_editor):
+    UserProfile = apps.get_model("core", "UserProfile")
+    Review = apps.get_model("core", "Review")
+    reviews = Review.objects.filter(user=OuterRef("user")).order_by().values("user")
+
+    def total(qs, aggregate):
+        return Coalesce(Subquery(qs.annotate(v=aggregate).values("v")[:1]), 0)
+
+    UserProfile.objects.update(
+        rating_sum=total(reviews, Sum("rating")),
+        rating_count=total(reviews, Count("pk")),
+        **{f"ratings_{r}": total(reviews.filter(rating=r), Count("pk")) for r in range(6)},
+    )
+    tops = defaultdict(lambda: {"top_tags": [], "top_brands": []})
+    sources = (("top_tags", "ad__tags_m2m"), ("top_brands", "ad__brand"))
+    for field, rel in sources:
+        rows = (Review.objects.exclude(**{rel: None}).order_by()
+                .values_list("user_id", f"{rel}__name", f"{rel}__slug").annotate(n=Count("pk")))
+        for user_id, name, slug, n in sorted(rows, key=lambda r: (r[0], -r[3], r[1])):
+            if len(tops[user_id][field]) < 5:
+                tops[user_id][field].append({"name": name, "slug": slug, "n": n})
+    for user_id, values in tops.items():
+        UserProfile.objects.filter(user_id=user_id).update(**values)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_leaderboards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='ratings_0',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='ratings_1',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='ratings_2',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='ratings_3',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='ratings_4',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='ratings_5',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='top_brands',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='top_tags',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.RunPython(fill_profile_stats, migrations.RunPython.noop),
+    ]
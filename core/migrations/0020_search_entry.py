@@ -0,0 +1,34 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:07
+
+import core.search
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_profile_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AdSearchEntry',
+            fields=[
+                ('ad', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='core.ad')),
+                ('document', core.search.FtsDocumentField(db_column='core_ad_fts')),
+            ],
+            options={
+                'db_table': 'core_ad_fts',
+                'managed': False,
+            },
+        ),
+        # Same tsvector column, now declared by core.search: nothing to do in the database.
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AlterField(
+                model_name='ad',
+                name='search_vector',
+                field=core.search.SearchVectorField(editable=False, null=True),
+            ),
+        ]),
+    ]
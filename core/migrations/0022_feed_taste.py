@@ -0,0 +1,30 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:16
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_updated_at_db_default'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedTaste',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('weights', models.JSONField(default=dict)),
+                ('ratings', models.JSONField(default=dict)),
+                ('as_of', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='feeditem',
+            name='bonus',
+            field=models.FloatField(default=0),
+        ),
+    ]
@@ -1,20 +1,59 @@
 # core/models.py
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.conf import settings
 from django.urls import reverse
 from django.core.exceptions import ValidationError
 from datetime import date
+from .search import FtsDocumentField, SearchVectorField
 from .utils import extract_youtube_id
 from django.utils.text import slugify
 from django.utils import timezone
+from django.db.models.functions import Now
+
+# ---------- Denormalised counters ----------
+
+class RatingCounters(models.Model):
+    """
+    Review totals stored on the row so listings don't aggregate at request time.
+    Maintained with F() increments by the receivers in signals.py and rebuilt
+    by ``manage.py rebuild_rating_counters``.
+    """
+    DERIVED_FIELDS = ("rating_sum", "rating_count")  # never written by save()
+
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def avg_rating(self):
+        return self.rating_sum / self.rating_count if self.rating_count else None
+
+    def save(self, *args, **kwargs):
+        # Derived fields only change through F()/set-based updates; a plain save
+        # of an instance loaded earlier must not write its stale copies back.
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.DERIVED_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
 
 # ---------- Core reference tables ----------
 
-class Brand(models.Model):
+class Brand(RatingCounters):
     name = models.CharField(max_length=200, unique=True)
     website = models.URLField(blank=True)
     slug = models.SlugField(max_length=220, unique=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # bumped by signals/counters whenever its page changes (HTTP Last-Modified)
+    # db_default: raw fixture loads (loaddata) skip auto_now
+    updated_at = models.DateTimeField(auto_now=True, db_default=Now())
+    num_ads = models.PositiveIntegerField(default=0, editable=False)
+
+    DERIVED_FIELDS = RatingCounters.DERIVED_FIELDS + ("num_ads",)
 
     class Meta:
         ordering = ["name"]
@@ -24,12 +63,18 @@ class Brand(models.Model):
         return reverse("brand_detail", args=[self.slug])
 
 
-class Agency(models.Model):
+class Agency(RatingCounters):
     name = models.CharField(max_length=200, unique=True)
     website = models.URLField(blank=True)
     country = models.CharField(max_length=120, blank=True)
     slug = models.SlugField(max_length=220, unique=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # bumped by signals/counters whenever its page changes (HTTP Last-Modified)
+    # db_default: raw fixture loads (loaddata) skip auto_now
+    updated_at = models.DateTimeField(auto_now=True, db_default=Now())
+    num_ads = models.PositiveIntegerField(default=0, editable=False)
+
+    DERIVED_FIELDS = RatingCounters.DERIVED_FIELDS + ("num_ads",)
 
     class Meta:
         ordering = ["name"]
@@ -56,7 +101,27 @@ class Tag(models.Model):
     slug = models.SlugField(max_length=60, unique=True, blank=True)
     def __str__(self): return self.name
 
-class Ad(models.Model):
+
+class TagFacet(models.Model):
+    """Ads per tag and year, kept current by core.facets. Year 0: year unknown."""
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name="facets")
+    year = models.PositiveIntegerField(default=0)
+    num_ads = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["tag", "year"], name="uniq_tag_year"),
+        ]
+        indexes = [models.Index(fields=["year", "tag"])]  # per-year tag counts
+
+    def __str__(self) -> str:
+        return f"{self.tag_id}/{self.year or '?'}: {self.num_ads}"
+
+
+DUPLICATE_VIDEO = "This YouTube video is already in Holograms."
+
+
+class Ad(RatingCounters):
     title = models.CharField(max_length=255)
     brand = models.ForeignKey(Brand, on_delete=models.PROTECT, related_name="ads")
     agency = models.ForeignKey(Agency, on_delete=models.PROTECT, related_name="ads",
@@ -68,12 +133,31 @@ class Ad(models.Model):
     tags = models.CharField(max_length=250, blank=True, help_text="Comma-separated")
     tags_m2m = models.ManyToManyField(Tag, blank=True, related_name="ads")
     created_at = models.DateTimeField(auto_now_add=True)
+    # bumped by signals/counters when reviews, credits or tags change (HTTP Last-Modified)
+    # db_default: raw fixture loads (loaddata) skip auto_now
+    updated_at = models.DateTimeField(auto_now=True, db_default=Now())
+    # maintained by core.search on PostgreSQL (GIN index added in migration 0009)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    DERIVED_FIELDS = RatingCounters.DERIVED_FIELDS + ("search_vector",)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remembered so signals can tell when an ad moves between brands/agencies
+        instance._loaded_owners = (instance.__dict__.get("brand_id"), instance.__dict__.get("agency_id"))
+        return instance
+
+    @property
+    def num_reviews(self):
+        return self.rating_count
+
     def clean(self):
         # Year sanity
         if self.year and (self.year < 1900 or self.year > date.today().year + 1):
             raise ValidationError({"year": "Year looks out of range."})
 
-        # Normalise YouTube and enforce uniqueness at the form/ORM level
+        # Normalise YouTube
         yt_input = (self.youtube_url or "").strip()
         yt_id = extract_youtube_id(yt_input)
         if not yt_id:
@@ -84,12 +168,33 @@ class Ad(models.Model):
         # Optional: keep youtube_url as a canonical watch url
         self.youtube_url = f"https://www.youtube.com/watch?v={yt_id}"
 
-        # Check for duplicates in DB (exclude self when editing)
-        qs = Ad.objects.filter(youtube_id=yt_id)
-        if self.pk:
-            qs = qs.exclude(pk=self.pk)
-        if qs.exists():
-            raise ValidationError({"youtube_url": "This YouTube video is already in Holograms."})
+        # Duplicates are left to the unique index on youtube_id: save() turns the
+        # IntegrityError into DUPLICATE_VIDEO, and clean_batch() checks many at once.
+
+    @classmethod
+    def clean_batch(cls, ads) -> dict[int, ValidationError]:
+        """
+        ``clean()`` for many ads at once, e.g. before a ``bulk_create``. Also
+        reports videos repeated within the batch or already stored, with one
+        ``IN`` query in all. Returns ``{index in ads: ValidationError}``.
+        """
+        errors, first = {}, {}
+        for i, ad in enumerate(ads):
+            try:
+                ad.clean()
+            except ValidationError as exc:
+                errors[i] = exc
+                continue
+            if ad.youtube_id in first:
+                errors[i] = ValidationError({"youtube_url": DUPLICATE_VIDEO})
+            else:
+                first[ad.youtube_id] = i
+        stored = cls.objects.filter(youtube_id__in=list(first)).order_by().values_list("youtube_id", "pk")
+        for yt_id, pk in stored:
+            i = first[yt_id]
+            if ads[i].pk != pk:
+                errors[i] = ValidationError({"youtube_url": DUPLICATE_VIDEO})
+        return dict(sorted(errors.items()))
 
     def save(self, *args, **kwargs):
         # Belt-and-braces: ensure youtube_id is set before saving
@@ -99,7 +204,16 @@ class Ad(models.Model):
                 self.youtube_id = yt_id
                 # keep canonical form
                 self.youtube_url = f"https://www.youtube.com/watch?v={yt_id}"
-        super().save(*args, **kwargs)
+        try:
+            # a savepoint, so a caller that catches the ValidationError inside its own
+            # atomic() block can go on (PostgreSQL aborts the whole transaction otherwise)
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+        except IntegrityError as exc:
+            # rolled back to the savepoint: ask the table whether the video is taken
+            if not Ad.objects.filter(youtube_id=self.youtube_id).exclude(pk=self.pk).exists():
+                raise
+            raise ValidationError({"youtube_url": DUPLICATE_VIDEO}) from exc
 
     class Meta:
         indexes = [
@@ -115,6 +229,20 @@ class Ad(models.Model):
         return reverse("ad_detail", args=[self.pk])
 
 
+class AdSearchEntry(models.Model):
+    """
+    A row of the SQLite FTS5 table of core.search (created by migration 0009).
+    Only joined to match and rank ads; core.search writes the table with SQL.
+    """
+    ad = models.OneToOneField(Ad, on_delete=models.DO_NOTHING, primary_key=True, db_column="rowid",
+                              db_constraint=False, related_name="search_entry")
+    document = FtsDocumentField(db_column="core_ad_fts")
+
+    class Meta:
+        managed = False
+        db_table = "core_ad_fts"
+
+
 ROLE_CHOICES = [
     ("CD", "Creative Director"),
     ("CW", "Copywriter"),
@@ -139,8 +267,16 @@ class Credit(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['ad', 'person', 'role'], name='uniq_ad_person_role'),
         ]
+        indexes = [models.Index(fields=['person', 'role'])]  # filmographies, per role
         ordering = ['ad_id', 'role', 'person__name']
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remembered so signals can update collaborations when a credit is moved
+        instance._loaded = (instance.__dict__.get("ad_id"), instance.__dict__.get("person_id"))
+        return instance
+
     def __str__(self) -> str:
         return f"{self.person.name} · {self.get_role_display()} · {self.ad.title}"
     
@@ -155,11 +291,82 @@ class Review(models.Model):
 
     class Meta:
         unique_together = ("ad", "user")  # one review per user per ad
+        indexes = [
+            models.Index(fields=["user", "-created_at", "id"]),  # profile_public cursor pages
+            models.Index(fields=["ad", "-created_at", "id"]),    # ad_detail review pages
+            models.Index(fields=["created_at"]),                 # leaderboard windows (core.leaderboards)
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remembered so signals can apply the rating delta on update/delete
+        instance._loaded = (instance.__dict__.get("ad_id"), instance.__dict__.get("rating"))
+        return instance
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(savepoint=False):  # the author's profile stats change with it (signals.py)
+            super().save(*args, **kwargs)
 
     def __str__(self) -> str:
         return f"{self.user} → {self.ad} ({self.rating})"
+
+
+class LeaderboardEntry(models.Model):
+    """
+    One ad on one leaderboard (``key``, e.g. ``trending:24h:tag:7``): the
+    database stand-in for a Redis sorted set, see core.leaderboards.
+    """
+    key = models.CharField(max_length=64)
+    member = models.BigIntegerField()  # Ad id; deleted ads are skipped when read
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["key", "member"], name="uniq_leaderboard_member"),
+        ]
+        indexes = [models.Index(fields=["key", "-score", "member"])]  # top N: one index range
+
+    def __str__(self) -> str:
+        return f"{self.key}: {self.member} ({self.score})"
+
+
+class FeedItem(models.Model):
+    """One ad of a user's "for you" feed, ``rank`` 1 first. Written in bulk by core.feed."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="feed")
+    ad = models.ForeignKey(Ad, on_delete=models.CASCADE, related_name="+")
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+    bonus = models.FloatField(default=0)  # the similarity part of score, carried over by incremental updates
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "rank"], name="uniq_feed_user_rank"),  # also the read index
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.user_id} #{self.rank}: {self.ad_id}"
+
+
+class FeedTaste(models.Model):
+    """The taste profile a user's feed was last computed with, so a new review can be folded in (core.feed)."""
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name="+")
+    weights = models.JSONField(default=dict)  # {"brand:3": weight, "tag:7": ...}
+    ratings = models.JSONField(default=dict)  # {"ad id": rating} of the reviews the weights average over
+    as_of = models.DateTimeField(null=True)  # the latest Review.updated_at they include
+
+    def __str__(self) -> str:
+        return f"{self.user_id}: {len(self.weights)} features over {len(self.ratings)} reviews"
     
-class UserProfile(models.Model):
+class UserProfile(RatingCounters):
+    """
+    Also carries the user's review stats (RatingCounters, a histogram and the
+    tags/brands they review most), kept by core.counters so the public profile
+    never aggregates.
+    """
+    HISTOGRAM = tuple(f"ratings_{r}" for r in range(6))
+    DERIVED_FIELDS = RatingCounters.DERIVED_FIELDS + HISTOGRAM + ("top_tags", "top_brands")
+
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="profile")
     display_name = models.CharField(max_length=120, blank=True)
     city = models.CharField(max_length=120, blank=True)
@@ -167,9 +374,27 @@ class UserProfile(models.Model):
     avatar = models.ImageField(upload_to="avatars/", blank=True, null=True)  # needs MEDIA config
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # reviews with each rating, 0..5
+    ratings_0 = models.PositiveIntegerField(default=0, editable=False)
+    ratings_1 = models.PositiveIntegerField(default=0, editable=False)
+    ratings_2 = models.PositiveIntegerField(default=0, editable=False)
+    ratings_3 = models.PositiveIntegerField(default=0, editable=False)
+    ratings_4 = models.PositiveIntegerField(default=0, editable=False)
+    ratings_5 = models.PositiveIntegerField(default=0, editable=False)
+    # [{"name": .., "slug": .., "n": reviews}, ...], most reviewed first
+    top_tags = models.JSONField(default=list, blank=True, editable=False)
+    top_brands = models.JSONField(default=list, blank=True, editable=False)
+
     def get_absolute_url(self):
         return reverse("profile_public", args=[self.user.username])
 
+    @property
+    def histogram(self):
+        """``[(rating, count, percent of the busiest rating), ...]`` for 0..5."""
+        counts = [getattr(self, f) for f in self.HISTOGRAM]
+        peak = max(counts) or 1
+        return [(r, n, round(100 * n / peak)) for r, n in enumerate(counts)]
+
     def __str__(self) -> str:
         return self.display_name or self.user.username
     
@@ -196,6 +421,45 @@ class Person(models.Model):
         super().save(*args, **kwargs)
 
 
+class Collaboration(models.Model):
+    """
+    Two people credited on the same ads, stored once per direction so a person's
+    collaborators are one index range. Kept current by core.collaborations.
+    """
+    person = models.ForeignKey(Person, on_delete=models.CASCADE, related_name="collaborations")
+    other = models.ForeignKey(Person, on_delete=models.CASCADE, related_name="+")
+    shared_ads = models.IntegerField(default=0)
+    last_year = models.PositiveIntegerField(null=True, blank=True)  # latest year of a shared ad
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["person", "other"], name="uniq_person_other"),
+        ]
+        indexes = [models.Index(fields=["person", "-shared_ads", "other"])]  # most frequent first
+
+    def __str__(self) -> str:
+        return f"{self.person_id} + {self.other_id}: {self.shared_ads}"
+
+
+class SimilarAd(models.Model):
+    """
+    The nearest neighbours of an ad by cosine similarity of its features,
+    ``rank`` 1 first. Written in bulk by core.similar, never edited.
+    """
+    ad = models.ForeignKey(Ad, on_delete=models.CASCADE, related_name="similar")
+    other = models.ForeignKey(Ad, on_delete=models.CASCADE, related_name="+")
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["ad", "rank"], name="uniq_similar_ad_rank"),  # also the read index
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.ad_id} ~ {self.other_id} ({self.score:.2f})"
+
+
 # A small, editable set of roles; keep simple for now.
 class AdRole(models.TextChoices):
     DIRECTOR = "director", "Director"
@@ -210,3 +474,35 @@ class AdRole(models.TextChoices):
 
 
     
+
+
+# ---------- Background admin jobs ----------
+
+class BulkJob(models.Model):
+    """A bulk admin operation too large to run inside the request (see core.bulk)."""
+    ACTIONS = [
+        ("apply_tag", "Apply tag"),
+        ("remove_tag", "Remove tag"),
+        ("reassign", "Reassign brand/agency"),
+    ]
+    STATUSES = [("queued", "Queued"), ("running", "Running"), ("done", "Done"), ("failed", "Failed")]
+
+    action = models.CharField(max_length=20, choices=ACTIONS)
+    params = models.JSONField(default=dict)   # ad_ids plus the action's arguments
+    total = models.PositiveIntegerField(default=0)
+    done = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUSES, default="queued")
+    error = models.TextField(blank=True)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self) -> str:
+        return f"#{self.pk} {self.get_action_display()} ({self.done}/{self.total})"
+
+    @property
+    def percent(self):
+        return round(100 * self.done / self.total) if self.total else 100
@@ -0,0 +1,203 @@
+# core/pagination.py
+"""
+Keyset ("cursor") pagination.
+
+Instead of ``OFFSET n`` the next page is fetched with a ``WHERE`` on the sort
+key of the last row shown, so page 500 costs the same as page 1, and no
+``COUNT(*)`` is run. Cursors are opaque URL-safe tokens; a missing or
+malformed one means the first page.
+
+The sort key is the queryset's ``order_by()`` (or the model's Meta ordering)
+plus ``pk`` as a tie-breaker; keys may follow foreign keys (``ad__year``),
+which should then be ``select_related``. Nullable columns keep the
+database's natural NULL placement so existing indexes such as
+``Ad(-year, title)`` still serve the ``ORDER BY``.
+"""
+import base64
+import binascii
+import json
+from functools import reduce
+from operator import attrgetter, or_
+from typing import NamedTuple
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import connection
+from django.db.models import Q
+
+
+class _Key(NamedTuple):
+    name: str
+    desc: bool
+    nullable: bool
+    nulls_last: bool
+
+    def flipped(self):
+        return self._replace(desc=not self.desc, nulls_last=not self.nulls_last)
+
+    @property
+    def order(self):
+        return f"-{self.name}" if self.desc else self.name
+
+    def after(self, value):
+        """Rows strictly after ``value`` on this key alone (None: no such rows)."""
+        if value is None:
+            return None if self.nulls_last else Q(**{f"{self.name}__isnull": False})
+        beyond = Q(**{f"{self.name}__{'lt' if self.desc else 'gt'}": value})
+        if self.nullable and self.nulls_last:
+            beyond |= Q(**{f"{self.name}__isnull": True})
+        return beyond
+
+    def equal(self, value):
+        return Q(**{f"{self.name}__isnull": True}) if value is None else Q(**{self.name: value})
+
+
+def _seek(keys, values):
+    """``(k1, k2, ...) > (v1, v2, ...)`` in the ordering described by ``keys``."""
+    terms, prefix = [], Q()
+    for key, value in zip(keys, values):
+        after = key.after(value)
+        if after is not None:
+            terms.append(prefix & after)
+        prefix &= key.equal(value)
+    return reduce(or_, terms) if terms else Q(pk__in=[])
+
+
+def _field_path(model, name):
+    """The fields along ``name``, e.g. ``ad__year`` -> [Credit.ad, Ad.year]."""
+    path = []
+    for part in name.split("__"):
+        if model is None:
+            raise FieldDoesNotExist(name)
+        path.append(model._meta.get_field(part))
+        model = path[-1].related_model
+    return path
+
+
+class CursorPage:
+    is_cursor = True
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.next_url = self.previous_url = None
+        self.total = None               # optional, set by the caller
+        self.total_is_estimate = False
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class CursorPaginator:
+    def __init__(self, queryset, per_page: int, ordering=None):
+        self.queryset = queryset
+        self.per_page = per_page
+        model = queryset.model
+        names = list(ordering or queryset.query.order_by or model._meta.ordering)
+        if not all(isinstance(n, str) for n in names):
+            raise ValueError("CursorPaginator needs field-name ordering")
+        if not {"pk", "-pk", "id", "-id"} & set(names):
+            names.append("pk")
+
+        largest = connection.features.nulls_order_largest
+        self.keys, self._to_python, self._getters = [], [], []
+        for n in names:
+            desc, name = n.startswith("-"), n.lstrip("-")
+            try:
+                path = _field_path(model, name)
+                nullable, to_python = any(f.null for f in path), path[-1].to_python
+            except FieldDoesNotExist:  # pk alias or annotation
+                nullable, to_python = False, None
+            self.keys.append(_Key(name, desc, nullable, nulls_last=largest != desc))
+            self._to_python.append(to_python)
+            self._getters.append(attrgetter(name.replace("__", ".")))  # related keys: select_related them
+
+    # ---- tokens --------------------------------------------------------------------
+
+    def _encode(self, direction, obj):
+        values = [get(obj) for get in self._getters]
+        raw = json.dumps([direction, values], default=str, separators=(",", ":"))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+    def _decode(self, token):
+        try:
+            raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+            direction, values = json.loads(raw)
+            if direction not in ("n", "p") or len(values) != len(self.keys):
+                return None
+            values = [
+                conv(v) if conv and v is not None else v
+                for conv, v in zip(self._to_python, values)
+            ]
+            return direction, values
+        except (ValueError, TypeError, binascii.Error, ValidationError):
+            return None
+
+    # ---- pages -----------------------------------------------------------------------
+
+    def get_page(self, token=None) -> CursorPage:
+        decoded = self._decode(token) if token else None
+        n = self.per_page
+
+        if decoded is None:
+            rows = list(self.queryset.order_by(*(k.order for k in self.keys))[:n + 1])
+            more = len(rows) > n
+            rows = rows[:n]
+            return CursorPage(rows, self._encode("n", rows[-1]) if more else None, None)
+
+        direction, values = decoded
+        if direction == "n":
+            rows = list(self.queryset.filter(_seek(self.keys, values))
+                        .order_by(*(k.order for k in self.keys))[:n + 1])
+            more = len(rows) > n
+            rows = rows[:n]
+            return CursorPage(
+                rows,
+                self._encode("n", rows[-1]) if more else None,
+                self._encode("p", rows[0]) if rows else None,
+            )
+
+        flipped = [k.flipped() for k in self.keys]
+        rows = list(self.queryset.filter(_seek(flipped, values))
+                    .order_by(*(k.order for k in flipped))[:n + 1])
+        more = len(rows) > n
+        rows = rows[:n][::-1]
+        return CursorPage(
+            rows,
+            self._encode("n", rows[-1]) if rows else None,
+            self._encode("p", rows[0]) if more else None,
+        )
+
+
+def paginate(request, queryset, per_page, *, total=None, estimate_cap=None, param="cursor"):
+    """
+    Cursor-paginate ``queryset`` for ``request`` and attach ``next_url`` /
+    ``previous_url`` that keep the other query parameters. Pass ``total`` when
+    it is known for free (e.g. a stored counter), or ``estimate_cap`` to count
+    at most that many rows and show "N+" beyond it.
+    """
+    page = CursorPaginator(queryset, per_page).get_page(request.GET.get(param))
+    for attr, token in (("next_url", page.next_cursor), ("previous_url", page.previous_cursor)):
+        if token:
+            params = request.GET.copy()
+            params[param] = token
+            params.pop("page", None)
+            setattr(page, attr, f"?{params.urlencode()}")
+    if total is not None:
+        page.total = total
+    elif estimate_cap:
+        counted = queryset.order_by()[:estimate_cap + 1].count()
+        page.total = min(counted, estimate_cap)
+        page.total_is_estimate = counted > estimate_cap
+    return page
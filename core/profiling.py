@@ -0,0 +1,178 @@
+# core/profiling.py
+"""
+Opt-in per-request profiling.
+
+``ProfilingMiddleware`` counts and times every SQL query (through
+``connection.execute_wrapper``, so it works with ``DEBUG = False``), times
+template rendering and the view, and fingerprints queries so the same statement
+run many times in one request -- the N+1 signature -- stands out. Templates
+are timed by swapping ``Template.render`` only while a profiled request runs
+(``timed_templates``); it is put back when the last one finishes.
+
+Sampled requests get a ``Server-Timing`` header (visible in the browser's
+network panel). Those over a threshold are also written as one JSON object
+per line to the ``holograms.slow_requests`` logger, which settings.py sends to
+a rotating file. ``manage.py slow_requests`` summarises that file.
+
+Settings (``PROFILING`` dict, all optional):
+    ENABLED        middleware is removed at startup unless true
+    SAMPLE_RATE    fraction of requests profiled (0..1)
+    SLOW_MS        log requests slower than this
+    SLOW_QUERIES   ... or running more queries than this
+    DUPLICATES     ... or repeating one query fingerprint this many times
+    SERVER_TIMING  add the Server-Timing header to profiled responses
+"""
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.base import Template
+
+logger = logging.getLogger("holograms.slow_requests")
+
+DEFAULTS = {
+    "ENABLED": False,
+    "SAMPLE_RATE": 1.0,
+    "SLOW_MS": 500,
+    "SLOW_QUERIES": 50,
+    "DUPLICATES": 5,
+    "SERVER_TIMING": True,
+}
+
+_IN_LIST_RE = re.compile(r"\((?:%s, )+%s\)")
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+def fingerprint(sql: str) -> str:
+    """The statement with literals and IN-list lengths collapsed."""
+    sql = _IN_LIST_RE.sub("(...)", sql)
+    return _LITERAL_RE.sub("?", sql)
+
+
+class RequestProfile:
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.fingerprints = Counter()
+        self._render_depth = 0
+
+    # connection.execute_wrapper hook
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_seconds += time.perf_counter() - started
+            self.queries += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self, at_least=2):
+        return [(fp, n) for fp, n in self.fingerprints.most_common() if n >= at_least]
+
+
+_current: ContextVar[RequestProfile | None] = ContextVar("request_profile", default=None)
+_original_render = Template.render
+_patch_lock = threading.Lock()
+_patched = {"depth": 0, "render": None}  # the Template.render replaced while profiled requests run
+
+
+def _timed_render(template, context):
+    render = _patched["render"] or _original_render
+    profile = _current.get()
+    if profile is None:
+        return render(template, context)  # another thread's unprofiled request
+    # only the outermost render counts; includes and form widgets nest inside it
+    profile._render_depth += 1
+    started = time.perf_counter()
+    try:
+        return render(template, context)
+    finally:
+        profile._render_depth -= 1
+        if not profile._render_depth:
+            profile.template_seconds += time.perf_counter() - started
+
+
+@contextmanager
+def timed_templates():
+    """Route ``Template.render`` through ``_timed_render`` while any profiled request is running."""
+    with _patch_lock:
+        if not _patched["depth"]:
+            _patched["render"], Template.render = Template.render, _timed_render
+        _patched["depth"] += 1
+    try:
+        yield
+    finally:
+        with _patch_lock:
+            _patched["depth"] -= 1
+            if not _patched["depth"]:
+                Template.render, _patched["render"] = _patched["render"], None
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.conf = {**DEFAULTS, **getattr(settings, "PROFILING", {})}
+        if not self.conf["ENABLED"]:
+            raise MiddlewareNotUsed
+
+    def __call__(self, request):
+        if random.random() >= self.conf["SAMPLE_RATE"]:
+            return self.get_response(request)
+
+        profile = RequestProfile()
+        token = _current.set(profile)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                stack.enter_context(timed_templates())
+                for conn in connections.all():
+                    stack.enter_context(conn.execute_wrapper(profile))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = time.perf_counter() - started
+
+        timings = {
+            "total_ms": round(total * 1000, 2),
+            "sql_ms": round(profile.sql_seconds * 1000, 2),
+            "template_ms": round(profile.template_seconds * 1000, 2),
+            # the view's own time, including the queries it ran before rendering
+            "view_ms": round((total - profile.template_seconds) * 1000, 2),
+        }
+        if self.conf["SERVER_TIMING"]:
+            response["Server-Timing"] = ", ".join([
+                f'sql;dur={timings["sql_ms"]};desc="{profile.queries} queries"',
+                f'tpl;dur={timings["template_ms"]}',
+                f'view;dur={timings["view_ms"]}',
+                f'total;dur={timings["total_ms"]}',
+            ])
+
+        duplicates = profile.duplicates()
+        worst_duplicate = duplicates[0][1] if duplicates else 0
+        if (timings["total_ms"] >= self.conf["SLOW_MS"]
+                or profile.queries >= self.conf["SLOW_QUERIES"]
+                or worst_duplicate >= self.conf["DUPLICATES"]):
+            match = getattr(request, "resolver_match", None)
+            logger.info(json.dumps({
+                "ts": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "method": request.method,
+                "path": request.path,
+                "route": match.route if match else None,
+                "view": match.view_name if match else None,
+                "status": response.status_code,
+                "queries": profile.queries,
+                **timings,
+                "duplicates": [{"sql": fp[:500], "count": n} for fp, n in duplicates[:5]],
+            }))
+        return response
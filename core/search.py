@@ -0,0 +1,198 @@
+# core/search.py
+"""
+Pluggable full-text search over ads (title, brand, agency and tag names).
+
+``get_backend()`` picks the backend from ``settings.SEARCH_BACKEND`` (a dotted
+path) or, by default, from the database vendor:
+
+* PostgreSQL -- ``Ad.search_vector`` (GIN-indexed tsvector) ranked with
+  ``SearchRank``;
+* SQLite     -- an FTS5 virtual table ``core_ad_fts`` ranked with ``bm25()``,
+  joined through the unmanaged ``AdSearchEntry`` model;
+* anything else falls back to the old ``icontains`` filters.
+
+Indexes are kept in sync by signals.py (ad save/delete, tag and brand/agency
+changes) and by the CSV importer; ``manage.py rebuild_search_index`` rebuilds
+them from scratch.
+"""
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection, models
+from django.db.models import F, FloatField, Lookup, Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def search_terms(q: str) -> list[str]:
+    return _TERM_RE.findall((q or "").lower())
+
+
+# ---- fields ------------------------------------------------------------------------
+
+class SearchVectorField(models.Field):
+    """A ``tsvector`` column, declared without importing django.contrib.postgres.
+
+    Only ``PostgresBackend`` fills and reads it; elsewhere it stays NULL.
+    """
+
+    def db_type(self, connection):
+        return "tsvector"
+
+
+class FtsDocumentField(models.TextField):
+    """An FTS5 table's hidden column of the same name, which ``MATCH`` searches in full."""
+
+
+@FtsDocumentField.register_lookup
+class Match(Lookup):
+    lookup_name = "match"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} MATCH {rhs}", [*lhs_params, *rhs_params]
+
+
+class SearchBackend:
+    """Base class; ``search`` must return ``queryset`` filtered and ordered by relevance."""
+
+    def search(self, queryset, q: str):
+        raise NotImplementedError
+
+    def index_ads(self, ad_ids):
+        """(Re)index the given ads; ids that no longer exist are dropped."""
+
+    def remove_ads(self, ad_ids):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+class IcontainsBackend(SearchBackend):
+    """Unranked substring match; used where no full-text engine is available."""
+
+    def search(self, queryset, q):
+        return queryset.filter(
+            Q(title__icontains=q) | Q(brand__name__icontains=q) | Q(agency__name__icontains=q)
+        )
+
+
+class SqliteFtsBackend(SearchBackend):
+    """FTS5 table ``core_ad_fts`` (created by migration 0009), rowid = ``Ad.id``; model ``AdSearchEntry``."""
+
+    table = "core_ad_fts"
+    # bm25 column weights: title, brand, agency, tags
+    weights = "10.0, 5.0, 5.0, 2.0"
+
+    _source = """
+        SELECT a.id, a.title, b.name, COALESCE(g.name, ''),
+               COALESCE((SELECT group_concat(t.name, ' ')
+                           FROM core_ad_tags_m2m m JOIN core_tag t ON t.id = m.tag_id
+                          WHERE m.ad_id = a.id), '')
+          FROM core_ad a
+          JOIN core_brand b ON b.id = a.brand_id
+          LEFT JOIN core_agency g ON g.id = a.agency_id
+    """
+
+    def _match(self, q):
+        # every term as a quoted prefix query, implicitly AND-ed
+        return " ".join('"%s"*' % t.replace('"', '""') for t in search_terms(q))
+
+    def search(self, queryset, q):
+        match = self._match(q)
+        if not match:
+            return queryset.none()
+        # A plain join so MATCH and bm25() run once per query, not once per
+        # candidate row (a correlated subquery took seconds on broad terms).
+        # bm25() takes the FTS table itself, which the join names after it.
+        return (queryset
+                .filter(search_entry__document__match=match)
+                .annotate(rank=RawSQL(f"-bm25({self.table}, {self.weights})", [], output_field=FloatField()))
+                .order_by("-rank", "-year", "title"))
+
+    def index_ads(self, ad_ids):
+        ad_ids = list(ad_ids)
+        if not ad_ids:
+            return
+        with connection.cursor() as cur:
+            for i in range(0, len(ad_ids), 500):
+                chunk = ad_ids[i:i + 500]
+                marks = ", ".join(["%s"] * len(chunk))
+                cur.execute(f"DELETE FROM {self.table} WHERE rowid IN ({marks})", chunk)
+                cur.execute(
+                    f"INSERT INTO {self.table} (rowid, title, brand, agency, tags) "
+                    f"{self._source} WHERE a.id IN ({marks})", chunk,
+                )
+
+    def remove_ads(self, ad_ids):
+        ad_ids = list(ad_ids)
+        with connection.cursor() as cur:
+            for i in range(0, len(ad_ids), 500):
+                chunk = ad_ids[i:i + 500]
+                cur.execute(f"DELETE FROM {self.table} WHERE rowid IN ({', '.join(['%s'] * len(chunk))})", chunk)
+
+    def rebuild(self):
+        with connection.cursor() as cur:
+            cur.execute(f"DELETE FROM {self.table}")
+            cur.execute(f"INSERT INTO {self.table} (rowid, title, brand, agency, tags) {self._source}")
+
+
+class PostgresBackend(SearchBackend):
+    """Weighted tsvector in ``Ad.search_vector`` with a GIN index (migration 0009)."""
+
+    config = "simple"  # ad titles and brand names are not English prose
+
+    _vector = """
+        setweight(to_tsvector('{cfg}', coalesce(a.title, '')), 'A')
+        || setweight(to_tsvector('{cfg}', coalesce(
+               (SELECT name FROM core_brand WHERE id = a.brand_id), '')), 'B')
+        || setweight(to_tsvector('{cfg}', coalesce(
+               (SELECT name FROM core_agency WHERE id = a.agency_id), '')), 'B')
+        || setweight(to_tsvector('{cfg}', coalesce(
+               (SELECT string_agg(t.name, ' ')
+                  FROM core_ad_tags_m2m m JOIN core_tag t ON t.id = m.tag_id
+                 WHERE m.ad_id = a.id), '')), 'C')
+    """
+
+    def search(self, queryset, q):
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorExact
+
+        terms = search_terms(q)
+        if not terms:
+            return queryset.none()
+        query = SearchQuery(" & ".join(f"{t}:*" for t in terms), config=self.config, search_type="raw")
+        return (queryset.filter(SearchVectorExact(F("search_vector"), query))  # search_vector @@ query
+                .annotate(rank=SearchRank(F("search_vector"), query))
+                .order_by("-rank", "-year", "title"))
+
+    def _update(self, where="", params=()):
+        with connection.cursor() as cur:
+            cur.execute(
+                f"UPDATE core_ad AS a SET search_vector = {self._vector.format(cfg=self.config)} {where}",
+                params,
+            )
+
+    def index_ads(self, ad_ids):
+        ad_ids = list(ad_ids)
+        if ad_ids:
+            self._update("WHERE a.id = ANY(%s)", [ad_ids])
+
+    def rebuild(self):
+        self._update()
+
+
+@lru_cache(maxsize=None)
+def get_backend() -> SearchBackend:
+    path = getattr(settings, "SEARCH_BACKEND", None)
+    if path:
+        return import_string(path)()
+    if connection.vendor == "postgresql":
+        return PostgresBackend()
+    if connection.vendor == "sqlite":
+        return SqliteFtsBackend()
+    return IcontainsBackend()
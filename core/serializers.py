@@ -0,0 +1,248 @@
+# core/serializers.py
+"""
+Read-only serializers behind ``/api/v1/`` (core/api.py).
+
+``?fields=title,year,brand.name`` keeps only the named fields; dotted names
+reach into included objects. ``?include=brand,credits.person`` swaps a related
+id for the nested object. ``ReadSerializer.optimise`` turns both into
+``select_related`` / ``Prefetch`` on the queryset, so a page costs the same
+few queries whatever its size and serializing never hits the database.
+
+Serializing is the hot loop of every list endpoint. ``to_representation``
+therefore resolves the readable fields once per serializer into a plan of
+``(name, getter, to_representation)`` and runs one tight loop per object,
+instead of going through DRF's generic per-field ``get_attribute``. Field
+sources must be plain attributes (dotted is fine, callables are not); use a
+``SerializerMethodField`` for anything computed. Per-object ``reverse()``
+and time zone lookups are hoisted out too (``PathField``, ``DateTimeField``).
+``manage.py api_benchmark`` compares the two paths.
+"""
+from functools import cached_property
+from operator import attrgetter
+
+from django.db import models
+from django.db.models import Prefetch
+from django.urls import reverse
+from rest_framework import serializers
+
+from .models import Ad, Agency, Brand, Credit, Person, Review, Tag
+
+
+def parse_tree(value):
+    """``"a,b.c,b.d"`` -> ``{"a": {}, "b": {"c": {}, "d": {}}}``; None when not given."""
+    if value is None:
+        return None
+    tree = {}
+    for path in value.split(","):
+        node = tree
+        for part in filter(None, (p.strip() for p in path.split("."))):
+            node = node.setdefault(part, {})
+    return tree
+
+
+def _identity(obj):
+    return obj
+
+
+class DateTimeField(serializers.DateTimeField):
+    """Looks the current time zone up once per field instead of once per value."""
+
+    @cached_property
+    def timezone(self):
+        return self.default_timezone()
+
+
+class PathField(serializers.Field):
+    """The page URL of the object; the route is reversed once, not per object."""
+    _MARK = "9999999999"  # valid for int, slug and str converters
+
+    def __init__(self, view_name, lookup="pk", **kwargs):
+        super().__init__(source=lookup, read_only=True, **kwargs)
+        self.view_name = view_name
+
+    @cached_property
+    def _template(self):
+        return reverse(self.view_name, args=[self._MARK]).replace(self._MARK, "{}")
+
+    def to_representation(self, value):
+        return self._template.format(value)
+
+
+class ReadSerializer(serializers.ModelSerializer):
+    serializer_field_mapping = {**serializers.ModelSerializer.serializer_field_mapping,
+                                models.DateTimeField: DateTimeField}
+
+    # name -> (serializer class, many); rendered only when named in ?include=
+    includes = {}
+    # field -> relation it reads (a lookup or a Prefetch), loaded only when the field is shown
+    related = {}
+
+    def __init__(self, *args, fields=None, include=None, **kwargs):
+        self.selected = fields or {}   # empty: every field
+        self.include = include or {}
+        super().__init__(*args, **kwargs)
+
+    # ---- ?fields= / ?include= ------------------------------------------------------
+
+    @classmethod
+    def field_names(cls):
+        return set(cls.Meta.fields) | set(cls.includes)
+
+    @classmethod
+    def check_params(cls, fields=None, include=None, path=""):
+        """Raise ValidationError for unknown names, before any query is built."""
+        fields, include = fields or {}, include or {}
+        errors = {}
+        unknown = set(fields) - cls.field_names()
+        if unknown:
+            errors["fields"] = [f"Unknown field {path}{n}" for n in sorted(unknown)]
+        unknown = set(include) - set(cls.includes)
+        if unknown:
+            errors["include"] = [f"Cannot include {path}{n}" for n in sorted(unknown)]
+        for name, sub in fields.items():
+            if sub and name not in cls.includes:
+                errors.setdefault("fields", []).append(f"{path}{name} has no sub-fields")
+        if errors:
+            raise serializers.ValidationError(errors)
+        for name, (nested, _) in cls.includes.items():
+            if name in fields or name in include:
+                nested.check_params(fields.get(name), include.get(name), f"{path}{name}.")
+
+    @classmethod
+    def wanted(cls, name, fields):
+        return not fields or name in fields
+
+    @classmethod
+    def optimise(cls, queryset, fields=None, include=None, prefix=""):
+        """Add the joins and prefetches needed to serialize ``queryset`` without further queries."""
+        fields, include = fields or {}, include or {}
+        model = cls.Meta.model
+        for name, lookup in cls.related.items():
+            if cls.wanted(name, fields):
+                if isinstance(lookup, Prefetch):
+                    lookup = Prefetch(prefix + lookup.prefetch_through, queryset=lookup.queryset,
+                                      to_attr=lookup.to_attr)
+                    queryset = queryset.prefetch_related(lookup)
+                else:
+                    queryset = queryset.select_related(prefix + lookup)
+        for name, (nested, many) in cls.includes.items():
+            if name not in include or not cls.wanted(name, fields):
+                continue
+            if many:
+                related_model = model._meta.get_field(name).related_model
+                inner = nested.optimise(related_model._default_manager.all(), fields.get(name), include[name])
+                queryset = queryset.prefetch_related(Prefetch(prefix + name, queryset=inner))
+            else:
+                queryset = queryset.select_related(prefix + name)
+                queryset = nested.optimise(queryset, fields.get(name), include[name], f"{prefix}{name}__")
+        return queryset
+
+    def get_fields(self):
+        fields = super().get_fields()
+        for name, (nested, many) in self.includes.items():
+            if name in self.include:
+                fields[name] = nested(many=many, read_only=True,
+                                      fields=self.selected.get(name), include=self.include[name])
+        if self.selected:
+            fields = {name: f for name, f in fields.items() if name in self.selected}
+        return fields
+
+    # ---- output ----------------------------------------------------------------------
+
+    @cached_property
+    def _plan(self):
+        return [
+            (name, _identity if field.source == "*" else attrgetter(field.source), field.to_representation)
+            for name, field in self.fields.items() if not field.write_only
+        ]
+
+    def to_representation(self, instance):
+        data = {}
+        for name, get, represent in self._plan:
+            value = get(instance)
+            data[name] = None if value is None else represent(value)
+        return data
+
+
+# ---- resources -------------------------------------------------------------------
+
+class PersonSerializer(ReadSerializer):
+    url = PathField("person_detail", "slug")
+
+    class Meta:
+        model = Person
+        fields = ("id", "name", "slug", "website", "twitter", "instagram", "url")
+
+
+class BrandSerializer(ReadSerializer):
+    avg_rating = serializers.FloatField(read_only=True)
+    url = PathField("brand_detail", "slug")
+
+    class Meta:
+        model = Brand
+        fields = ("id", "name", "slug", "website", "num_ads", "rating_count", "avg_rating",
+                  "created_at", "updated_at", "url")
+
+
+class AgencySerializer(BrandSerializer):
+    url = PathField("agency_detail", "slug")
+
+    class Meta:
+        model = Agency
+        fields = BrandSerializer.Meta.fields + ("country",)
+
+
+class CreditSerializer(ReadSerializer):
+    ad = serializers.IntegerField(source="ad_id", read_only=True)
+    person = serializers.IntegerField(source="person_id", read_only=True)
+    company = serializers.IntegerField(source="company_id", read_only=True)
+    role_name = serializers.SerializerMethodField()
+
+    includes = {"person": (PersonSerializer, False), "company": (AgencySerializer, False)}
+
+    class Meta:
+        model = Credit
+        fields = ("id", "ad", "person", "role", "role_name", "company")
+
+    def get_role_name(self, obj):
+        return obj.get_role_display()
+
+
+class AdSerializer(ReadSerializer):
+    brand = serializers.IntegerField(source="brand_id", read_only=True)
+    agency = serializers.IntegerField(source="agency_id", read_only=True)
+    avg_rating = serializers.FloatField(read_only=True)
+    tags = serializers.SerializerMethodField()
+    url = PathField("ad_detail")
+
+    includes = {
+        "brand": (BrandSerializer, False),
+        "agency": (AgencySerializer, False),
+        "credits": (CreditSerializer, True),
+    }
+    # a plain list: cheaper to read than building a related manager per ad
+    related = {"tags": Prefetch("tags_m2m", queryset=Tag.objects.order_by("name"), to_attr="tag_list")}
+
+    class Meta:
+        model = Ad
+        fields = ("id", "title", "year", "youtube_id", "youtube_url", "duration_sec", "brand", "agency",
+                  "tags", "rating_count", "avg_rating", "created_at", "updated_at", "url")
+
+    def get_tags(self, obj):
+        tags = getattr(obj, "tag_list", None)  # absent when not loaded through optimise()
+        return [t.name for t in (obj.tags_m2m.all() if tags is None else tags)]
+
+
+CreditSerializer.includes = {**CreditSerializer.includes, "ad": (AdSerializer, False)}
+
+
+class ReviewSerializer(ReadSerializer):
+    ad = serializers.IntegerField(source="ad_id", read_only=True)
+    user = serializers.CharField(source="user.username", read_only=True)
+
+    includes = {"ad": (AdSerializer, False)}
+    related = {"user": "user"}
+
+    class Meta:
+        model = Review
+        fields = ("id", "ad", "user", "rating", "body", "created_at", "updated_at")
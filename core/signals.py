@@ -1,9 +1,326 @@
+from collections import Counter
+
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db.models import DEFERRED
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
-from .models import UserProfile
+from . import caching, collaborations, facets, tasks
+from .counters import apply_ad_delta, apply_profile_delta, refresh_owner_totals, refresh_profile_stats
+from .freshness import touch, touch_reviewers
+from .models import Ad, Agency, Brand, Credit, Person, Review, Tag, UserProfile
+from .search import get_backend
+from .suggest import KIND_OF_MODEL, SOURCES, index as suggest_index
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_profile_on_user_create(sender, instance, created, **kwargs):
     if created:
-        UserProfile.objects.get_or_create(user=instance)
\ No newline at end of file
+        UserProfile.objects.get_or_create(user=instance)
+
+
+# ---- rating counters -----------------------------------------------------------
+# raw saves (loaddata) are skipped: run `manage.py rebuild_rating_counters` after.
+# Review counters are reconciled after commit by a task (core.tasks); the ad's
+# updated_at is stamped right away because its review list changes now.
+# The author's profile stats change in the review's own transaction.
+
+def _review_changed(ad_ids):
+    ad_ids = sorted({pk for pk in ad_ids if pk is not None})
+    touch(Ad, pk__in=ad_ids)
+    tasks.reconcile_ads.delay_on_commit(ad_ids)
+
+
+@receiver(post_save, sender=Review)
+def count_review_on_save(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    old_ad, old_rating = getattr(instance, "_loaded", (None, None))
+    _review_changed([instance.ad_id, old_ad])
+    if created or old_rating is not None:
+        apply_profile_delta(instance.user_id, None if created else old_rating, instance.rating)
+    else:
+        refresh_profile_stats([instance.user_id])  # saved without a loaded copy: recount
+        touch(UserProfile, user_id=instance.user_id)
+    instance._loaded = (instance.ad_id, instance.rating)
+
+
+@receiver(post_delete, sender=Review)
+def count_review_on_delete(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Ad) or getattr(origin, "model", None) is Ad:
+        return  # the ad is going too; count_ad_on_delete recomputes its owners and reviewers
+    old_ad, old_rating = getattr(instance, "_loaded", (None, None))
+    _review_changed([instance.ad_id, old_ad])
+    apply_profile_delta(instance.user_id, instance.rating if old_rating is None else old_rating, None)
+
+
+@receiver(post_save, sender=Ad)
+def count_ad_on_save(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    owners = (instance.brand_id, instance.agency_id)
+    if created:
+        apply_ad_delta(*owners, 1)
+    else:
+        old_brand, old_agency = getattr(instance, "_loaded_owners", owners)
+        if old_brand != instance.brand_id:
+            refresh_owner_totals(Brand, [old_brand, instance.brand_id])
+        if old_agency != instance.agency_id:
+            refresh_owner_totals(Agency, [old_agency, instance.agency_id])
+    instance._loaded_owners = owners
+
+
+@receiver(pre_delete, sender=Ad)
+def remember_reviewers(sender, instance, **kwargs):
+    instance._reviewers = list(instance.reviews.values_list("user_id", flat=True))
+
+
+@receiver(post_delete, sender=Ad)
+def count_ad_on_delete(sender, instance, **kwargs):
+    refresh_owner_totals(Brand, [instance.brand_id])
+    refresh_owner_totals(Agency, [instance.agency_id])
+    if getattr(instance, "_reviewers", None):
+        refresh_profile_stats(instance._reviewers)
+        touch(UserProfile, user_id__in=instance._reviewers)
+
+
+# ---- search index ----------------------------------------------------------------
+
+@receiver(post_save, sender=Ad)
+def index_ad_on_save(sender, instance, raw, **kwargs):
+    if not raw:
+        get_backend().index_ads([instance.pk])
+
+
+@receiver(post_delete, sender=Ad)
+def unindex_ad_on_delete(sender, instance, **kwargs):
+    get_backend().remove_ads([instance.pk])
+
+
+# renames and tag changes can touch many ads: reindexed by tasks after commit
+
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Agency)
+@receiver(post_save, sender=Tag)
+def reindex_ads_on_rename(sender, instance, created, raw, **kwargs):
+    if not created and not raw:
+        tasks.reindex_owned_ads.delay_on_commit(sender.__name__.lower(), instance.pk)
+
+
+@receiver(pre_delete, sender=Tag)
+def remember_tagged_ads(sender, instance, **kwargs):
+    instance._cleared_ad_ids = list(instance.ads.values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+def reindex_ads_on_tag_delete(sender, instance, **kwargs):
+    tasks.reindex_ads.delay_on_commit(getattr(instance, "_cleared_ad_ids", []))
+
+
+@receiver(m2m_changed, sender=Ad.tags_m2m.through)
+def reindex_ads_on_tags_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == "pre_clear":
+        # Tag.ads.clear(): remember which ads lose the tag
+        instance._cleared_ad_ids = list(instance.ads.values_list("pk", flat=True))
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        tasks.reindex_ads.delay_on_commit([instance.pk])
+    elif action == "post_clear":
+        tasks.reindex_ads.delay_on_commit(getattr(instance, "_cleared_ad_ids", []))
+    else:
+        tasks.reindex_ads.delay_on_commit(sorted(pk_set or []))
+
+
+# ---- tag facets (see core.facets) --------------------------------------------------
+# counted in the same transaction as the link change
+
+@receiver(m2m_changed, sender=Ad.tags_m2m.through)
+def count_tag_facets(sender, instance, action, reverse, pk_set, **kwargs):
+    own, other = ("tag_id", "ad_id") if reverse else ("ad_id", "tag_id")
+    if action in ("pre_remove", "pre_clear"):
+        # pk_set of a remove may name links that don't exist: count what is there
+        gone = sender.objects.filter(**{own: instance.pk})
+        if action == "pre_remove":
+            gone = gone.filter(**{f"{other}__in": pk_set or []})
+        instance._facet_links = list(gone.values_list("ad_id", "tag_id"))
+    elif action in ("post_remove", "post_clear"):
+        facets.apply(facets.count(getattr(instance, "_facet_links", []), -1))
+    elif action == "post_add" and pk_set:  # only the links actually added
+        pairs = ((ad_id, instance.pk) for ad_id in pk_set) if reverse else ((instance.pk, t) for t in pk_set)
+        facets.apply(facets.count(pairs))
+
+
+def move_tag_facets(ad, old_year):
+    # after the save: the links are counted under the new year, they were under old_year
+    after = facets.links(ad_ids=[ad.pk])
+    before = Counter()
+    for (tag, _), n in after.items():
+        before[tag, old_year or 0] += n
+    facets.apply(facets.change(before, after))
+
+
+@receiver(pre_delete, sender=Ad)
+def uncount_tag_facets_on_ad_delete(sender, instance, **kwargs):
+    # the links go by cascade, without m2m_changed
+    facets.apply(facets.change(facets.links(ad_ids=[instance.pk]), {}))
+
+
+# ---- collaborations (see core.collaborations) ----------------------------------------
+
+@receiver(post_save, sender=Credit)
+def count_collaborations_on_credit_save(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    current, old = (instance.ad_id, instance.person_id), getattr(instance, "_loaded", None)
+    if created:
+        collaborations.credit_added(*current)
+    elif old and old != current:
+        old_ad, old_person = old  # moved: as if deleted there
+        collaborations.refresh(old_person, collaborations.people_on(old_ad, exclude=old_person))
+        collaborations.credit_added(*current)
+    instance._loaded = current
+
+
+@receiver(pre_delete, sender=Credit)
+def remember_credited_people(sender, instance, **kwargs):
+    # taken before any row goes: a delete may remove several credits of the ad at once
+    instance._ad_people = collaborations.people_on(instance.ad_id, exclude=instance.person_id)
+
+
+@receiver(post_delete, sender=Credit)
+def count_collaborations_on_credit_delete(sender, instance, **kwargs):
+    others = getattr(instance, "_ad_people", None)
+    if others:
+        collaborations.refresh(instance.person_id, others)
+
+
+# ---- ad year edits ---------------------------------------------------------------------
+
+def _writes_year(instance, raw, update_fields):
+    return not raw and not instance._state.adding and (update_fields is None or "year" in update_fields)
+
+
+@receiver(pre_save, sender=Ad)
+def read_saved_year(sender, instance, raw, update_fields, **kwargs):
+    # from the row, not from the instance: it may be stale or have loaded the year deferred
+    if _writes_year(instance, raw, update_fields):
+        instance._saved_year = Ad.objects.filter(pk=instance.pk).values_list("year", flat=True).first()
+
+
+@receiver(post_save, sender=Ad)
+def follow_year_edit(sender, instance, created, raw, update_fields, **kwargs):
+    old = instance.__dict__.pop("_saved_year", DEFERRED)
+    if not created and old is not DEFERRED and old != instance.year:
+        move_tag_facets(instance, old)
+        collaborations.refresh_ad(instance.pk)  # shared-ad years
+
+
+# ---- leaderboards (see core.leaderboards) ---------------------------------------------
+# an edited ad may have changed scope, a deleted one leaves every board
+
+@receiver(post_save, sender=Ad)
+def replace_ad_on_boards(sender, instance, created, raw, **kwargs):
+    if not created and not raw:
+        tasks.reconcile_ads.delay_on_commit([instance.pk])
+
+
+@receiver(post_delete, sender=Ad)
+def remove_ad_from_boards(sender, instance, **kwargs):
+    tasks.reconcile_ads.delay_on_commit([instance.pk])
+
+
+# ---- suggest index (this process only; see core.suggest) ----------------------------
+
+def update_suggest_index(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    kind = KIND_OF_MODEL[sender]
+    label = getattr(instance, SOURCES[kind][1])
+    suggest_index.upsert(kind, instance.pk, label, instance.pk if kind == "ad" else instance.slug)
+
+
+def remove_from_suggest_index(sender, instance, **kwargs):
+    suggest_index.remove(KIND_OF_MODEL[sender], instance.pk)
+
+
+for _model in (Ad, Brand, Agency, Person, Tag):
+    post_save.connect(update_suggest_index, sender=_model, dispatch_uid=f"suggest-save-{_model.__name__}")
+    post_delete.connect(remove_from_suggest_index, sender=_model, dispatch_uid=f"suggest-delete-{_model.__name__}")
+
+
+# ---- page cache (see core.caching) ----------------------------------------------------
+
+def invalidate_page_cache(sender, **kwargs):
+    caching.bump(*caching.INVALIDATES[sender.__name__])
+
+
+for _model in (Ad, Review, Brand, Agency, Tag):
+    post_save.connect(invalidate_page_cache, sender=_model, dispatch_uid=f"cache-save-{_model.__name__}")
+    post_delete.connect(invalidate_page_cache, sender=_model, dispatch_uid=f"cache-delete-{_model.__name__}")
+
+
+@receiver(m2m_changed, sender=Ad.tags_m2m.through)
+def invalidate_page_cache_on_tags_change(sender, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        caching.bump(*caching.INVALIDATES["Tag"])
+
+
+# ---- last-modified stamps (see core.freshness) ------------------------------------
+# Reviews and ad counts are stamped by core.counters; these cover the rest.
+
+@receiver(post_save, sender=Ad)
+def touch_pages_on_ad_edit(sender, instance, created, raw, **kwargs):
+    if not created and not raw:  # the ad's title/year show on its brand and agency pages, and its reviewers'
+        touch(Brand, pk=instance.brand_id)
+        if instance.agency_id:
+            touch(Agency, pk=instance.agency_id)
+        touch_reviewers(pk=instance.pk)
+
+
+@receiver(post_save, sender=Credit)
+@receiver(post_delete, sender=Credit)
+def touch_ad_on_credit_change(sender, instance, raw=False, **kwargs):
+    if not raw:
+        touch(Ad, pk=instance.ad_id)
+
+
+@receiver(post_save, sender=Person)
+def touch_ads_on_person_rename(sender, instance, created, raw, **kwargs):
+    if not created and not raw:
+        touch(Ad, credits__person=instance)
+
+
+@receiver(post_save, sender=Brand)
+def touch_pages_on_brand_rename(sender, instance, created, raw, **kwargs):
+    if not created and not raw:  # agency pages and reviewers' profiles list brand names
+        touch(Agency, ads__brand=instance)
+        touch_reviewers(brand=instance)
+
+
+@receiver(post_save, sender=Agency)
+def touch_pages_on_agency_rename(sender, instance, created, raw, **kwargs):
+    if not created and not raw:  # brand pages list agency names, ad credits name companies
+        touch(Brand, ads__agency=instance)
+        touch(Ad, credits__company=instance)
+
+
+@receiver(post_save, sender=Tag)
+def touch_ads_on_tag_rename(sender, instance, created, raw, **kwargs):
+    if not created and not raw:
+        touch(Ad, tags_m2m=instance)
+
+
+@receiver(post_delete, sender=Tag)
+def touch_ads_on_tag_delete(sender, instance, **kwargs):
+    touch(Ad, pk__in=getattr(instance, "_cleared_ad_ids", []))  # set by remember_tagged_ads
+
+
+@receiver(m2m_changed, sender=Ad.tags_m2m.through)
+def touch_ads_on_tags_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        touch(Ad, pk=instance.pk)
+    elif action == "post_clear":
+        touch(Ad, pk__in=getattr(instance, "_cleared_ad_ids", []))
+    else:
+        touch(Ad, pk__in=pk_set or [])
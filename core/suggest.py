@@ -0,0 +1,222 @@
+# core/suggest.py
+"""
+In-process prefix index behind ``/api/suggest/``.
+
+Names of ads, brands, agencies, people and tags are folded (lower-case, no
+accents) and indexed at every word start, so "spl" finds "The Epic Split".
+The index is two parallel sorted arrays -- ``keys`` and the entity ``slots``
+they point at -- so a lookup is a ``bisect`` plus a short scan: O(log n + k).
+A slot is stored as ``~slot`` for keys that start mid-name, which lets results
+whose name starts with the prefix rank first without re-folding labels.
+
+Each process builds its own copy on first use (``config/wsgi.py`` warms it at
+worker start) and keeps it current from model signals. Signalled names go to
+a small sorted ``recent`` list, searched alongside the main arrays and merged
+into them every ``MERGE_AT`` keys, so an update costs O(log n) amortised
+instead of a list insert into the big arrays. Deletes only blank the entity's
+slot; the merge drops its keys. Changes made in other processes (other
+workers, CSV imports) are picked up by a full rebuild once the index is older
+than ``settings.SUGGEST_REFRESH_SECONDS`` (default 600). That rebuild runs in
+a background thread: requests keep using the old arrays until it swaps the
+new ones in, and changes signalled meanwhile are replayed onto them.
+
+Memory: ~75 MB per 100k entities whose names average 3.5 words (350k keys),
+measured with tracemalloc on CPython 3.11 -- about 210 bytes per key, so it
+scales with words per name. Building that index takes a few seconds.
+"""
+import heapq
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import connection
+from django.urls import NoReverseMatch, reverse
+
+from .models import Ad, Agency, Brand, Person, Tag
+
+# kind -> (model, label field)
+SOURCES = {
+    "ad": (Ad, "title"),
+    "brand": (Brand, "name"),
+    "agency": (Agency, "name"),
+    "person": (Person, "name"),
+    "tag": (Tag, "name"),
+}
+KIND_OF_MODEL = {model: kind for kind, (model, _) in SOURCES.items()}
+
+MAX_SCAN = 2000  # keys inspected per lookup, whatever the prefix
+MERGE_AT = 1000  # signalled keys held apart from the main arrays
+
+
+def fold(text: str) -> str:
+    if text.isascii():
+        return text.casefold()
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in text if not unicodedata.combining(c)).casefold()
+
+
+def _word_keys(label: str) -> list[str]:
+    """The folded name from each word start; the first key is the whole name."""
+    words = fold(label or "").split()
+    return [" ".join(words[i:]) for i in range(len(words))]
+
+
+def _tagged(slot: int, keys: list[str]):
+    return [(key, slot if n == 0 else ~slot) for n, key in enumerate(keys)]
+
+
+_url_templates: dict[str, str | None] = {}
+
+
+def entity_url(kind, pk, slug):
+    # reverse() once per kind and format afterwards: it costs ~40µs a call
+    if kind not in _url_templates:
+        try:
+            if kind == "ad":
+                tpl = reverse("ad_detail", args=[987654321]).replace("987654321", "{pk}")
+            elif kind == "tag":
+                tpl = f"{reverse('search')}?tag={{slug}}"
+            else:
+                tpl = reverse(f"{kind}_detail", args=["slug-placeholder"]).replace("slug-placeholder", "{slug}")
+        except NoReverseMatch:
+            tpl = None
+        _url_templates[kind] = tpl
+    tpl = _url_templates[kind]
+    return tpl.format(pk=pk, slug=slug) if tpl and (kind == "ad" or slug) else None
+
+
+class PrefixIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.keys: list[str] = []
+        self.slots: list[int] = []
+        self.recent: list[tuple[str, int]] = []  # (key, slot) not merged into keys/slots yet
+        self.entities: list[tuple | None] = []   # slot -> (kind, pk, label, slug)
+        self.slot_of: dict[tuple[str, int], int] = {}
+        self.built_at = None
+        self._pending = None  # changes signalled during a build, replayed onto its result
+        self._rebuild = None  # background rebuild thread
+
+    # ---- building --------------------------------------------------------------
+
+    def build(self):
+        with self._lock:
+            self._pending = []
+        pairs, entities, slot_of = [], [], {}
+        for kind, (model, field) in SOURCES.items():
+            slug = "id" if kind == "ad" else "slug"
+            for pk, label, s in model.objects.order_by().values_list("pk", field, slug).iterator(chunk_size=5000):
+                slot = len(entities)
+                entities.append((kind, pk, label, s))
+                slot_of[(kind, pk)] = slot
+                pairs.extend(_tagged(slot, _word_keys(label)))
+        pairs.sort()
+        with self._lock:
+            self.keys = [k for k, _ in pairs]
+            self.slots = [s for _, s in pairs]
+            self.recent = []
+            self.entities, self.slot_of = entities, slot_of
+            pending, self._pending = self._pending, None
+            for change, args in pending:
+                change(*args)
+            self.built_at = time.monotonic()
+
+    def ensure_fresh(self):
+        if self.built_at is None:
+            self.build()  # nothing to serve yet
+            return
+        max_age = getattr(settings, "SUGGEST_REFRESH_SECONDS", 600)
+        if time.monotonic() - self.built_at > max_age:
+            with self._lock:
+                if self._rebuild and self._rebuild.is_alive():
+                    return
+                self._rebuild = threading.Thread(target=self._build_in_background, name="suggest-rebuild",
+                                                 daemon=True)
+                self._rebuild.start()
+
+    def _build_in_background(self):
+        try:
+            self.build()
+        finally:
+            connection.close()  # this thread's own connection
+
+    def _merge(self):
+        """Fold ``recent`` into the main arrays, dropping the keys of blanked slots."""
+        live = ((k, s) for k, s in zip(self.keys, self.slots) if self.entities[s if s >= 0 else ~s])
+        pairs = list(heapq.merge(live, self.recent))
+        self.keys = [k for k, _ in pairs]
+        self.slots = [s for _, s in pairs]
+        self.recent = []
+
+    # ---- incremental updates ---------------------------------------------------
+
+    def upsert(self, kind, pk, label, slug=None):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((self._upsert, (kind, pk, label, slug)))
+            if self.built_at is not None:  # otherwise build() will read the DB
+                self._upsert(kind, pk, label, slug)
+
+    def remove(self, kind, pk):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((self._remove, (kind, pk)))
+            self._remove(kind, pk)
+
+    def _upsert(self, kind, pk, label, slug):
+        self._remove(kind, pk)
+        slot = len(self.entities)
+        self.entities.append((kind, pk, label, slug))
+        self.slot_of[(kind, pk)] = slot
+        for pair in _tagged(slot, _word_keys(label)):
+            insort(self.recent, pair)
+        if len(self.recent) > MERGE_AT:
+            self._merge()
+
+    def _remove(self, kind, pk):
+        slot = self.slot_of.pop((kind, pk), None)
+        if slot is not None:
+            self.entities[slot] = None  # its keys are skipped, and dropped at the next merge or build
+
+    # ---- lookup ----------------------------------------------------------------
+
+    def _scan(self, p):
+        """Slots of the keys starting with ``p``: the recent ones, then up to MAX_SCAN of the main arrays."""
+        i = bisect_left(self.recent, (p,))
+        while i < len(self.recent) and self.recent[i][0].startswith(p):
+            yield self.recent[i][1]
+            i += 1
+        i = bisect_left(self.keys, p)
+        end = min(len(self.keys), i + MAX_SCAN)
+        while i < end and self.keys[i].startswith(p):
+            yield self.slots[i]
+            i += 1
+
+    def lookup(self, prefix: str, limit: int = 10, kinds=None) -> list[dict]:
+        p = " ".join(fold(prefix).split())
+        if not p:
+            return []
+        self.ensure_fresh()
+        found, seen = [], set()
+        with self._lock:
+            for tagged in self._scan(p):
+                if len(found) >= limit * 4:
+                    break
+                slot = tagged if tagged >= 0 else ~tagged
+                if slot in seen:
+                    continue
+                seen.add(slot)
+                entity = self.entities[slot]
+                if entity and (not kinds or entity[0] in kinds):
+                    found.append((tagged < 0, len(entity[2]), entity))
+        # names starting with the prefix first, then shorter names
+        found.sort(key=lambda f: f[:2])
+        return [
+            {"type": kind, "id": pk, "label": label, "url": entity_url(kind, pk, slug)}
+            for _, _, (kind, pk, label, slug) in found[:limit]
+        ]
+
+
+index = PrefixIndex()
@@ -0,0 +1,152 @@
+# core/tasks.py
+"""
+Background side effects of writes (Celery; the app is in config/celery.py).
+
+Views and signal receivers write only the rows they were asked to, plus the
+cheap ``updated_at`` stamps conditional GETs rely on. Then they queue the rest
+with ``delay_on_commit``:
+
+    reconcile_ads      review counters of ads and their brands/agencies, and
+                       their places on the leaderboards (core.leaderboards)
+    reindex_ads        search index entries of ads
+    reindex_owned_ads  ads of a renamed brand, agency or tag
+    refresh_imported   search index, owner totals and page cache after an import batch
+    run_bulk_job       a large admin bulk operation (core.bulk), with progress
+    refresh_feeds      "for you" feeds of users (core.feed)
+    update_feed        one new or re-rated review folded into its author's feed
+    roll_leaderboards  hourly: ads whose reviews left a trending window
+
+Every task recomputes from the source rows instead of applying a delta it was
+handed, so retries and redeliveries (``acks_late``) are harmless. The one
+exception, ``update_feed``, skips a review its user's feed already includes. Dropped
+connections and lock timeouts are retried with backoff.
+
+Runs, failures, retries and run times are counted per task in the cache, so
+they cover every worker. ``manage.py task_stats`` prints them. Tasks slower
+than ``CELERY_SLOW_TASK_MS`` are logged to ``holograms.tasks``.
+
+With no broker configured, tasks run eagerly in the calling process
+(``CELERY_TASK_ALWAYS_EAGER``).
+"""
+import logging
+import time
+
+from celery import shared_task
+from celery.contrib.django.task import DjangoTask
+from django.conf import settings
+from django.core.cache import cache
+from django.db import InterfaceError, OperationalError
+
+from . import bulk, caching, feed, leaderboards
+from .cachestats import CacheStats
+from .counters import reconcile_ad, refresh_owner_totals
+from .models import Ad, Agency, Brand
+from .search import get_backend as get_search_backend
+
+logger = logging.getLogger("holograms.tasks")
+
+STATS_PREFIX = "taskstats"
+COUNTERS = ("runs", "failures", "retries", "total_ms")
+
+
+class TimedTask(DjangoTask):
+    autoretry_for = (OperationalError, InterfaceError)
+    retry_backoff = True
+    retry_backoff_max = 300
+    max_retries = 5
+
+    def __call__(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().__call__(*args, **kwargs)
+        finally:
+            ms = (time.perf_counter() - started) * 1000
+            _record(self.name, ms)
+            if ms >= getattr(settings, "CELERY_SLOW_TASK_MS", 2000):
+                logger.warning("slow task %s: %.0f ms", self.name, ms)
+
+    def on_retry(self, exc, task_id, args, kwargs, einfo):
+        _incr(self.name, "retries")
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        _incr(self.name, "failures")
+        logger.error("task %s failed: %r", self.name, exc)
+
+
+# ---- tasks -------------------------------------------------------------------------
+
+@shared_task(base=TimedTask)
+def reconcile_ads(ad_ids):
+    """Review counters of ``ad_ids`` (and their brand/agency) after reviews changed."""
+    changed = [pk for pk in ad_ids if reconcile_ad(pk)]
+    if changed:
+        caching.bump(*caching.INVALIDATES["Review"])
+    leaderboards.refresh(ad_ids)
+    return len(changed)
+
+
+@shared_task(base=TimedTask)
+def reindex_ads(ad_ids):
+    get_search_backend().index_ads(ad_ids)
+
+
+OWNER_FILTERS = {"brand": "brand_id", "agency": "agency_id", "tag": "tags_m2m"}
+
+
+@shared_task(base=TimedTask)
+def reindex_owned_ads(kind, pk):
+    """Every ad of a renamed brand, agency or tag (``kind`` is a key of OWNER_FILTERS)."""
+    ad_ids = Ad.objects.filter(**{OWNER_FILTERS[kind]: pk}).values_list("pk", flat=True)
+    get_search_backend().index_ads(ad_ids)
+
+
+@shared_task(base=TimedTask)
+def refresh_imported(ad_ids, brand_ids, agency_ids):
+    """Follow-up of one ``AdBatchWriter.write`` (bulk writes bypass the model signals)."""
+    get_search_backend().index_ads(ad_ids)
+    refresh_owner_totals(Brand, brand_ids)
+    refresh_owner_totals(Agency, agency_ids)
+    caching.bump_all()
+
+
+@shared_task(base=TimedTask)
+def run_bulk_job(job_id):
+    bulk.run_job(job_id)
+
+
+@shared_task(base=TimedTask)
+def refresh_feeds(user_ids):
+    for user_id in user_ids:
+        feed.refresh(user_id)
+
+
+@shared_task(base=TimedTask)
+def update_feed(review_id):
+    feed.add_review(review_id)
+
+
+@shared_task(base=TimedTask)
+def roll_leaderboards():
+    return leaderboards.roll()
+
+
+# ---- stats -------------------------------------------------------------------------
+
+_stats = CacheStats(STATS_PREFIX, COUNTERS + ("max_ms",))
+_incr = _stats.incr
+
+
+def _record(name, ms):
+    _incr(name, "runs")
+    _incr(name, "total_ms", round(ms))
+    key = _stats.key(name, "max_ms")
+    if ms > (cache.get(key) or 0):  # racy across workers; close enough for a maximum
+        cache.set(key, round(ms), None)
+
+
+def stats() -> dict[str, dict[str, int]]:
+    return _stats.stats()
+
+
+def reset_stats():
+    _stats.reset()
@@ -1,3 +1,1565 @@
-from django.test import TestCase
+import csv
+import fnmatch
+import json
+import os
+import random
+import re
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed, ValidationError
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.models import Count
+from django.template.base import Template
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver, reverse
+from django.utils import timezone
+
+from . import bulk, caching, collaborations, facets, feed, leaderboards, profiling, similar, tasks
+from .imports import AdBatchWriter, Checkpoint, iter_chunks, iter_chunks_parallel, read_header
+from .counters import rebuild_all as rebuild_counters, reconcile_ad, refresh_profile_stats
+from .forms import AdAdminForm
+from .models import Ad, Agency, Brand, BulkJob, Collaboration, Credit, FeedItem, FeedTaste, LeaderboardEntry, Person, Review, SimilarAd, Tag, TagFacet, UserProfile
+from .profiling import ProfilingMiddleware
+from .search import get_backend as get_search_backend
+from .suggest import index as suggest_index
+from .utils import extract_youtube_id, extract_youtube_ids
+from .views import REVIEWS_PER_PAGE
+
+User = get_user_model()
+
+
+class CsvImportMixin:
+    HEADER = "title,brand,agency,year,youtube,duration_sec,tags\n"
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+
+    def csv(self, body, name="ads.csv"):
+        path = self.dir / name
+        path.write_text(self.HEADER + body)
+        return path
+
+    def run_import(self, path, *args):
+        out, err = StringIO(), StringIO()
+        with self.captureOnCommitCallbacks(execute=True):  # reindex and owner totals run in a task
+            call_command("import_ads_csv", str(path), *args, stdout=out, stderr=err)
+        return out.getvalue() + err.getvalue()
+
+    def tags(self, yt_id):
+        return set(Ad.objects.get(youtube_id=yt_id).tags_m2m.values_list("name", flat=True))
+
+
+class ImportCsvTests(CsvImportMixin, TestCase):
+    def test_creates_then_upserts_by_youtube_id(self):
+        out = self.run_import(self.csv(
+            "Epic Split,Volvo,Forsman,2013,https://youtu.be/M7FIvfx5J10,60,\"stunt, truck, Stunt\"\n"
+            "Surfer,Guinness,,1999,zcdDg30VBgo,,\n"
+            "No video,Guinness,,,,,\n"
+        ))
+        self.assertIn("Created: 2, Updated: 0, Skipped: 1", out)
+        ad = Ad.objects.select_related("brand", "agency").get(youtube_id="M7FIvfx5J10")
+        self.assertEqual((ad.title, ad.brand.name, ad.agency.name, ad.year, ad.duration_sec),
+                         ("Epic Split", "Volvo", "Forsman", 2013, 60))
+        self.assertEqual(ad.youtube_url, "https://www.youtube.com/watch?v=M7FIvfx5J10")
+        self.assertEqual(self.tags("M7FIvfx5J10"), {"stunt", "truck"})
+        self.assertEqual(Brand.objects.get(name="Volvo").num_ads, 1)
+
+        out = self.run_import(self.csv("The Epic Split,Volvo,,2014,https://www.youtube.com/watch?v=M7FIvfx5J10,,\n",
+                                       "again.csv"))
+        self.assertIn("Created: 0, Updated: 1", out)
+        ad = Ad.objects.get(youtube_id="M7FIvfx5J10")
+        self.assertEqual((ad.title, ad.agency_id, ad.year), ("The Epic Split", None, 2014))
+        self.assertEqual(Ad.objects.count(), 2)
+
+    def test_tags_are_replaced_unless_appending(self):
+        self.run_import(self.csv("Spot,Acme,,,M7FIvfx5J10,,\"a, b\"\n"))
+        self.run_import(self.csv("Spot,Acme,,,M7FIvfx5J10,,c\n", "replace.csv"))
+        self.assertEqual(self.tags("M7FIvfx5J10"), {"c"})
+        self.run_import(self.csv("Spot,Acme,,,M7FIvfx5J10,,\"d, c\"\n", "append.csv"), "--append-tags")
+        self.assertEqual(self.tags("M7FIvfx5J10"), {"c", "d"})
+        self.assertEqual(TagFacet.objects.get(tag__name="a").num_ads, 0)
+
+    def test_new_names_get_free_slugs(self):
+        Brand.objects.create(name="Nike", slug="nike")
+        self.run_import(self.csv(
+            "One,NIKE,,,M7FIvfx5J10,,\n"
+            "Two,Nike,,,zcdDg30VBgo,,\n"
+            "Three,Acme Co,,,mSh1NNp0q5Q,,\n"
+            "Four,Acme-Co,,,JHEJfRnWyBM,,\n"
+        ))
+        self.assertEqual(dict(Brand.objects.values_list("name", "slug")),
+                         {"Nike": "nike", "NIKE": "nike-2", "Acme Co": "acme-co", "Acme-Co": "acme-co-2"})
+        self.assertEqual(Ad.objects.get(youtube_id="zcdDg30VBgo").brand.slug, "nike")
+
+
+class ImportResumeTests(CsvImportMixin, TestCase):
+    BODY = ("One,Acme,,,M7FIvfx5J10,,a\n"
+            "\"Two,\nin two lines\",Acme,,,zcdDg30VBgo,,b\n"
+            "Three,Other,,,,,\n"
+            "Four,Other,,,mSh1NNp0q5Q,,\"a, c\"\n"
+            "Five,Acme,,,JHEJfRnWyBM,,\n"
+            "One again,Acme,,,M7FIvfx5J10,,c\n")
+
+    def state(self):
+        return sorted((a.youtube_id, a.title, a.brand.name, tuple(sorted(t.name for t in a.tags_m2m.all())))
+                      for a in Ad.objects.select_related("brand").prefetch_related("tags_m2m"))
+
+    def test_lines_are_physical_lines(self):
+        out = self.run_import(self.csv(self.BODY), "-v", "2")
+        self.assertIn("[line 5] missing title/brand/youtube", out)  # "Two" spans lines 3 and 4
+        self.assertIn("[line 6] CREATED: Four", out)
+
+    def test_resume_after_a_crash_matches_a_clean_run(self):
+        path = self.csv(self.BODY)
+        real, written = AdBatchWriter.write, []
+
+        def crash_on_third_chunk(writer, rows):
+            if len(written) == 2:
+                raise RuntimeError("killed")
+            written.append(rows)
+            return real(writer, rows)
+
+        with mock.patch.object(AdBatchWriter, "write", autospec=True, side_effect=crash_on_third_chunk):
+            with self.assertRaises(RuntimeError):
+                self.run_import(path, "--batch-size", "2")
+        self.assertEqual(Ad.objects.count(), 3)  # two chunks committed, one of them skipped a row
+        out = self.run_import(path, "--batch-size", "2", "--resume")
+        self.assertIn("Resuming after line 6", out)
+        self.assertFalse(Checkpoint(path).path.exists())
+        resumed = self.state()
+
+        Ad.objects.all().delete()
+        self.run_import(path, "--batch-size", "2")
+        self.assertEqual(self.state(), resumed)
+        self.assertEqual(len(resumed), 4)
+
+
+class ImportDryRunTests(CsvImportMixin, TestCase):
+    def test_dry_run_plans_without_writing(self):
+        self.run_import(self.csv("One,Acme,,2020,M7FIvfx5J10,,a\nTwo,Acme,,,zcdDg30VBgo,,\n"))
+        path = self.csv(
+            "One,Acme,,2020,M7FIvfx5J10,,a\n"          # unchanged
+            "Two,Acme,,1999,zcdDg30VBgo,,\n"           # new year
+            "Three,New Brand,,,mSh1NNp0q5Q,,\"a, b\"\n"  # new ad, brand and tag
+            "Three,New Brand,,,mSh1NNp0q5Q,,b\n"       # repeats the row above, minus a tag
+            "Broken,Acme,,,not a video,,\n",
+            "plan.csv",
+        )
+        with CaptureQueriesContext(connection) as ctx:
+            out = self.run_import(path, "--dry-run")
+        self.assertIn("Create: 1, Update: 2, Unchanged: 1, Skip: 1; new brands: 1, new agencies: 0, new tags: 1", out)
+        self.assertIn("year: None → 1999", out)
+        self.assertIn("tags_m2m: -a", out)
+        self.assertEqual([q["sql"] for q in ctx.captured_queries if not q["sql"].startswith("SELECT")], [])
+        self.assertEqual(Ad.objects.count(), 2)
+        self.assertFalse(Brand.objects.filter(name="New Brand").exists())
+
+
+class ParallelParseTests(CsvImportMixin, TestCase):
+    def test_workers_parse_exactly_like_the_serial_reader(self):
+        records = [
+            f'"Spot {i}\n{"long quoted text " * 40}\n{"more of it " * 40}",Brand {i % 7},,2001,{i:011d},30,"a, b"\n'
+            if i % 3 else f"Plain {i},Brand {i % 7},,,{i:011d},,\n"
+            for i in range(600)
+        ] + [",,,,,,\n"]
+        path = self.csv("".join(records))
+        fmt = {"delimiter": ",", "quotechar": '"', "escapechar": None, "doublequote": True,
+               "skipinitialspace": False, "quoting": csv.QUOTE_MINIMAL}
+        header, offset, line = read_header(path, fmt)
+
+        # the file is cut into 64k shards; some cuts must fall inside a quoted field
+        starts, pos = set(), offset
+        for r in records:
+            starts.add(pos)
+            pos += len(r.encode())
+        data = path.read_bytes()
+        guesses = {data.index(b"\n", cut - 1) + 1 for cut in range(offset + 65536, len(data), 65536)}
+        self.assertTrue(guesses - starts)
+
+        def flat(chunks):
+            rows, skipped = [], []
+            for chunk in chunks:
+                rows += chunk.rows
+                skipped += chunk.skipped
+            return rows, skipped
+
+        serial = flat(iter_chunks(path, fmt, header, offset, line, 1000))
+        parallel = flat(iter_chunks_parallel(path, fmt, header, offset, line, workers=2))
+        self.assertEqual(parallel, serial)
+        self.assertEqual(len(serial[0]), 600)
+        self.assertEqual(serial[1], [(serial[0][-1].line + 3, "missing title/brand/youtube")])
+
+
+class RatingCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.acme, cls.other = Brand.objects.create(name="Acme", slug="acme"), Brand.objects.create(name="Other", slug="other")
+        cls.agency = Agency.objects.create(name="Wieden", slug="wieden")
+        cls.users = [User.objects.create(username=f"critic{i}") for i in range(2)]
+
+    def totals(self, obj):
+        obj.refresh_from_db()
+        return obj.num_ads, obj.rating_sum, obj.rating_count
+
+    def create_ad(self, n, **kwargs):
+        ad = Ad.objects.create(title=f"Spot {n}", youtube_url=f"https://youtu.be/{n:011d}", **kwargs)
+        with self.captureOnCommitCallbacks(execute=True):
+            for user, rating in zip(self.users, (5, 2)):
+                Review.objects.create(ad=ad, user=user, rating=rating)
+        return ad
+
+    def test_create_update_move_and_delete(self):
+        ad = self.create_ad(1, brand=self.acme, agency=self.agency)
+        self.create_ad(2, brand=self.acme)
+        self.assertEqual(self.totals(self.acme), (2, 14, 4))
+        self.assertEqual(self.totals(self.agency), (1, 7, 2))
+        ad.refresh_from_db()
+        self.assertEqual(ad.avg_rating, 3.5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            review = ad.reviews.get(user=self.users[1])
+            review.rating = 4
+            review.save()
+        self.assertEqual(self.totals(self.acme), (2, 16, 4))
+
+        stale = Ad.objects.get(pk=ad.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.filter(pk=review.pk).delete()  # a queryset delete still sends the signals
+        stale.brand, stale.agency = self.other, None
+        stale.save()  # the stale copy's counters are not written back
+        self.assertEqual(self.totals(self.acme), (1, 7, 2))
+        self.assertEqual(self.totals(self.other), (1, 5, 1))
+        self.assertEqual(self.totals(self.agency), (0, 0, 0))
+        self.assertEqual(Ad.objects.get(pk=ad.pk).rating_count, 1)
+
+        stale.delete()
+        self.assertEqual(self.totals(self.other), (0, 0, 0))
+
+    def test_rebuild_repairs_drift(self):
+        ad = self.create_ad(1, brand=self.acme, agency=self.agency)
+        Ad.objects.filter(pk=ad.pk).update(rating_sum=99)
+        Brand.objects.filter(pk=self.acme.pk).update(num_ads=5, rating_count=0)
+        rebuild_counters()
+        self.assertEqual(self.totals(self.acme), (1, 7, 2))
+        self.assertEqual(Ad.objects.get(pk=ad.pk).rating_sum, 7)
+
+
+class SearchBackendTests(TestCase):
+    """Runs against the backend of the test database (FTS5 on SQLite, tsvector on PostgreSQL)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        rocket = Brand.objects.create(name="Rocket Cola", slug="rocket-cola")
+        plain = Brand.objects.create(name="Plain", slug="plain")
+        tag = Tag.objects.create(name="rockets", slug="rockets")
+        cls.in_title = Ad.objects.create(title="Rocket launch", brand=plain, year=2001,
+                                         youtube_url="https://youtu.be/00000000001")
+        cls.in_brand = Ad.objects.create(title="Fizz", brand=rocket, year=2001, youtube_url="https://youtu.be/00000000002")
+        cls.in_tags = Ad.objects.create(title="Countdown", brand=plain, year=2002, youtube_url="https://youtu.be/00000000003")
+        with cls.captureOnCommitCallbacks(execute=True):  # tag changes are reindexed in a task
+            cls.in_tags.tags_m2m.add(tag)
+        Ad.objects.create(title="Unrelated", brand=plain, youtube_url="https://youtu.be/00000000004")
+
+    def search(self, q, **filters):
+        return list(get_search_backend().search(Ad.objects.filter(**filters), q))
+
+    def test_prefix_match_ranked_title_then_brand_then_tags(self):
+        self.assertEqual(self.search("rock"), [self.in_title, self.in_brand, self.in_tags])
+        self.assertEqual(self.search("ROCKET cola"), [self.in_brand])
+        self.assertEqual(self.search("rock", year=2001), [self.in_title, self.in_brand])
+        self.assertEqual(self.search("--"), [])
+
+    def test_index_follows_edits_and_deletes(self):
+        self.in_title.title = "Splashdown"
+        self.in_title.save()
+        self.assertEqual(self.search("splash"), [self.in_title])
+        self.in_brand.delete()
+        self.assertEqual(self.search("rock"), [self.in_tags])
+
+
+class SuggestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.brand = Brand.objects.create(name="Volvo Trucks", slug="volvo-trucks")
+        cls.ad = Ad.objects.create(title="The Epic Split", brand=cls.brand, youtube_url="https://youtu.be/M7FIvfx5J10")
+        Tag.objects.create(name="split screen", slug="split-screen")
+        Person.objects.create(name="Émile Durand", slug="emile-durand")
+
+    def setUp(self):
+        suggest_index.build()
+
+    def labels(self, q, **kwargs):
+        return [r["label"] for r in suggest_index.lookup(q, **kwargs)]
+
+    def test_prefix_of_any_word_folded(self):
+        self.assertEqual(self.labels("SPL"), ["split screen", "The Epic Split"])  # name starts first
+        self.assertEqual(self.labels("epic sp"), ["The Epic Split"])
+        self.assertEqual(self.labels("emile"), ["Émile Durand"])
+        self.assertEqual(suggest_index.lookup("spl", kinds={"ad"}),
+                         [{"type": "ad", "id": self.ad.pk, "label": "The Epic Split",
+                           "url": reverse("ad_detail", args=[self.ad.pk])}])
+        self.assertEqual(self.labels("xyz"), [])
+
+    def test_signals_update_the_index(self):
+        with mock.patch("core.suggest.MERGE_AT", 3):
+            brand = Brand.objects.create(name="Splash Cola", slug="splash-cola")
+            self.assertEqual(self.labels("splash"), ["Splash Cola"])
+            brand.name = "Fizz Cola"
+            brand.save()
+            self.assertEqual(self.labels("splash"), [])
+            self.assertEqual(self.labels("cola"), ["Fizz Cola"])
+            brand.delete()
+            self.assertEqual(self.labels("fizz"), [])
+            Brand.objects.create(name="Split Pea Soup", slug="split-pea-soup")
+            Brand.objects.create(name="Soup Co", slug="soup-co")  # over 3 recent keys: merged
+        self.assertEqual(suggest_index.recent, [])
+        self.assertFalse({"splash cola", "fizz cola"} & set(suggest_index.keys))  # dropped by the merge
+        self.assertEqual(self.labels("split"), ["split screen", "Split Pea Soup", "The Epic Split"])
+
+    def test_stale_index_is_rebuilt_in_the_background(self):
+        suggest_index.built_at -= 10 * 24 * 3600
+        with mock.patch.object(type(suggest_index), "build", autospec=True) as build:
+            self.assertEqual(self.labels("epic"), ["The Epic Split"])  # answered from the old arrays
+            suggest_index._rebuild.join()
+        build.assert_called_once_with(suggest_index)
+
+
+class AdDetailQueryBudgetTests(TestCase):
+    """ad_detail must cost the same number of queries however popular the ad is."""
+
+    # freshness check (core.freshness), ad (+ brand, agency), tags,
+    # credits (+ person, company), one page of reviews (+ users),
+    # similar ads (+ their brands)
+    ANON_QUERIES = 6
+    # + session, user, the viewer's own review
+    AUTH_QUERIES = ANON_QUERIES + 3
+
+    @classmethod
+    def setUpTestData(cls):
+        brand = Brand.objects.create(name="Acme", slug="acme")
+        agency = Agency.objects.create(name="Wieden", slug="wieden")
+        cls.ad = Ad.objects.create(title="Big Spot", brand=brand, agency=agency,
+                                   youtube_url="https://youtu.be/dQw4w9WgXcQ", year=2020)
+        cls.ad.tags_m2m.set([Tag.objects.create(name=f"tag {i}", slug=f"tag-{i}") for i in range(8)])
+        roles = ["CD", "CW", "AD", "DIR"]
+        for i in range(40):
+            person = Person.objects.create(name=f"Person {i}")
+            Credit.objects.create(ad=cls.ad, person=person, role=roles[i % 4],
+                                  company=agency if i % 2 else None)
+        cls.users = [User.objects.create(username=f"user{i}") for i in range(3 * REVIEWS_PER_PAGE)]
+        with cls.captureOnCommitCallbacks(execute=True):  # counters are updated by a task
+            for i, user in enumerate(cls.users):
+                Review.objects.create(ad=cls.ad, user=user, rating=i % 6, body=f"review {i}")
+
+    def test_first_page_anonymous(self):
+        url = reverse("ad_detail", args=[self.ad.pk])
+        with self.assertNumQueries(self.ANON_QUERIES):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Person 39")
+        self.assertContains(response, "tag 7")
+        self.assertEqual(len(response.context["page"].object_list), REVIEWS_PER_PAGE)
+
+    def test_every_page_has_the_same_budget(self):
+        url = reverse("ad_detail", args=[self.ad.pk])
+        seen = []
+        while url:
+            with self.assertNumQueries(self.ANON_QUERIES):
+                response = self.client.get(url)
+            page = response.context["page"]
+            seen += [r.pk for r in page.object_list]
+            url = page.next_url and reverse("ad_detail", args=[self.ad.pk]) + page.next_url
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(len(seen), len(self.users))
+
+    def test_logged_in(self):
+        self.client.force_login(self.users[0])
+        with self.assertNumQueries(self.AUTH_QUERIES):
+            response = self.client.get(reverse("ad_detail", args=[self.ad.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(re.search(r"★ [\d.]+ · 60 reviews", response.content.decode()))
+
+
+# ---- view budgets --------------------------------------------------------------
+# Every route in config/urls.py is requested against a generated catalogue and
+# must stay within a query count (independent of data size). Latency is only
+# reported, against a target sized for PERF_SCALE=1.0 on a laptop for a warm
+# request (GETs are made twice): wall-clock time is too noisy to fail a build
+# on. Knobs, all environment variables:
+#   PERF_SCALE          catalogue size; 1.0 = 50k ads, 5k brands, 500k reviews
+#                       (default 0.01 so `manage.py test` stays quick)
+#   PERF_REPORT         write a JSON report of every request to this path
+#                       (default: no report)
+
+PERF_SCALE = float(os.environ.get("PERF_SCALE", "0.01"))
+PERF_REPORT = os.environ.get("PERF_REPORT")
+
+# route (as written in config/urls.py) -> (url factory, max queries, target ms)
+# The url factory gets the test case so it can point at seeded rows. Query
+# budgets include the session and user lookups of the logged-in client and the
+# freshness check of conditional pages.
+VIEW_BUDGETS = {
+    "api/health/":               (lambda t: "/api/health/", 0, 50),
+    "api/suggest/":              (lambda t: "/api/suggest/?q=bra", 0, 50),
+    "api/v1/":                   (lambda t: "/api/v1/ads/?include=brand,agency,credits.person", 3, 500),
+    "ads/":                      (lambda t: reverse("ad_list"), 4, 300),
+    "ads/<int:pk>/":             (lambda t: reverse("ad_detail", args=[t.busy_ad.pk]), 9, 300),  # +1: similar ads
+    "ads/<int:pk>/review/":      (lambda t: reverse("review_submit", args=[t.busy_ad.pk]), 9, 300),  # counters: core.tasks
+    "accounts/":                 (lambda t: reverse("login"), 2, 100),
+    "accounts/signup/":          (lambda t: reverse("signup"), 2, 100),
+    "accounts/profile/":         (lambda t: reverse("profile_edit"), 3, 100),
+    "feed/":                     (lambda t: reverse("feed"), 3, 300),
+    "u/<str:username>/":         (lambda t: reverse("profile_public", args=[t.user.username]), 7, 300),
+    "search/":                   (lambda t: reverse("search") + "?q=spot", 8, 1000),
+    "top/":                      (lambda t: reverse("leaderboard") + "?window=7d", 4, 300),  # +2: sampled tag facets
+    "brands/":                   (lambda t: reverse("brand_list"), 3, 3000),
+    "brands/<slug:slug>/":       (lambda t: reverse("brand_detail", args=[t.busy_brand.slug]), 5, 300),
+    "agencies/":                 (lambda t: reverse("agency_list"), 3, 1000),
+    "agencies/<slug:slug>/":     (lambda t: reverse("agency_detail", args=[t.busy_agency.slug]), 5, 300),
+    "people/":                   (lambda t: reverse("person_list"), 3, 300),
+    "people/<slug:slug>/":       (lambda t: reverse("person_detail", args=[t.busy_person.slug]), 6, 300),
+    "admin/":                    (lambda t: reverse("admin:core_review_changelist"), 6, 1000),
+}
+POST_ROUTES = {"ads/<int:pk>/review/": {"rating": "4", "body": "again"}}
+
+
+def seed_catalogue(scale: float, seed: int = 1):
+    """Bulk-load a catalogue shaped like production; returns the Ad list."""
+    rng = random.Random(seed)
+
+    def n(full, floor):
+        return max(floor, int(full * scale))
+
+    n_brands, n_agencies, n_ads = n(5000, 20), n(500, 5), n(50000, 200)
+    n_users, n_reviews, n_people = n(20000, 50), n(500000, 2000), n(5000, 30)
+
+    brands = Brand.objects.bulk_create(
+        Brand(name=f"Brand {i}", slug=f"brand-{i}", website="https://example.com") for i in range(n_brands))
+    agencies = Agency.objects.bulk_create(
+        Agency(name=f"Agency {i}", slug=f"agency-{i}", country="UK") for i in range(n_agencies))
+    tags = Tag.objects.bulk_create(Tag(name=f"tag {i}", slug=f"tag-{i}") for i in range(100))
+    people = Person.objects.bulk_create(Person(name=f"Person {i}", slug=f"person-{i}") for i in range(n_people))
+    ads = Ad.objects.bulk_create(
+        (Ad(title=f"{rng.choice(['Big', 'Epic', 'Quiet', 'Split'])} spot {i}",
+            brand=rng.choice(brands), agency=rng.choice(agencies + [None]),
+            year=rng.choice([None] + list(range(1990, 2025))), duration_sec=rng.randint(15, 120),
+            youtube_url=f"https://www.youtube.com/watch?v={i:011d}", youtube_id=f"{i:011d}")
+         for i in range(n_ads)),
+        batch_size=2000,
+    )
+    Through = Ad.tags_m2m.through
+    Through.objects.bulk_create(
+        (Through(ad=ad, tag=tag) for ad in ads for tag in rng.sample(tags, 3)), batch_size=5000)
+    roles = ["CD", "CW", "AD", "DIR", "DOP"]
+    Credit.objects.bulk_create(
+        (Credit(ad=ad, person=person, role=rng.choice(roles))
+         for ad in ads for person in rng.sample(people, 3)), batch_size=5000)
+
+    users = User.objects.bulk_create(User(username=f"user{i}") for i in range(n_users))
+    UserProfile.objects.bulk_create(UserProfile(user=u) for u in users)
+    # reviews are skewed: the first ad and the first user get a page-busting share
+    pairs = {(ads[0].pk, u.pk) for u in users[:200]} | {(a.pk, users[0].pk) for a in ads[:200]}
+    while len(pairs) < n_reviews:
+        pairs.add((rng.choice(ads).pk, rng.choice(users).pk))
+    Review.objects.bulk_create(
+        (Review(ad_id=a, user_id=u, rating=rng.randint(0, 5), body="ok") for a, u in pairs), batch_size=5000)
+
+    rebuild_counters()            # bulk_create skips the signals
+    refresh_profile_stats()
+    collaborations.rebuild()
+    leaderboards.rebuild()
+    get_search_backend().rebuild()
+    suggest_index.build()
+    return ads
+
+
+class ViewBudgetTests(TestCase):
+    """Query-count budgets for every route; timings go to ``PERF_REPORT`` when it is set."""
+
+    report = []
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalogue(PERF_SCALE)
+        cls.busy_ad = Ad.objects.order_by("-rating_count").first()
+        cls.busy_brand = Brand.objects.order_by("-num_ads").first()
+        cls.busy_agency = Agency.objects.order_by("-num_ads").first()
+        cls.busy_person = Person.objects.annotate(n=Count("ad_credits")).order_by("-n").first()
+        cls.user = User.objects.get(username="user0")
+        cls.user.is_staff = cls.user.is_superuser = True
+        cls.user.save()
+
+    def setUp(self):
+        cache.clear()  # fragments from other tests describe rolled-back rows
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        if PERF_REPORT and cls.report:
+            with open(PERF_REPORT, "w") as fh:
+                json.dump({"scale": PERF_SCALE, "views": cls.report}, fh, indent=2)
+
+    def test_every_route_has_a_budget(self):
+        routes = {str(p.pattern) for p in get_resolver().url_patterns}
+        routes -= {str(p.pattern) for p in get_resolver().url_patterns if str(p.pattern).startswith("^")}  # static()
+        self.assertEqual(sorted(routes - set(VIEW_BUDGETS)), [], "add these routes to VIEW_BUDGETS")
+
+    def test_view_budgets(self):
+        self.client.force_login(self.user)
+        for route, (url_for, max_queries, target_ms) in VIEW_BUDGETS.items():
+            with self.subTest(route=route):
+                url = url_for(self)
+                entry = self.measure(url, POST_ROUTES.get(route))
+                entry.update(route=route, target_ms=target_ms, over_target=entry["total_ms"] > target_ms)
+                ViewBudgetTests.report.append(entry)
+                self.assertLess(entry["status"], 400, url)
+                self.assertLessEqual(entry["queries"], max_queries, f"{url}: {entry['sql']}")
+
+    def measure(self, url, post_data=None):
+        if post_data is None:
+            self.client.get(url)  # warm template and url caches
+        rendering, depth = 0.0, 0
+        original_render = Template.render
+
+        def timed_render(template, context):
+            # only the outermost render counts; includes and widgets nest inside it
+            nonlocal rendering, depth
+            depth += 1
+            started = time.perf_counter()
+            try:
+                return original_render(template, context)
+            finally:
+                depth -= 1
+                if not depth:
+                    rendering += time.perf_counter() - started
+
+        with mock.patch.object(Template, "render", timed_render), \
+                CaptureQueriesContext(connection) as ctx:
+            started = time.perf_counter()
+            if post_data is None:
+                response = self.client.get(url)
+            else:
+                response = self.client.post(url, post_data)
+            total = time.perf_counter() - started
+        return {
+            "url": url,
+            "status": response.status_code,
+            "queries": len(ctx),
+            "sql_ms": round(sum(float(q["time"]) for q in ctx) * 1000, 2),
+            "render_ms": round(rendering * 1000, 2),  # includes queries run lazily by templates
+            "total_ms": round(total * 1000, 2),
+            "sql": [{"ms": round(float(q["time"]) * 1000, 2), "sql": q["sql"][:200]} for q in ctx],
+        }
+
+
+# ---- request profiling -----------------------------------------------------------
+
+class ProfilingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.brand = Brand.objects.create(name="Acme", slug="acme")
+
+    def test_inert_unless_enabled(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            ProfilingMiddleware(lambda request: None)
+        response = self.client.get(reverse("brand_list"))
+        self.assertNotIn("Server-Timing", response)
+        self.assertIs(Template.render, profiling._original_render)
+
+    @override_settings(PROFILING={"ENABLED": True, "SLOW_MS": 0})
+    def test_slow_requests_are_timed_and_logged(self):
+        with self.assertLogs("holograms.slow_requests") as logs:
+            response = self.client.get(reverse("brand_detail", args=["acme"]))
+        self.assertRegex(response["Server-Timing"], r'sql;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((record["route"], record["status"]), ("brands/<slug:slug>/", 200))
+        self.assertGreater(record["queries"], 0)
+        self.assertGreater(record["template_ms"], 0)
+        self.assertIs(Template.render, profiling._original_render)  # put back after the request
+
+    def test_slow_requests_command(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            log = Path(tmp) / "slow.log"
+            lines = [{"method": "GET", "route": "ads/<int:pk>/", "total_ms": ms, "queries": 40, "sql_ms": ms / 2,
+                      "template_ms": ms / 4, "duplicates": [{"sql": "SELECT * FROM core_tag WHERE id = ?", "count": 30}]}
+                     for ms in (100, 300)]
+            lines.append({"method": "GET", "route": "brands/", "total_ms": 900, "queries": 3, "sql_ms": 10})
+            log.write_text("".join(json.dumps(line) + "\n" for line in lines) + "not json\n")
+            out, err = StringIO(), StringIO()
+            call_command("slow_requests", "--log", str(log), "--sort", "count", stdout=out, stderr=err)
+        rows = out.getvalue().splitlines()
+        self.assertTrue(rows[1].startswith("GET ads/<int:pk>/"))
+        self.assertEqual(rows[1].split()[2:5], ["2", "300", "300"])  # n, p50, p95
+        self.assertIn("x30 SELECT * FROM core_tag WHERE id = ?", rows[2])
+        self.assertTrue(rows[3].startswith("GET brands/"))
+        self.assertEqual(err.getvalue(), "1 unreadable line(s) skipped\n")
+
+
+# ---- fragment cache ------------------------------------------------------------
+
+class FragmentCacheTests(TestCase):
+    """Listing fragments are served from the (local-memory) cache until a model change bumps them."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.brand = Brand.objects.create(name="Acme", slug="acme")
+        cls.ad = Ad.objects.create(title="Big Spot", brand=cls.brand, youtube_url="https://youtu.be/dQw4w9WgXcQ")
+
+    def setUp(self):
+        cache.clear()
+
+    def test_second_hit_skips_the_listing_queries(self):
+        url = reverse("brand_detail", args=[self.brand.slug])
+        with self.assertNumQueries(3):  # freshness check, brand, ads page
+            self.client.get(url)
+        with self.assertNumQueries(2):  # freshness check, brand
+            response = self.client.get(url)
+        self.assertContains(response, "Big Spot")
+        self.assertEqual(caching.stats()["brand_detail"], {"hit": 1, "wait": 0, "miss": 1})
+
+    def test_model_changes_invalidate(self):
+        self.client.get(reverse("brand_list"))
+        with self.captureOnCommitCallbacks(execute=True):
+            Brand.objects.filter(pk=self.brand.pk).update(name="Acme Corp")  # no signal: still cached
+        self.assertNotContains(self.client.get(reverse("brand_list")), "Acme Corp")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.brand.refresh_from_db()
+            self.brand.save()
+        self.assertContains(self.client.get(reverse("brand_list")), "Acme Corp")
+
+    def test_variants_are_cached_separately(self):
+        url = reverse("brand_detail", args=[self.brand.slug])
+        self.client.get(url)
+        self.client.get(url + "?cursor=bogus")
+        self.assertEqual(caching.stats()["brand_detail"]["miss"], 2)
+
+    def test_unread_parameters_share_a_fragment(self):
+        for ad in range(30):
+            Ad.objects.create(title=f"Spot {ad:02}", brand=self.brand, youtube_url=f"https://youtu.be/{ad:011}")
+        url = reverse("brand_detail", args=[self.brand.slug])
+        for n in range(5):
+            response = self.client.get(f"{url}?utm_source={n}")
+        self.assertEqual(caching.stats()["brand_detail"], {"hit": 4, "wait": 0, "miss": 1})
+        self.assertContains(response, "?cursor=")
+        self.assertNotContains(response, "utm_source")  # the next link was built without it
+        self.client.get(reverse("brand_list") + "?x=1")
+        self.client.get(reverse("brand_list") + "?x=2")
+        self.assertEqual(caching.stats()["brand_list"]["miss"], 1)
+
+
+# ---- conditional GETs ----------------------------------------------------------
+
+class ConditionalGetTests(TestCase):
+    """Detail pages answer 304 until something on them changes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.brand = Brand.objects.create(name="Acme", slug="acme")
+        cls.agency = Agency.objects.create(name="Wieden", slug="wieden")
+        cls.ad = Ad.objects.create(title="Big Spot", brand=cls.brand, agency=cls.agency,
+                                   youtube_url="https://youtu.be/dQw4w9WgXcQ")
+        cls.user = User.objects.create(username="viewer")
+
+    def revalidate(self, url, etag):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def assert_fresh_until(self, url, change):
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.revalidate(url, first["ETag"]).status_code, 304)
+        change()
+        self.assertEqual(self.revalidate(url, first["ETag"]).status_code, 200)
+
+    def test_ad_detail(self):
+        self.assert_fresh_until(reverse("ad_detail", args=[self.ad.pk]),
+                                lambda: Review.objects.create(ad=self.ad, user=self.user, rating=4))
+
+    def test_ad_detail_tags_and_credits(self):
+        url = reverse("ad_detail", args=[self.ad.pk])
+        self.assert_fresh_until(url, lambda: self.ad.tags_m2m.add(Tag.objects.create(name="funny", slug="funny")))
+        person = Person.objects.create(name="Jo")
+        self.assert_fresh_until(url, lambda: Credit.objects.create(ad=self.ad, person=person, role="CD"))
+        self.assert_fresh_until(url, lambda: Credit.objects.filter(ad=self.ad).delete())
+
+    def test_brand_and_agency_detail(self):
+        self.assert_fresh_until(reverse("brand_detail", args=[self.brand.slug]),
+                                lambda: Ad.objects.create(title="Another", brand=self.brand,
+                                                          youtube_url="https://youtu.be/aaaaaaaaaaa"))
+        renamed = lambda: Brand.objects.get(pk=self.brand.pk).save()  # noqa: E731 - its name shows on agency pages
+        self.assert_fresh_until(reverse("agency_detail", args=[self.agency.slug]), renamed)
+
+    def test_ad_detail_similar_ads(self):
+        Ad.objects.create(title="Sibling", brand=self.brand, youtube_url="https://youtu.be/bbbbbbbbbbb")
+        self.assert_fresh_until(reverse("ad_detail", args=[self.ad.pk]), similar.build)
+
+    def test_profile_public(self):
+        url = reverse("profile_public", args=[self.user.username])
+        review = Review.objects.create(ad=self.ad, user=self.user, rating=4)
+        self.assert_fresh_until(url, lambda: Review.objects.get(pk=review.pk).save())
+        # the reviewed ad's title, year and brand name show in the review list
+        self.assert_fresh_until(url, lambda: Ad.objects.get(pk=self.ad.pk).save())
+        self.assert_fresh_until(url, lambda: Brand.objects.get(pk=self.brand.pk).save())
+        other = Brand.objects.create(name="Other", slug="other")
+        self.assert_fresh_until(url, lambda: bulk.reassign([self.ad.pk], brand_id=other.pk))
+        self.assert_fresh_until(url, review.delete)
+
+    def test_etag_depends_on_viewer(self):
+        url = reverse("ad_detail", args=[self.ad.pk])
+        etag = self.client.get(url)["ETag"]
+        self.client.force_login(self.user)
+        self.assertEqual(self.revalidate(url, etag).status_code, 200)
+
+    def test_seed_fixture_loads(self):
+        # raw fixture rows carry no updated_at: the column's database default fills it
+        out = StringIO()
+        call_command("loaddata", str(settings.BASE_DIR / "seed.json"), stdout=out)
+        self.assertIn("Installed 43 object(s)", out.getvalue())
+        self.assertFalse(Ad.objects.filter(updated_at=None).exists())
+
+
+# ---- /api/v1/ ------------------------------------------------------------------
+
+class ApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.brand = Brand.objects.create(name="Acme", slug="acme")
+        cls.agency = Agency.objects.create(name="Wieden", slug="wieden")
+        tags = [Tag.objects.create(name=f"tag {i}", slug=f"tag-{i}") for i in range(3)]
+        people = [Person.objects.create(name=f"Person {i}") for i in range(3)]
+        cls.ads = []
+        for i in range(12):
+            ad = Ad.objects.create(title=f"Spot {i}", brand=cls.brand, agency=cls.agency if i % 2 else None,
+                                   year=2000 + i % 4, youtube_url=f"https://youtu.be/{i:011d}")
+            ad.tags_m2m.set(tags)
+            for person in people:
+                Credit.objects.create(ad=ad, person=person, role="CD", company=cls.agency)
+            cls.ads.append(ad)
+        cls.user = User.objects.create(username="critic")
+        Review.objects.create(ad=cls.ads[0], user=cls.user, rating=5, body="great")
+
+    def get(self, url, status=200):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status, response.content)
+        return response.json()
+
+    def test_page_cost_does_not_grow_with_page_size(self):
+        url = "/api/v1/ads/?include=brand,agency,credits.person,credits.company&page_size="
+        for size in (1, 12):
+            with self.assertNumQueries(3):  # ads (+ brand, agency), tags, credits (+ person, company)
+                results = self.get(url + str(size))["results"]
+            self.assertEqual(len(results), size)
+        credit = results[0]["credits"][0]
+        self.assertEqual((credit["person"]["name"], credit["company"]["slug"]), ("Person 0", "wieden"))
+
+    def test_sparse_fields(self):
+        results = self.get("/api/v1/ads/?fields=title,brand.name,tags&include=brand")["results"]
+        self.assertEqual(results[0], {"title": results[0]["title"], "brand": {"name": "Acme"},
+                                      "tags": ["tag 0", "tag 1", "tag 2"]})
+        with self.assertNumQueries(1):  # no tag prefetch, no join
+            self.get("/api/v1/ads/?fields=id,brand")
+
+    def test_unknown_names_are_rejected(self):
+        self.assertIn("fields", self.get("/api/v1/ads/?fields=nope", 400))
+        self.assertIn("include", self.get("/api/v1/ads/?include=credits.nope", 400))
+        self.assertIn("fields", self.get("/api/v1/ads/?fields=title.x", 400))
+
+    def test_cursor_walks_every_ad_once(self):
+        seen, url = [], "/api/v1/ads/?fields=id&page_size=5"
+        while url:
+            data = self.get(url)
+            seen += [row["id"] for row in data["results"]]
+            url = data["next"]
+        self.assertEqual(sorted(seen), sorted(ad.pk for ad in self.ads))
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_detail_and_filters(self):
+        self.assertEqual(self.get("/api/v1/brands/acme/")["num_ads"], 12)
+        self.assertEqual(len(self.get("/api/v1/ads/?agency=wieden&page_size=50")["results"]), 6)
+        reviews = self.get("/api/v1/reviews/?user=critic&include=ad&fields=rating,ad.title")["results"]
+        self.assertEqual(reviews, [{"rating": 5, "ad": {"title": "Spot 0"}}])
+
+    def test_batch(self):
+        a, b = self.ads[3], self.ads[7]
+        data = self.client.post(
+            "/api/v1/ads/batch/?fields=id", {"ids": [b.pk, 999999], "youtube_ids": [f"https://youtu.be/{a.youtube_id}", "nope"]},
+            content_type="application/json").json()
+        self.assertEqual(data["results"], [{"id": b.pk}, {"id": a.pk}])
+        self.assertEqual(data["missing"], {"ids": ["999999"], "youtube_ids": ["nope"]})
+        with self.assertNumQueries(1):
+            data = self.get(f"/api/v1/ads/batch/?fields=id&ids={a.pk},{b.pk},{a.pk}")
+        self.assertEqual(data["results"], [{"id": a.pk}, {"id": b.pk}])
+        ids = ",".join(["1"] * 201)
+        self.get(f"/api/v1/ads/batch/?ids={ids}", 400)
+        self.get("/api/v1/ads/batch/?ids=%C2%B2", 400)
+        for url in ("/api/v1/ads/?year=%C2%B2", "/api/v1/credits/?ad=%C2%B2", "/api/v1/reviews/?ad=%C2%B2"):
+            self.get(url)  # not a number: the filter is ignored
+        for body in ({"ids": 5}, {"youtube_ids": {"a": 1}}, {"ids": [1, "x"]}, {"ids": "²"}):
+            response = self.client.post("/api/v1/ads/batch/", body, content_type="application/json")
+            self.assertEqual(response.status_code, 400, body)
+
+
+# ---- background tasks ------------------------------------------------------------
+
+class ReviewTaskTests(TestCase):
+    """Review counters are reconciled by core.tasks after commit (eagerly in tests)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.brand = Brand.objects.create(name="Acme", slug="acme")
+        cls.ads = [Ad.objects.create(title=f"Spot {i}", brand=cls.brand, youtube_url=f"https://youtu.be/{i:011d}")
+                   for i in range(2)]
+        cls.user = User.objects.create(username="critic")
+
+    def setUp(self):
+        cache.clear()
+
+    def counters(self, obj):
+        obj.refresh_from_db()
+        return obj.rating_sum, obj.rating_count
+
+    def test_counters_follow_on_commit(self):
+        a, b = self.ads
+        with self.captureOnCommitCallbacks(execute=True):
+            review = Review.objects.create(ad=a, user=self.user, rating=4)
+            self.assertEqual(self.counters(a), (0, 0))  # not yet: queued until commit
+        self.assertEqual((self.counters(a), self.counters(self.brand)), ((4, 1), (4, 1)))
+        with self.captureOnCommitCallbacks(execute=True):
+            review.ad, review.rating = b, 2
+            review.save()
+        self.assertEqual((self.counters(a), self.counters(b), self.counters(self.brand)), ((0, 0), (2, 1), (2, 1)))
+        with self.captureOnCommitCallbacks(execute=True):
+            review.delete()
+        self.assertEqual((self.counters(b), self.counters(self.brand)), ((0, 0), (0, 0)))
+
+    def test_reconcile_is_idempotent(self):
+        ad = self.ads[0]
+        Review.objects.bulk_create([Review(ad=ad, user=self.user, rating=5)])  # no signals
+        self.assertEqual(tasks.reconcile_ads.delay([ad.pk]).get(), 1)
+        self.assertEqual(tasks.reconcile_ads.delay([ad.pk]).get(), 0)
+        self.assertEqual((self.counters(ad), self.counters(self.brand)), ((5, 1), (5, 1)))
+
+    def test_database_errors_are_retried_and_timed(self):
+        ad = self.ads[0]
+        Review.objects.bulk_create([Review(ad=ad, user=self.user, rating=3)])
+        calls = []
+
+        def flaky(pk):
+            calls.append(pk)
+            if len(calls) == 1:
+                raise OperationalError("database is locked")
+            return reconcile_ad(pk)
+
+        with mock.patch.object(tasks, "reconcile_ad", flaky):
+            tasks.reconcile_ads.apply(([ad.pk],), throw=False)  # as a worker runs it: retried, not raised
+        self.assertEqual(self.counters(ad), (3, 1))
+        stats = tasks.stats()[tasks.reconcile_ads.name]
+        self.assertEqual((stats["retries"], stats["failures"]), (1, 0))
+        self.assertGreaterEqual(stats["runs"], 2)
+
+
+# ---- bulk admin operations -------------------------------------------------------
+
+class BulkOperationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.acme = Brand.objects.create(name="Acme", slug="acme")
+        cls.other = Brand.objects.create(name="Other", slug="other")
+        cls.ads = Ad.objects.bulk_create(
+            Ad(title=f"Spot {i}", brand=cls.acme, youtube_url=f"https://youtu.be/{i:011d}", youtube_id=f"{i:011d}")
+            for i in range(30))
+        rebuild_counters()
+        cls.tag = Tag.objects.create(name="funny", slug="funny")
+        cls.admin = User.objects.create(username="boss", is_staff=True, is_superuser=True)
+
+    def ids(self, ads):
+        return [ad.pk for ad in ads]
+
+    def test_tagging_costs_the_same_for_any_selection(self):
+        self.ads[0].tags_m2m.add(self.tag)
+        # savepoint, already tagged, insert, years, facet row, facet update per year, stamp, release
+        with self.assertNumQueries(8):
+            self.assertEqual(bulk.apply_tag(self.ids(self.ads[:3]), self.tag.pk), 2)
+        with self.assertNumQueries(8):
+            self.assertEqual(bulk.apply_tag(self.ids(self.ads), self.tag.pk), 27)
+        self.assertEqual(self.tag.ads.count(), 30)
+        self.assertEqual(bulk.remove_tag(self.ids(self.ads[:10]), self.tag.pk), 10)
+        self.assertEqual(self.tag.ads.count(), 20)
+
+    def test_reassign_keeps_counters(self):
+        bulk.reassign(self.ids(self.ads[:12]), brand_id=self.other.pk)
+        self.acme.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((self.acme.num_ads, self.other.num_ads), (18, 12))
+
+    def test_merge_people_drops_clashing_credits(self):
+        keep, dup, dup2 = (Person.objects.create(name=n) for n in ("Jo Bloggs", "Joe Bloggs", "J. Bloggs"))
+        a, b = self.ads[:2]
+        Credit.objects.create(ad=a, person=keep, role="CD")
+        Credit.objects.create(ad=a, person=dup, role="CD")   # same credit twice
+        Credit.objects.create(ad=b, person=dup, role="DIR")
+        Credit.objects.create(ad=b, person=dup2, role="DIR")  # and again between duplicates
+        Credit.objects.create(ad=b, person=dup2, role="CW")
+        bulk.merge(Person, keep, [keep, dup, dup2])
+        self.assertFalse(Person.objects.filter(pk__in=[dup.pk, dup2.pk]).exists())
+        self.assertEqual(sorted(Credit.objects.filter(person=keep).values_list("ad_id", "role")),
+                         sorted([(a.pk, "CD"), (b.pk, "DIR"), (b.pk, "CW")]))
+
+    def test_merge_tags_and_brands(self):
+        dup = Tag.objects.create(name="Funny!", slug="funny-2")
+        self.ads[0].tags_m2m.add(self.tag, dup)
+        self.ads[1].tags_m2m.add(dup)
+        bulk.merge(Tag, self.tag, [dup])
+        self.assertEqual(sorted(self.tag.ads.values_list("pk", flat=True)), self.ids(self.ads[:2]))
+        bulk.merge(Brand, self.other, [self.acme])
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.num_ads, 30)
+        self.assertFalse(Brand.objects.filter(pk=self.acme.pk).exists())
+
+    @override_settings(ADMIN_BULK_INLINE_LIMIT=10)
+    def test_large_selections_run_as_a_job(self):
+        self.client.force_login(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("admin:core_ad_changelist"), {
+                "action": "apply_tag", "tag": "funny", "_selected_action": self.ids(self.ads)}, follow=True)
+        job = BulkJob.objects.get()
+        self.assertContains(response, f"bulk job #{job.pk}")
+        self.assertEqual((job.status, job.done, job.total), ("done", 30, 30))
+        self.assertEqual(self.tag.ads.count(), 30)
+
+
+# ---- legacy tag text backfill ----------------------------------------------------------
+
+class LegacyTagBackfillTests(TestCase):
+    def setUp(self):
+        brand = Brand.objects.create(name="Acme", slug="acme")
+        self.funny = Tag.objects.create(name="funny", slug="funny")
+        self.ads = [
+            Ad.objects.create(title=f"Spot {i}", brand=brand, youtube_url=f"https://youtu.be/{i:011d}", tags=tags)
+            for i, tags in enumerate(["funny, Cars", "Cars,,cars , funny", "", "Pets", "funny"])
+        ]
+        self.ads[0].tags_m2m.add(self.funny)  # already linked: left alone
+
+    def backfill(self, **opts):
+        out = StringIO()
+        call_command("backfill_legacy_tags", throttle=0, batch_size=2, stdout=out, **opts)
+        return out.getvalue()
+
+    def tag_names(self, ad):
+        return sorted(ad.tags_m2m.values_list("name", flat=True))
+
+    def test_backfill_links_the_text_tags_once(self):
+        self.assertIn("4 ads scanned, 5 links missing", self.backfill(dry_run=True))
+        self.assertFalse(Tag.objects.filter(name="Cars").exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            out = self.backfill()
+        self.assertIn("4 ads scanned, 5 links added to 4 ads, 2 tags created", out)
+        self.assertIn("legacy column can go", out)
+        self.assertEqual([self.tag_names(ad) for ad in self.ads],
+                         [["Cars", "funny"], ["Cars", "funny"], [], ["Pets"], ["funny"]])
+        self.assertEqual(get_search_backend().search(Ad.objects.all(), "pets").count(), 1)
+        self.assertEqual({(f.tag_id, f.year): f.num_ads for f in TagFacet.objects.exclude(num_ads=0)},
+                         dict(facets.links()))
+
+        self.assertIn("0 links added", self.backfill())
+        self.assertIn("2 ads scanned, 0 links missing", self.backfill(dry_run=True, after=self.ads[2].pk))
+
+
+# ---- tag facets --------------------------------------------------------------------
+
+class TagFacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        brand = Brand.objects.create(name="Acme", slug="acme")
+        cls.ads = [
+            Ad.objects.create(title=f"Spot {i}", brand=brand, year=year, youtube_url=f"https://youtu.be/{i:011d}")
+            for i, year in enumerate([2001, 2001, 2002, None])
+        ]
+        cls.funny, cls.cars = Tag.objects.create(name="funny", slug="funny"), Tag.objects.create(name="cars", slug="cars")
+
+    def assertFacets(self, expected):
+        stored = {(f.tag_id, f.year): f.num_ads for f in TagFacet.objects.exclude(num_ads=0)}
+        self.assertEqual(stored, dict(facets.links()))  # matches the links
+        self.assertEqual(stored, expected)
+
+    def test_facets_follow_every_kind_of_tag_change(self):
+        a, b, c, d = self.ads
+        f, k = self.funny.pk, self.cars.pk
+        a.tags_m2m.add(self.funny, self.cars)
+        self.funny.ads.add(b, c, d)
+        self.assertFacets({(f, 2001): 2, (f, 2002): 1, (f, 0): 1, (k, 2001): 1})
+
+        a.tags_m2m.remove(self.funny, self.funny)
+        self.funny.ads.remove(a, b)  # a no longer has it: not counted twice
+        self.assertFacets({(f, 2002): 1, (f, 0): 1, (k, 2001): 1})
+
+        c = Ad.objects.get(pk=c.pk)
+        c.year = 2001
+        c.save()
+        self.assertFacets({(f, 2001): 1, (f, 0): 1, (k, 2001): 1})
+
+        d.delete()
+        self.cars.ads.clear()
+        self.assertFacets({(f, 2001): 1})
+
+        bulk.apply_tag([a.pk, b.pk, c.pk], k)
+        bulk.remove_tag([c.pk], f)
+        self.assertFacets({(k, 2001): 3})
+
+    def test_stale_and_deferred_years(self):
+        a, b = self.ads[:2]
+        f, k = self.funny.pk, self.cars.pk
+        Ad.objects.filter(pk=a.pk).update(year=2010)  # a.year is stale from here on
+        a.tags_m2m.add(self.funny)
+        a.tags_m2m.set([self.cars])
+        self.assertFacets({(k, 2010): 1})
+
+        b.tags_m2m.add(self.funny)
+        deferred = Ad.objects.only("title").get(pk=b.pk)
+        deferred.year = 2005
+        deferred.save()
+        self.assertFacets({(k, 2010): 1, (f, 2005): 1})
+        deferred.year = 1999
+        deferred.save(update_fields=["title"])  # the year isn't written
+        self.assertFacets({(k, 2010): 1, (f, 2005): 1})
+
+    def test_random_mix_of_changes(self):
+        rng = random.Random(18)
+        tags = [self.funny, self.cars] + [Tag.objects.create(name=f"t{i}", slug=f"t{i}") for i in range(3)]
+        for step in range(120):
+            ad, tag = rng.choice(self.ads), rng.choice(tags)
+            stale = Ad.objects.get(pk=ad.pk) if rng.random() < 0.5 else ad
+            op = rng.randrange(8)
+            if op == 0:
+                stale.tags_m2m.add(*rng.sample(tags, 2))
+            elif op == 1:
+                stale.tags_m2m.remove(tag)
+            elif op == 2:
+                stale.tags_m2m.set(rng.sample(tags, rng.randrange(4)))
+            elif op == 3:
+                tag.ads.add(*rng.sample(self.ads, 2))
+            elif op == 4:
+                tag.ads.remove(ad) if rng.random() < 0.7 else tag.ads.clear()
+            elif op == 5:
+                edited = Ad.objects.only("title").get(pk=ad.pk) if rng.random() < 0.5 else stale
+                edited.year = rng.choice([2001, 2002, 2003, None])
+                edited.save()
+            elif op == 6:
+                bulk.apply_tag([a.pk for a in rng.sample(self.ads, 2)], tag.pk)
+            else:
+                bulk.remove_tag([a.pk for a in rng.sample(self.ads, 2)], tag.pk)
+            stored = {(t.tag_id, t.year): t.num_ads for t in TagFacet.objects.exclude(num_ads=0)}
+            self.assertEqual(stored, dict(facets.links()), f"step {step}, op {op}")
+
+    def test_search_shows_counts(self):
+        for ad in self.ads:
+            ad.tags_m2m.add(self.funny)
+        self.ads[0].tags_m2m.add(self.cars)
+        html = self.client.get(reverse("search")).content.decode()
+        self.assertIn("funny (4)", html)
+        self.assertIn("cars (1)", html)
+        html = self.client.get(reverse("search"), {"tag": "cars"}).content.decode()
+        self.assertIn("funny (1)", html)
+        self.assertIn('year=2001">2001 <span class="meta">1</span>', html)  # year facet of the tag
+
+
+# ---- YouTube ids -------------------------------------------------------------------
+
+class YoutubeIdTests(TestCase):
+    IDS = ["dQw4w9WgXcQ", "a-b_c-d_e-f", "00000000001", "ZZZZZZZZZZZ"]
+    ACCEPTED = [
+        "{id}", " {id}\n",
+        "https://www.youtube.com/watch?v={id}", "http://youtube.com/watch?v={id}", "youtube.com/watch?v={id}",
+        "www.youtube.com/watch?v={id}", "//www.youtube.com/watch?v={id}", "HTTPS://WWW.YOUTUBE.COM/watch?v={id}",
+        "https://www.youtube.com/watch?v={id}&t=42s", "https://www.youtube.com/watch?feature=share&v={id}",
+        "https://www.youtube.com/watch?app=desktop&feature=x&v={id}&list=PL123", "https://www.youtube.com/watch?v={id}#t=30",
+        "https://www.youtube.com/watch/?v={id}",
+        "https://m.youtube.com/watch?v={id}", "https://music.youtube.com/watch?v={id}&list=RDAMVM{id}",
+        "https://youtu.be/{id}", "youtu.be/{id}", "https://youtu.be/{id}?si=Xb3kq0w9fA2", "https://youtu.be/{id}?t=10",
+        "https://youtu.be/{id}/", "https://www.youtube.com/embed/{id}", "https://www.youtube.com/embed/{id}?autoplay=1",
+        "https://www.youtube-nocookie.com/embed/{id}?rel=0", "https://www.youtube.com/v/{id}", "https://www.youtube.com/e/{id}",
+        "https://www.youtube.com/shorts/{id}", "https://youtube.com/shorts/{id}?feature=share",
+        "https://www.youtube.com/live/{id}", "https://m.youtube.com/live/{id}?feature=share",
+    ]
+    REJECTED = [
+        "", "   ", "dQw4w9WgXc", "dQw4w9WgXcQQ", "dQw4w9WgX!Q", "https://youtu.be/", "https://youtu.be/dQw4w9WgXc",
+        "https://youtu.be/dQw4w9WgXcQQ", "https://www.youtube.com/", "https://www.youtube.com/watch",
+        "https://www.youtube.com/watch?vv=dQw4w9WgXcQ", "https://www.youtube.com/watch?list=PL1&xv=dQw4w9WgXcQ",
+        "https://www.youtube.com/watch?list=PL1#v=dQw4w9WgXcQ", "https://www.youtube.com/channel/UCdQw4w9WgXcQ",
+        "https://www.youtube.com/@acme", "https://www.youtube.com/playlist?list=PLdQw4w9WgXcQ",
+        "https://vimeo.com/123456789", "https://notyoutube.com/watch?v=dQw4w9WgXcQ",
+        "https://youtube.com.evil.example/watch?v=dQw4w9WgXcQ", "https://evil.example/?u=youtube.com/watch?v=dQw4w9WgXcQ",
+        "https://www.youtube.com/embed/dQw4w9WgXcQQ",
+    ]
+
+    def test_accepted_shapes(self):
+        for shape in self.ACCEPTED:
+            for yt_id in self.IDS:
+                with self.subTest(shape=shape, id=yt_id):
+                    self.assertEqual(extract_youtube_id(shape.format(id=yt_id)), yt_id)
+
+    def test_rejected(self):
+        for value in self.REJECTED:
+            with self.subTest(value=value):
+                self.assertIsNone(extract_youtube_id(value))
+
+    def test_batch_matches_single(self):
+        values = [shape.format(id=i) for shape in self.ACCEPTED for i in self.IDS] + self.REJECTED
+        values += values[::-1]
+        self.assertEqual(extract_youtube_ids(values), [extract_youtube_id(v) for v in values])
+        self.assertEqual(extract_youtube_ids(iter(["x", "youtu.be/dQw4w9WgXcQ"])), [None, "dQw4w9WgXcQ"])
+
+
+# ---- duplicate videos ----------------------------------------------------------------
+
+class DuplicateVideoTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.brand = Brand.objects.create(name="Acme", slug="acme")
+        cls.ad = Ad.objects.create(title="Spot", brand=cls.brand, youtube_url="https://youtu.be/dQw4w9WgXcQ")
+        cls.admin = User.objects.create(username="boss", is_staff=True, is_superuser=True)
+
+    def test_save_reports_duplicates_from_the_unique_index(self):
+        with self.assertRaises(ValidationError) as ctx:
+            Ad(title="Copy", brand=self.brand, youtube_url="https://www.youtube.com/watch?v=dQw4w9WgXcQ").save()
+        self.assertEqual(ctx.exception.message_dict, {"youtube_url": ["This YouTube video is already in Holograms."]})
+
+    def test_transaction_survives_a_caught_duplicate(self):
+        with transaction.atomic(), CaptureQueriesContext(connection) as queries:
+            with self.assertRaises(ValidationError):
+                Ad(title="Copy", brand=self.brand, youtube_url="https://youtu.be/dQw4w9WgXcQ").save()
+            Ad.objects.create(title="Other", brand=self.brand, youtube_url="https://youtu.be/aaaaaaaaaaa")
+        self.assertTrue(any(q["sql"].startswith("ROLLBACK TO SAVEPOINT") for q in queries))
+        self.assertEqual(Ad.objects.count(), 2)
+
+    def test_other_integrity_errors_are_not_reported_as_duplicates(self):
+        error = IntegrityError("UNIQUE constraint failed: core_ad.youtube_id")  # the text is not trusted
+        with mock.patch("django.db.models.Model.save", side_effect=error), self.assertRaises(IntegrityError):
+            Ad(title="New", brand=self.brand, youtube_url="https://youtu.be/aaaaaaaaaaa").save()
+
+    def test_admin_change_to_a_taken_video(self):
+        other = Ad.objects.create(title="Other", brand=self.brand, youtube_url="https://youtu.be/aaaaaaaaaaa")
+        self.client.force_login(self.admin)
+        data = {"title": "Renamed", "brand": self.brand.pk, "youtube_url": "https://youtu.be/dQw4w9WgXcQ",
+                **{f"credits-{k}": v for k, v in (("TOTAL_FORMS", 0), ("INITIAL_FORMS", 0))}}
+        response = self.client.post(reverse("admin:core_ad_change", args=[other.pk]), data)
+        self.assertContains(response, "This YouTube video is already in Holograms.")
+        self.assertEqual(response.context["original"], other)
+        other.refresh_from_db()
+        self.assertEqual((other.title, other.youtube_id), ("Other", "aaaaaaaaaaa"))
+
+    def test_admin_add_without_a_duplicate_query(self):
+        self.client.force_login(self.admin)
+        data = {"title": "New", "brand": self.brand.pk, "youtube_url": "https://youtu.be/dQw4w9WgXcQ",
+                **{f"credits-{k}": v for k, v in (("TOTAL_FORMS", 0), ("INITIAL_FORMS", 0))}}
+        with mock.patch.object(AdAdminForm, "full_clean", autospec=True, side_effect=AdAdminForm.full_clean) as clean:
+            response = self.client.post(reverse("admin:core_ad_add"), data)
+        self.assertContains(response, "This YouTube video is already in Holograms.")
+        self.assertEqual(clean.call_count, 1)  # the error went onto the form that was saved
+        self.assertEqual(Ad.objects.count(), 1)
+
+        data["youtube_url"] = "https://m.youtube.com/watch?v=a-b_c-d_e-f"
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse("admin:core_ad_add"), data)
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse([q for q in ctx.captured_queries
+                          if q["sql"].startswith("SELECT") and "youtube_id" in q["sql"].split("FROM")[-1]])
+        self.assertTrue(Ad.objects.filter(youtube_id="a-b_c-d_e-f").exists())
+
+    def test_clean_batch_uses_one_query(self):
+        ads = [
+            Ad(title="A", brand=self.brand, youtube_url="https://youtu.be/00000000001"),
+            Ad.objects.get(pk=self.ad.pk),                                                   # itself: fine
+            Ad(title="B", brand=self.brand, youtube_url="https://youtu.be/dQw4w9WgXcQ"),      # taken
+            Ad(title="C", brand=self.brand, youtube_url="https://vimeo.com/1"),               # invalid
+            Ad(title="D", brand=self.brand, youtube_url="00000000001"),                      # repeat of A
+            Ad(title="E", brand=self.brand, youtube_url="https://youtu.be/00000000002", year=1800),
+            Ad(title="F", brand=self.brand, youtube_url="https://youtu.be/00000000003"),
+        ]
+        Ad.objects.create(title="F0", brand=self.brand, youtube_url="https://youtu.be/00000000003")  # stored
+        with self.assertNumQueries(1):
+            errors = Ad.clean_batch(ads)
+        self.assertEqual({i: list(e.message_dict) for i, e in errors.items()},
+                         {2: ["youtube_url"], 3: ["youtube_url"], 4: ["youtube_url"], 5: ["year"], 6: ["youtube_url"]})
+        self.assertEqual(ads[0].youtube_url, "https://www.youtube.com/watch?v=00000000001")
+
+
+class CollaborationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.brand = Brand.objects.create(name="Acme", slug="acme")
+        cls.ann, cls.bob, cls.cat = (Person.objects.create(name=n) for n in ("Ann", "Bob", "Cat"))
+        cls.ad1 = Ad.objects.create(title="One", brand=cls.brand, year=2019, youtube_url="https://youtu.be/00000000001")
+        cls.ad2 = Ad.objects.create(title="Two", brand=cls.brand, year=2021, youtube_url="https://youtu.be/00000000002")
+
+    def edges(self):
+        return {(c.person_id, c.other_id): (c.shared_ads, c.last_year) for c in Collaboration.objects.all()}
+
+    def assertMatchesRebuild(self):
+        kept = self.edges()
+        collaborations.rebuild()
+        self.assertEqual(kept, self.edges())
+
+    def test_credits_count_each_shared_ad_once(self):
+        Credit.objects.create(ad=self.ad1, person=self.ann, role="CD")
+        Credit.objects.create(ad=self.ad1, person=self.bob, role="CW")
+        Credit.objects.create(ad=self.ad1, person=self.bob, role="AD")  # second role, same ad
+        Credit.objects.create(ad=self.ad2, person=self.ann, role="CD")
+        Credit.objects.create(ad=self.ad2, person=self.bob, role="CW")
+        self.assertEqual(self.edges(), {(self.ann.pk, self.bob.pk): (2, 2021), (self.bob.pk, self.ann.pk): (2, 2021)})
+        self.assertMatchesRebuild()
+
+    def test_moves_deletes_and_year_edits(self):
+        for ad in (self.ad1, self.ad2):
+            for p in (self.ann, self.bob, self.cat):
+                Credit.objects.create(ad=ad, person=p, role="CD")
+        moved = Credit.objects.get(ad=self.ad2, person=self.cat)
+        moved.person = Person.objects.create(name="Dee")
+        moved.save()
+        self.assertEqual(self.edges()[(self.ann.pk, self.cat.pk)], (1, 2019))
+        self.assertMatchesRebuild()
+
+        Credit.objects.filter(ad=self.ad1, person__in=[self.bob, self.cat]).delete()  # one batch
+        self.assertEqual(self.edges()[(self.ann.pk, self.bob.pk)], (1, 2021))
+        self.assertNotIn((self.ann.pk, self.cat.pk), self.edges())
+        self.assertMatchesRebuild()
+
+        self.ad2.year = 2005
+        self.ad2.save()
+        self.assertEqual(self.edges()[(self.bob.pk, self.ann.pk)], (1, 2005))
+        self.ad2.delete()
+        self.assertEqual(self.edges(), {})
+
+    def test_person_merge(self):
+        Credit.objects.create(ad=self.ad1, person=self.ann, role="CD")
+        Credit.objects.create(ad=self.ad1, person=self.bob, role="CW")
+        Credit.objects.create(ad=self.ad2, person=self.cat, role="CW")
+        Credit.objects.create(ad=self.ad2, person=self.ann, role="CD")
+        bulk.merge(Person, self.bob, [self.cat])
+        self.assertEqual(self.edges()[(self.ann.pk, self.bob.pk)], (2, 2021))
+        self.assertMatchesRebuild()
+
+    def test_person_pages(self):
+        Credit.objects.create(ad=self.ad1, person=self.ann, role="CD")
+        Credit.objects.create(ad=self.ad2, person=self.ann, role="CW")
+        Credit.objects.create(ad=self.ad2, person=self.bob, role="CW")
+        response = self.client.get(reverse("person_list"))
+        self.assertContains(response, "2 credits")
+        response = self.client.get(self.ann.get_absolute_url())
+        self.assertEqual([c.ad.title for c in response.context["page"].object_list], ["Two", "One"])
+        self.assertContains(response, self.bob.get_absolute_url())
+        response = self.client.get(self.ann.get_absolute_url() + "?role=CW")
+        self.assertEqual([c.ad.title for c in response.context["page"].object_list], ["Two"])
+        self.assertEqual(response.context["page"].total, 1)
+
+
+class SimilarAdTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        acme, other = Brand.objects.create(name="Acme", slug="acme"), Brand.objects.create(name="Other", slug="other")
+        funny, cars = Tag.objects.create(name="funny", slug="funny"), Tag.objects.create(name="cars", slug="cars")
+        cls.ads = [Ad.objects.create(title=f"Spot {i}", brand=b, year=2020, youtube_url=f"https://youtu.be/0000000000{i}")
+                   for i, b in enumerate([acme, acme, acme, other])]
+        cls.ads[0].tags_m2m.add(funny, cars)
+        cls.ads[1].tags_m2m.add(funny, cars)
+        cls.ads[2].tags_m2m.add(funny)
+
+    def test_build_ranks_by_shared_features(self):
+        similar.build(k=2, max_df=3)
+        ranked = list(SimilarAd.objects.filter(ad=self.ads[0]).order_by("rank").values_list("other_id", flat=True))
+        self.assertEqual(ranked, [self.ads[1].pk, self.ads[2].pk])
+        # only the year (on all 4 ads, so not walked) links the last ad to the others
+        self.assertFalse(SimilarAd.objects.filter(ad=self.ads[3]).exists())
+
+    def test_common_features_are_left_out_of_the_dot_product(self):
+        vectors = similar.Vectors(similar.features())
+        walked, skipped = vectors.nearest(0, 2, max_df=10), vectors.nearest(0, 2, max_df=3)  # the year is on 4 ads
+        self.assertEqual([j for _, j in skipped], [j for _, j in walked])
+        self.assertTrue(all(a < b for (a, _), (b, _) in zip(skipped, walked)))
+
+    def test_unchanged_lists_are_not_rewritten(self):
+        similar.build(k=2)
+        stamps = dict(Ad.objects.values_list("pk", "updated_at"))
+        with self.assertNumQueries(6):  # pks, 4 feature reads, stored lists; nothing to write
+            similar.build(k=2)
+        self.assertEqual(dict(Ad.objects.values_list("pk", "updated_at")), stamps)
+
+    def test_rebuild_replaces_rows_and_detail_reads_them(self):
+        similar.build(k=2)
+        similar.build(k=1)
+        self.assertEqual(SimilarAd.objects.filter(ad=self.ads[0]).count(), 1)
+        response = self.client.get(self.ads[0].get_absolute_url())
+        self.assertContains(response, "Similar ads")
+        self.assertContains(response, self.ads[1].get_absolute_url())
+
+
+class FeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        liked, panned = Brand.objects.create(name="Liked", slug="liked"), Brand.objects.create(name="Panned", slug="panned")
+        cls.user = User.objects.create(username="viewer")
+        cls.seen = [Ad.objects.create(title=f"Seen {i}", brand=b, youtube_url=f"https://youtu.be/0000000000{i}")
+                    for i, b in enumerate([liked, panned])]
+        cls.fresh = [Ad.objects.create(title=f"Fresh {i}", brand=b, youtube_url=f"https://youtu.be/0000000001{i}")
+                     for i, b in enumerate([liked, panned])]
+        with cls.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(ad=cls.seen[0], user=cls.user, rating=5)
+            Review.objects.create(ad=cls.seen[1], user=cls.user, rating=0)
+
+    def test_refresh_ranks_unseen_ads_of_liked_features(self):
+        self.assertEqual(feed.refresh(self.user.pk), 1)
+        self.assertEqual(list(self.user.feed.values_list("ad_id", "rank")), [(self.fresh[0].pk, 1)])
+
+    def test_review_submit_refreshes_and_feed_is_one_read(self):
+        self.client.force_login(self.user)
+        feed.refresh(self.user.pk)
+        self.assertContains(self.client.get(reverse("feed")), "Fresh 0")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("review_submit", args=[self.fresh[0].pk]), {"rating": "4"})
+        self.assertFalse(FeedItem.objects.filter(user=self.user).exists())  # now reviewed
+        with self.assertNumQueries(3):  # session, user, feed
+            response = self.client.get(reverse("feed"))
+        self.assertContains(response, "Review a few ads")
+
+    @mock.patch.object(feed, "HISTORY", 3)
+    def test_review_submit_folds_the_review_in(self):
+        liked = self.seen[0].brand
+        Ad.objects.create(title="Fresh 2", brand=liked, youtube_url="https://youtu.be/00000000020")
+        feed.refresh(self.user.pk)
+        self.client.force_login(self.user)
+
+        def incremental_matches_refresh():
+            taste = FeedTaste.objects.get(user=self.user)
+            folded = (taste.weights, taste.ratings, set(self.user.feed.values_list("ad_id", flat=True)))
+            feed.refresh(self.user.pk)
+            taste.refresh_from_db()
+            self.assertEqual(folded[1:], (taste.ratings, set(self.user.feed.values_list("ad_id", flat=True))))
+            self.assertEqual(folded[0].keys(), taste.weights.keys())
+            for key, weight in taste.weights.items():
+                self.assertAlmostEqual(folded[0][key], weight)
+
+        # new, re-rated, new and pushing the oldest out of the window, re-rated beyond the window
+        for ad, rating in [(self.fresh[1], 4), (self.fresh[1], 1), (self.fresh[0], 5), (self.seen[0], 2)]:
+            with self.subTest(ad=ad.title, rating=rating), \
+                    mock.patch.object(feed, "refresh", side_effect=AssertionError("not incremental")), \
+                    self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse("review_submit", args=[ad.pk]), {"rating": rating})
+            incremental_matches_refresh()
+
+        review = Review.objects.get(user=self.user, ad=self.seen[0])
+        before = FeedTaste.objects.get(user=self.user).weights
+        tasks.update_feed(review.pk)  # redelivered: already counted
+        self.assertEqual(FeedTaste.objects.get(user=self.user).weights, before)
+
+
+class FakeRedis:
+    """The commands RedisBoards uses, in memory; like redis-py, members and values come back as bytes."""
+
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def zadd(self, key, mapping):
+        self.data.setdefault(key, {}).update({str(m).encode(): float(s) for m, s in mapping.items()})
+
+    def zrem(self, key, *members):
+        zset = self.data.get(key, {})
+        for m in members:
+            zset.pop(str(m).encode(), None)
+        if not zset:
+            self.data.pop(key, None)
+
+    def zrevrange(self, key, start, end, withscores=False):
+        ranked = sorted(self.data.get(key, {}).items(), key=lambda item: (item[1], item[0]), reverse=True)
+        ranked = ranked[start:None if end == -1 else end + 1]
+        return ranked if withscores else [m for m, _ in ranked]
+
+    def smembers(self, key):
+        return set(self.data.get(key, ()))
+
+    def sadd(self, key, *values):
+        self.data.setdefault(key, set()).update(str(v).encode() for v in values)
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value):
+        self.data[key] = str(value).encode()
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key.decode() if isinstance(key, bytes) else key, None)
+
+    def scan_iter(self, match, count=None):
+        return [key.encode() for key in list(self.data) if fnmatch.fnmatchcase(key, match)]
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client, self.calls = client, []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+    def execute(self):
+        return [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+
+class LeaderboardTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.acme, cls.other = Brand.objects.create(name="Acme", slug="acme"), Brand.objects.create(name="Other", slug="other")
+        cls.tag = Tag.objects.create(name="funny", slug="funny")
+        cls.ads = [Ad.objects.create(title=f"Spot {i}", brand=cls.acme, year=2020, youtube_url=f"https://youtu.be/0000000000{i}")
+                   for i in range(3)]
+        cls.ads[0].tags_m2m.add(cls.tag)
+        cls.users = [User.objects.create(username=f"fan{i}") for i in range(6)]
+
+    def review(self, ad, users, rating=5, hours_ago=0):
+        with self.captureOnCommitCallbacks(execute=True):  # counters and boards follow in a task
+            for user in users:
+                r = Review.objects.create(ad=ad, user=user, rating=rating)
+                Review.objects.filter(pk=r.pk).update(created_at=timezone.now() - timedelta(hours=hours_ago))
+
+    def board(self, board, scope="all", window="24h"):
+        return [pk for pk, _ in leaderboards.get_backend().top(leaderboards.key(board, scope, window), 10)]
+
+    def test_trending_windows_and_roll(self):
+        self.review(self.ads[0], self.users[:2], hours_ago=30)
+        self.review(self.ads[1], self.users[:1])
+        self.assertEqual(self.board("trending"), [self.ads[1].pk])
+        self.assertEqual(self.board("trending", window="7d"), [self.ads[0].pk, self.ads[1].pk])
+        self.assertEqual(self.board("trending", f"tag:{self.tag.pk}", "7d"), [self.ads[0].pk])
+
+        now = leaderboards.hour()
+        leaderboards.get_backend().set_meta("rolled", now)
+        self.assertEqual(leaderboards.roll(now + 24), 1)  # the review of ads[1] left the 24h window
+        self.assertEqual(self.board("trending"), [])
+        self.assertEqual(self.board("trending", window="7d"), [self.ads[0].pk, self.ads[1].pk])
+
+    def test_roll_runs_on_a_schedule_not_in_requests(self):
+        scheduled = {entry["task"] for entry in settings.CELERY_BEAT_SCHEDULE.values()}
+        self.assertIn(tasks.roll_leaderboards.name, scheduled)
+        with mock.patch.object(tasks.roll_leaderboards, "delay") as delay:
+            leaderboards.top("trending")  # eager tasks: would run inline
+            delay.assert_not_called()
+            with override_settings(CELERY_TASK_ALWAYS_EAGER=False):
+                leaderboards.top("trending")
+                leaderboards.top("trending", "year:2020")
+            delay.assert_called_once_with()  # fallback for a missed beat, once an hour
+
+        call_command("roll_leaderboards", stdout=StringIO())
+        self.assertEqual(leaderboards.get_backend().get_meta("rolled"), leaderboards.hour())
+
+    def test_top_rated_needs_min_count_and_shrinks_to_the_mean(self):
+        self.review(self.ads[0], self.users[:5], rating=4)
+        self.review(self.ads[1], self.users[:4], rating=5)  # one review short
+        self.review(self.ads[2], self.users[:6], rating=1)
+        self.assertEqual(self.board("rated"), [self.ads[0].pk, self.ads[2].pk])
+        places = LeaderboardEntry.objects.exclude(key__startswith="meta:").values_list("key", "member")
+        entries = set(places)
+        leaderboards.rebuild()  # also re-fixes the mean, so only places are compared
+        self.assertEqual(set(places), entries)
+        self.assertEqual(self.board("rated"), [self.ads[0].pk, self.ads[2].pk])
+
+    def test_moved_and_deleted_ads_leave_their_boards(self):
+        fake = FakeRedis()
+        backends = {
+            "database": override_settings(LEADERBOARD_REDIS_URL=""),
+            "redis": override_settings(LEADERBOARD_REDIS_URL="redis://boards"),
+        }
+        for name, settings_override in backends.items():
+            ad = Ad.objects.create(title=f"Moving {name}", brand=self.acme, year=2020,
+                                   youtube_url=f"https://youtu.be/{name[:5]}000001")
+            ad.tags_m2m.add(self.tag)
+            with self.subTest(backend=name), settings_override, \
+                    mock.patch.object(leaderboards, "_redis", return_value=fake):
+                self.review(ad, self.users[:1])
+                self.assertEqual(f"lb:ad:{ad.pk}" in fake.data, name == "redis")
+                self.assertEqual(self.board("trending", f"brand:{self.acme.pk}"), [ad.pk])
+                self.assertEqual(self.board("trending", "year:2020"), [ad.pk])
+
+                with self.captureOnCommitCallbacks(execute=True):
+                    ad.brand, ad.year = self.other, 2021
+                    ad.save()
+                self.assertEqual(self.board("trending", f"brand:{self.acme.pk}"), [])
+                self.assertEqual(self.board("trending", "year:2020"), [])
+                self.assertEqual(self.board("trending", f"brand:{self.other.pk}"), [ad.pk])
+
+                ad.tags_m2m.clear()
+                leaderboards.refresh([ad.pk])
+                self.assertEqual(self.board("trending", f"tag:{self.tag.pk}"), [])
+
+                with self.captureOnCommitCallbacks(execute=True):
+                    ad.delete()
+                self.assertEqual(self.board("trending"), [])
+                self.assertEqual(self.board("trending", f"brand:{self.other.pk}"), [])
+        self.assertEqual([key for key in fake.data if not key.startswith("lb:meta:")], [])
+
+    def test_view_drops_ads_that_left_the_scope(self):
+        self.review(self.ads[0], self.users[:1])
+        self.review(self.ads[1], self.users[:2])
+        Ad.objects.filter(pk=self.ads[1].pk).update(brand=self.other)  # no signals: still on the Acme board
+        with self.assertNumQueries(3):  # brand, board, ads
+            response = self.client.get(reverse("leaderboard") + "?brand=acme")
+        self.assertEqual([ad for ad, _ in response.context["rows"]], [self.ads[0]])
+
+
+class ProfileStatsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.brand = Brand.objects.create(name="Acme", slug="acme")
+        cls.tag = Tag.objects.create(name="funny", slug="funny")
+        cls.ads = [Ad.objects.create(title=f"Spot {i}", brand=cls.brand, youtube_url=f"https://youtu.be/0000000000{i}")
+                   for i in range(3)]
+        cls.ads[0].tags_m2m.add(cls.tag)
+        cls.user = User.objects.create(username="critic")
+
+    def stats(self):
+        p = UserProfile.objects.get(user=self.user)
+        return p.rating_count, p.rating_sum, [getattr(p, f) for f in UserProfile.HISTOGRAM], p.top_tags, p.top_brands
+
+    def test_review_writes_keep_stats_exact(self):
+        first = Review.objects.create(ad=self.ads[0], user=self.user, rating=5)
+        Review.objects.create(ad=self.ads[1], user=self.user, rating=3)
+        self.assertEqual(self.stats(), (2, 8, [0, 0, 0, 1, 0, 1], [{"name": "funny", "slug": "funny", "n": 1}],
+                                        [{"name": "Acme", "slug": "acme", "n": 2}]))
+        first = Review.objects.get(pk=first.pk)
+        first.rating = 1
+        first.save()
+        self.assertEqual(self.stats()[:3], (2, 4, [0, 1, 0, 1, 0, 0]))
+        first.delete()
+        self.assertEqual(self.stats(), (1, 3, [0, 0, 0, 1, 0, 0], [], [{"name": "Acme", "slug": "acme", "n": 1}]))
+        self.ads[1].delete()
+        self.assertEqual(self.stats(), (0, 0, [0] * 6, [], []))
+
+    def test_public_profile_reads_stats_and_reconcile_fixes_drift(self):
+        for ad, rating in zip(self.ads, (5, 4, 4)):
+            Review.objects.create(ad=ad, user=self.user, rating=rating)
+        expected = self.stats()
+        UserProfile.objects.filter(user=self.user).update(rating_count=0, ratings_4=9, top_tags=[])
+        out = StringIO()
+        call_command("reconcile_profile_stats", stdout=out)
+        self.assertIn("1 fixed", out.getvalue())
+        self.assertEqual(self.stats(), expected)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("profile_public", args=["critic"]))
+        self.assertContains(response, "3 reviews")
+        self.assertContains(response, "?tag=funny")
+        self.assertFalse([q for q in ctx.captured_queries if re.search(r"\b(COUNT|SUM|AVG)\(", q["sql"])])
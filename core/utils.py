@@ -1,19 +1,56 @@
+"""
+YouTube video id normalisation.
+
+One precompiled pattern covers every URL shape we accept, with or without
+scheme and ``www.``/``m.``/``music.`` prefix:
+
+    <id>                              bare 11-character id
+    youtu.be/<id>[?si=..&t=..]
+    youtube.com/watch?[..&]v=<id>[&..]
+    youtube.com/{embed,v,e,shorts,live}/<id>
+    youtube-nocookie.com/embed/<id>
+
+Anything else -- channels, playlists, other hosts, ids of the wrong length --
+gives None. ``extract_youtube_id`` is memoised (forms and model validation see
+the same values repeatedly); ``extract_youtube_ids`` is for batches of mostly
+distinct values (imports), which would only churn the memo.
+``manage.py youtube_id_benchmark`` times both.
+"""
 import re
-from urllib.parse import urlparse, parse_qs
+from functools import lru_cache
+
+_ID = r"[A-Za-z0-9_-]{11}"
+_ID_RE = re.compile(_ID)
+_URL_RE = re.compile(rf"""
+    (?:https?:)?(?://)?
+    (?:(?:www|m|music)\.)?
+    (?:
+        youtu\.be/(?P<short>{_ID})
+      | youtube(?:-nocookie)?\.com/
+        (?:
+            (?:embed|v|e|shorts|live)/(?P<path>{_ID})
+          | watch/?\?(?:[^#]*?&)?v=(?P<query>{_ID})
+        )
+    )
+    (?![A-Za-z0-9_-])
+""", re.VERBOSE | re.IGNORECASE)
 
-_YT_ID_RE = re.compile(r"^[a-zA-Z0-9_-]{11}$")
 
+def _extract(value) -> str | None:
+    value = (value or "").strip()
+    if len(value) == 11 and _ID_RE.fullmatch(value):
+        return value
+    m = _URL_RE.match(value)
+    return m and (m["short"] or m["path"] or m["query"])
+
+
+@lru_cache(maxsize=4096)
 def extract_youtube_id(url: str) -> str | None:
-    # Accept full URLs or bare IDs
-    if _YT_ID_RE.match(url):
-        return url
-    u = urlparse(url)
-    if u.netloc.endswith(("youtube.com", "youtu.be")):
-        if u.netloc.endswith("youtu.be"):
-            return u.path.strip("/").split("/")[0] or None
-        if u.path == "/watch":
-            return parse_qs(u.query).get("v", [None])[0]
-        # e.g. /embed/<id> or /shorts/<id>
-        parts = [p for p in u.path.split("/") if p]
-        return parts[-1] if parts else None
-    return None
\ No newline at end of file
+    """The video id in a YouTube URL, or a bare id; None when there is none."""
+    return _extract(url)
+
+
+def extract_youtube_ids(values) -> list[str | None]:
+    """``extract_youtube_id`` over ``values``, in order; repeats within the batch are parsed once."""
+    seen = {}
+    return [seen[v] if v in seen else seen.setdefault(v, _extract(v)) for v in values]
@@ -1,49 +1,84 @@
+import math
+from urllib.parse import urlencode
+
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.db.models import Avg, Count, Prefetch, Q
-from django.http import HttpResponseForbidden
+from django.db.models import Count, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+from django.http import Http404, HttpResponseForbidden
 from django.shortcuts import get_object_or_404, redirect, render
 from .forms import ReviewForm, UserCreationForm, UserProfileForm
-from .models import Ad, Review, Brand, Agency, Tag
+from .models import Ad, Credit, Review, Brand, Agency, Tag, Person, ROLE_CHOICES
+from . import leaderboards, tasks
+from .caching import cached_fragment
+from .facets import SAMPLE as FACET_SAMPLE, search_facets as tag_facets
+from .freshness import ad_state, agency_state, brand_state, conditional_page, profile_state
+from .search import get_backend as get_search_backend
 from django.contrib.auth import login, get_user_model
 from django.contrib.auth.models import User
-from django.core.paginator import Paginator
+from .pagination import paginate
 
 User = get_user_model()
 
 def ad_list(request):
-    qs = (Ad.objects
-          .select_related("brand", "agency")
-          .annotate(avg_rating=Avg("reviews__rating"), num_reviews=Count("reviews"))
-          .order_by("-year", "title")[:50])
-    return render(request, "ads/list.html", {"ads": qs})
+    listing = cached_fragment(
+        request, "ad_list", ("ads", "brands", "agencies", "tags"), "ads/_grid.html",
+        lambda request: {"ads": (Ad.objects
+                                 .select_related("brand", "agency")
+                                 .prefetch_related("tags_m2m")
+                                 .order_by("-year", "title")[:50])},
+    )
+    return render(request, "ads/list.html", {"listing": listing})
 
+REVIEWS_PER_PAGE = 20
+TAG_CLOUD_SIZE = 30
+
+@conditional_page(ad_state)
 def ad_detail(request, pk: int):
+    # one query per relation, whatever the number of tags, credits or reviews
     ad = get_object_or_404(
-        Ad.objects.select_related("brand", "agency")
-        .annotate(avg_rating=Avg("reviews__rating"), num_reviews=Count("reviews")),
+        Ad.objects.select_related("brand", "agency").prefetch_related(
+            Prefetch("tags_m2m", queryset=Tag.objects.order_by("name")),
+            Prefetch("credits", queryset=Credit.objects.select_related("person", "company")),
+        ),
         pk=pk,
     )
+    reviews = (ad.reviews.select_related("user")
+               .order_by("-created_at", "id"))  # Review(ad, -created_at, id) index
+    page = paginate(request, reviews, REVIEWS_PER_PAGE, total=ad.rating_count)
     user_review = None
     if request.user.is_authenticated:
         user_review = Review.objects.filter(ad=ad, user=request.user).first()
     form = ReviewForm(instance=user_review)
-    return render(request, "ads/detail.html", {"ad": ad, "form": form, "user_review": user_review})
+    # computed offline by core.similar; one range of the (ad, rank) index
+    similar = ad.similar.select_related("other", "other__brand").order_by("rank")
+    return render(request, "ads/detail.html", {
+        "ad": ad, "form": form, "user_review": user_review, "page": page, "similar": similar,
+    })
 
 @login_required
 def review_submit(request, pk):
-    ad = get_object_or_404(Ad, pk=pk)
+    # only the review row is written here; counters follow in core.tasks
+    if not Ad.objects.filter(pk=pk).exists():
+        raise Http404("No such ad.")
     rating = int(request.POST.get("rating", 0))
     body = (request.POST.get("body") or "").strip()
     if rating < 0 or rating > 5:
         messages.error(request, "Rating must be 0–5.")
-        return redirect(ad.get_absolute_url())
-    Review.objects.update_or_create(
-        ad=ad, user=request.user,
+        return redirect("ad_detail", pk=pk)
+    review, _ = Review.objects.update_or_create(
+        ad_id=pk, user=request.user,
         defaults={"rating": rating, "body": body},
     )
+    tasks.update_feed.delay_on_commit(review.pk)
     messages.success(request, "Review saved.")
-    return redirect(ad.get_absolute_url())
+    return redirect("ad_detail", pk=pk)
+
+@login_required
+def feed(request):
+    # precomputed by core.feed; one range of the (user, rank) index
+    items = request.user.feed.select_related("ad", "ad__brand", "ad__agency").order_by("rank")
+    return render(request, "accounts/feed.html", {"items": items})
 
 @login_required
 def profile_edit(request):
@@ -68,77 +103,125 @@ def signup(request):
         form = UserCreationForm()
     return render(request, "registration/signup.html", {"form": form})
 
+@conditional_page(profile_state)
 def profile_public(request, username):
-    user = get_object_or_404(User, username=username)
+    user = get_object_or_404(User.objects.select_related("profile"), username=username)
     profile = getattr(user, "profile", None)
 
     reviews_qs = (user.reviews   # related_name="reviews" on Review.user
                   .select_related("ad", "ad__brand")
-                  .order_by("-created_at"))
-
-    paginator = Paginator(reviews_qs, 10)  # 10 per page
-    page = paginator.get_page(request.GET.get("page"))
+                  .order_by("-created_at", "id"))  # Review(user, -created_at, id) index
 
-    stats = {
-        "num_reviews": reviews_qs.count(),
-    }
+    # count, average, histogram and top lists are stored on the profile (core.counters)
+    page = paginate(request, reviews_qs, 10, total=profile.rating_count if profile else 0)  # 10 per page
 
     return render(request, "accounts/profile_public.html", {
         "profile_user": user,
         "profile": profile,
         "page": page,
-        "stats": stats,
     })
 
 def brand_list(request):
-    brands = (
-        Brand.objects
-        .annotate(num_ads=Count("ads", distinct=True),
-                  avg_rating=Avg("ads__reviews__rating"))
-        .order_by("name")
+    listing = cached_fragment(
+        request, "brand_list", ("brands",), "brands/_grid.html",
+        lambda request: {"brands": Brand.objects.order_by("name")},  # counters are stored on the row
     )
-    return render(request, "brands/list.html", {"brands": brands})
+    return render(request, "brands/list.html", {"listing": listing})
 
+@conditional_page(brand_state)
 def brand_detail(request, slug: str):
-    brand = get_object_or_404(
-        Brand.objects.annotate(
-            num_ads=Count("ads", distinct=True),
-            avg_rating=Avg("ads__reviews__rating"),
-        ),
-        slug=slug,
-    )
+    brand = get_object_or_404(Brand, slug=slug)
     qs = (Ad.objects.filter(brand=brand)
           .select_related("brand", "agency")
-          .annotate(avg_rating=Avg("reviews__rating"))
           .order_by("-year", "title"))
-    page = Paginator(qs, 24).get_page(request.GET.get("page"))
-    return render(request, "brands/detail.html", {"brand": brand, "page": page})
+    listing = cached_fragment(
+        request, "brand_detail", ("ads", "brands", "agencies"), "brands/_ads.html",
+        lambda request: {"page": paginate(request, qs, 24, total=brand.num_ads)},
+        vary=[brand.pk], params=["cursor"],
+    )
+    return render(request, "brands/detail.html", {"brand": brand, "listing": listing})
 
 
 def agency_list(request):
-    agencies = (
-        Agency.objects
-        .annotate(num_ads=Count("ads", distinct=True),
-                  avg_rating=Avg("ads__reviews__rating"))
-        .order_by("name")
+    listing = cached_fragment(
+        request, "agency_list", ("agencies",), "agencies/_list.html",
+        lambda request: {"agencies": Agency.objects.order_by("name")},  # counters are stored on the row
     )
-    return render(request, "agencies/list.html", {"agencies": agencies})
+    return render(request, "agencies/list.html", {"listing": listing})
 
 
+@conditional_page(agency_state)
 def agency_detail(request, slug: str):
-    agency = get_object_or_404(
-        Agency.objects.annotate(
-            num_ads=Count("ads", distinct=True),
-            avg_rating=Avg("ads__reviews__rating"),
-        ),
-        slug=slug,
-    )
+    agency = get_object_or_404(Agency, slug=slug)
     qs = (Ad.objects.filter(agency=agency)
           .select_related("brand", "agency")
-          .annotate(avg_rating=Avg("reviews__rating"))
           .order_by("-year", "title"))
-    page = Paginator(qs, 24).get_page(request.GET.get("page"))
-    return render(request, "agencies/detail.html", {"agency": agency, "page": page})
+    listing = cached_fragment(
+        request, "agency_detail", ("ads", "brands", "agencies"), "agencies/_ads.html",
+        lambda request: {"page": paginate(request, qs, 24, total=agency.num_ads)},
+        vary=[agency.pk], params=["cursor"],
+    )
+    return render(request, "agencies/detail.html", {"agency": agency, "listing": listing})
+
+def person_list(request):
+    credits = (Credit.objects.filter(person=OuterRef("pk")).order_by()
+               .values("person").annotate(n=Count("pk")).values("n"))
+    qs = Person.objects.annotate(num_credits=Coalesce(Subquery(credits), 0)).order_by("name")
+    return render(request, "people/list.html", {"page": paginate(request, qs, 50)})
+
+
+def person_detail(request, slug: str):
+    person = get_object_or_404(Person, slug=slug)
+    # Credit(person, role) index: one range scan, however many credits
+    roles = dict(Credit.objects.filter(person=person).order_by()
+                 .values_list("role").annotate(n=Count("pk")))
+    role = request.GET.get("role")
+    credits = (Credit.objects.filter(person=person)
+               .select_related("ad", "ad__brand", "company")
+               .order_by("-ad__year", "ad__title"))
+    if role in roles:
+        credits = credits.filter(role=role)
+        total = roles[role]
+    else:
+        role, total = None, sum(roles.values())
+    # precomputed by core.collaborations, read off the (person, -shared_ads) index
+    collaborators = (person.collaborations.select_related("other")
+                     .order_by("-shared_ads", "other__name")[:12])
+    return render(request, "people/detail.html", {
+        "person": person,
+        "roles": [(code, label, roles[code]) for code, label in ROLE_CHOICES if code in roles],
+        "role": role,
+        "page": paginate(request, credits, 24, total=total),
+        "collaborators": collaborators,
+    })
+
+
+def leaderboard(request):
+    board = "rated" if request.GET.get("board") == "rated" else "trending"
+    window = request.GET.get("window")
+    if window not in leaderboards.WINDOWS:
+        window = "24h"
+    scope, label, only = "all", None, {}
+    for name, model in (("tag", Tag), ("brand", Brand), ("agency", Agency)):
+        slug = request.GET.get(name)
+        if slug:
+            obj = get_object_or_404(model, slug=slug)
+            scope, label, only = f"{name}:{obj.pk}", obj.name, {"tags_m2m" if name == "tag" else name: obj}
+            break
+    else:
+        year = request.GET.get("year", "")
+        if year.isascii() and year.isdigit():
+            scope, label, only = f"year:{year}", year, {"year": int(year)}
+    ranked = leaderboards.top(board, scope, window)
+    # also drops ads that have left the scope since they were ranked
+    ads = Ad.objects.filter(pk__in=[pk for pk, _ in ranked], **only).select_related("brand", "agency").in_bulk()
+    return render(request, "ads/leaderboard.html", {
+        "board": board, "window": window, "windows": list(leaderboards.WINDOWS), "label": label,
+        "scope_query": urlencode({k: v for k, v in request.GET.items() if k in ("tag", "brand", "agency", "year")}),
+        "rows": [(ads[pk], score) for pk, score in ranked if pk in ads],
+        "min_count": leaderboards.MIN_COUNT,
+    })
+
 
 def search(request):
     q = (request.GET.get("q") or "").strip()
@@ -148,12 +231,21 @@ def search(request):
           .prefetch_related("tags_m2m")
           .order_by("-year","title"))
     if q:
-        qs = qs.filter(Q(title__icontains=q) | Q(brand__name__icontains=q) | Q(agency__name__icontains=q))
+        qs = get_search_backend().search(qs, q)  # ordered by relevance
     if tag:
         qs = qs.filter(tags_m2m__slug=tag)
-    if year.isdigit():
+    if year.isascii() and year.isdigit():
         qs = qs.filter(year=int(year))
-    page = Paginator(qs.distinct(), 24).get_page(request.GET.get("page"))
+    page = paginate(request, qs, 24, estimate_cap=1000)
+    counts, years, partial = tag_facets(qs, q, tag, int(year) if year.isascii() and year.isdigit() else None)
+    tags = list(Tag.objects.order_by("name"))
+    for t in tags:
+        t.num_ads = counts.get(t.pk, 0)
+    cloud = sorted((t for t in tags if t.num_ads), key=lambda t: -t.num_ads)[:TAG_CLOUD_SIZE]
+    for t in cloud:  # 0.9em .. 1.5em on a log scale
+        t.size = f"{0.9 + 0.6 * math.log1p(t.num_ads) / math.log1p(cloud[0].num_ads):.2f}em"
     return render(request, "search/results.html", {
-        "page": page, "q": q, "tag": tag, "year": year, "tags": Tag.objects.order_by("name"),
+        "page": page, "q": q, "tag": tag, "year": year, "tags": tags,
+        "cloud": sorted(cloud, key=lambda t: t.name), "years": years, "facets_partial": partial,
+        "facet_sample": FACET_SAMPLE,
     })
\ No newline at end of file